@@ -12,32 +12,29 @@ min_supported_LIS_version="4.3.0"
 def RunTest(command):
     UpdateState("TestStarted")
     hvModules=["hv_storvsc", "hv_netvsc", "hv_vmbus", "hv_utils", "hid_hyperv", ]
-    configPath="/boot/config-$(uname -r)"
+    kernelRelease = GetSystemFacts().KernelRelease()
+    configPath="/boot/config-" + kernelRelease
     if (DetectDistro()[0] == 'clear-linux-os'):
-        configPath="/usr/lib/kernel/config-$(uname -r)"
+        configPath="/usr/lib/kernel/config-" + kernelRelease
 
-    output = Run('grep CONFIG_HYPERV_STORAGE=y ' + configPath)
-    if output:
+    kernelConfig = ReadFile(configPath)
+    if 'CONFIG_HYPERV_STORAGE=y' in kernelConfig:
         hvModules.remove("hv_storvsc")
 
-    output = Run('grep CONFIG_HYPERV_NET=y ' + configPath)
-    if output:
+    if 'CONFIG_HYPERV_NET=y' in kernelConfig:
         hvModules.remove("hv_netvsc")
 
-    output = Run('grep CONFIG_HYPERV=y ' + configPath)
-    if output:
+    if 'CONFIG_HYPERV=y' in kernelConfig:
         hvModules.remove("hv_vmbus")
 
-    output = Run('grep CONFIG_HYPERV_UTILS=y ' + configPath)
-    if output:
+    if 'CONFIG_HYPERV_UTILS=y' in kernelConfig:
         hvModules.remove("hv_utils")
 
-    output = Run('grep CONFIG_HID_HYPERV_MOUSE=y ' + configPath)
-    if output:
+    if 'CONFIG_HID_HYPERV_MOUSE=y' in kernelConfig:
         hvModules.remove("hid_hyperv")
 
     [current_distro, distro_version] = DetectDistro()
-    lis_exists=Run("rpm -qa | grep microsoft-hyper-v 2>/dev/null")
+    lis_exists=GetInstalledPackages().Glob("*microsoft-hyper-v*")
 
     if LooseVersion(distro_version) >= LooseVersion(min_supported_distro_version) and lis_exists:
         hvModules.append("pci_hyperv")
@@ -0,0 +1,51 @@
+#!/usr/bin/python
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the Apache License.
+from azuremodules import *
+import argparse
+import json
+
+parser = argparse.ArgumentParser(description='Built-in TCP/UDP latency probe, writes a histogram report as JSON')
+parser.add_argument('-s', '--server', action='store_true', help='run the echo server')
+parser.add_argument('-c', '--client', help='server address to probe')
+parser.add_argument('-p', '--port', type=int, default=LATENCY_PORT, help='port of the server')
+parser.add_argument('-m', '--mode', choices=['tcp', 'udp', 'connect'], default='tcp', help='ping-pong, echo or connect time')
+parser.add_argument('-n', '--count', type=int, default=LATENCY_COUNT, help='round trips to measure')
+parser.add_argument('-t', '--time', type=int, help='seconds to run (client, stops before count) or to serve (server)')
+parser.add_argument('-l', '--length', type=int, default=LATENCY_MESSAGE_SIZE, help='message size in bytes')
+parser.add_argument('-i', '--interval', type=float, default=0, help='seconds between round trips')
+parser.add_argument('-J', '--json', default=LATENCY_RESULTS_FILE, help='report file')
+args = parser.parse_args()
+
+
+def RunServer():
+    server = LatencyEchoServer(args.port)
+    server.Start()
+    print("listening on port %s" % server.port)
+    sys.stdout.flush()
+    try:
+        time.sleep(args.time or 3600)
+    except KeyboardInterrupt:
+        pass
+    server.Stop()
+
+
+def RunClient():
+    UpdateState("TestRunning")
+    report = RunLatencyProbe(args.client, args.port, mode=args.mode, count=args.count, duration=args.time,
+                             messageSize=args.length, interval=args.interval)
+    report.Save(args.json)
+    print(json.dumps(report.ToDict()['percentilesUs'], sort_keys=True))
+    if report.Succeeded():
+        ResultLog.info('PASS')
+    else:
+        RunLog.error("Latency probe failed : %s", report.errors)
+        ResultLog.error('FAIL')
+    UpdateState("TestCompleted")
+
+if args.server:
+    RunServer()
+elif args.client:
+    RunClient()
+else:
+    parser.error('either --server or --client is required')
@@ -0,0 +1,59 @@
+#!/usr/bin/python
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the Apache License.
+from azuremodules import *
+import argparse
+import json
+
+parser = argparse.ArgumentParser(description='Built-in TCP/UDP throughput test, writes its report as JSON')
+parser.add_argument('-s', '--server', action='store_true', help='run the receiving side')
+parser.add_argument('-c', '--client', help='server address to send to')
+parser.add_argument('-p', '--port', type=int, default=THROUGHPUT_PORT, help='port of the server')
+parser.add_argument('-u', '--udp', action='store_true', help='UDP instead of TCP')
+parser.add_argument('-P', '--parallel', type=int, default=1, help='number of parallel streams')
+parser.add_argument('-t', '--time', type=int, default=THROUGHPUT_DURATION, help='seconds to send (client) or to listen (server)')
+parser.add_argument('-l', '--length', type=int, help='TCP send size or UDP datagram size in bytes')
+parser.add_argument('-b', '--bandwidth', type=float, default=UDP_BANDWIDTH, help='UDP bits per second per stream, 0 : unpaced')
+parser.add_argument('-i', '--interval', type=float, default=THROUGHPUT_INTERVAL, help='seconds per sample')
+parser.add_argument('--no-zerocopy', action='store_true', help='memoryview sends instead of sendfile')
+parser.add_argument('-J', '--json', default=THROUGHPUT_RESULTS_FILE, help='report file')
+args = parser.parse_args()
+
+
+def RunServer():
+    server = ThroughputServer(args.port, udp=args.udp, bufferSize=args.length or THROUGHPUT_BUFFER_SIZE,
+                              interval=args.interval)
+    server.Start()
+    print("listening on port %s" % server.port)
+    sys.stdout.flush()
+    try:
+        time.sleep(args.time)
+    except KeyboardInterrupt:
+        pass
+    report = server.Stop()
+    report.Save(args.json)
+    RunLog.info("Received %s bytes on %s streams", report.Bytes(), len(report.streams))
+
+
+def RunClient():
+    UpdateState("TestRunning")
+    report = RunThroughputClient(args.client, args.port, streams=args.parallel, duration=args.time, udp=args.udp,
+                                 bufferSize=args.length, bandwidth=args.bandwidth or None, interval=args.interval,
+                                 zeroCopy=not args.no_zerocopy)
+    report.Save(args.json)
+    print(json.dumps({'gbps': report.Gbps(), 'streams': len(report.streams), 'protocol': report.protocol}))
+    if report.Succeeded():
+        ResultLog.info('PASS')
+    else:
+        for stream in report.streams:
+            if stream.error:
+                RunLog.error("Stream %s : %s", stream.streamId, stream.error)
+        ResultLog.error('FAIL')
+    UpdateState("TestCompleted")
+
+if args.server:
+    RunServer()
+elif args.client:
+    RunClient()
+else:
+    parser.error('either --server or --client is required')
@@ -0,0 +1,30 @@
+#!/usr/bin/python
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the Apache License.
+from azuremodules import *
+import argparse
+import shlex
+
+parser = argparse.ArgumentParser(description='Runs the WALA-*/VERIFY-* checks in one process, writes suite-results.json')
+parser.add_argument('checks', nargs='*', help='check script names or glob patterns, default : WALA-*.py VERIFY-*.py')
+parser.add_argument('-w', '--workers', type=int, default=DEFAULT_SUITE_WORKERS, help='checks run concurrently')
+parser.add_argument('-s', '--serial', action='append', default=[], help='additional check to run on its own, after the others')
+parser.add_argument('-a', '--check-args', action='append', default=[], metavar='NAME=ARGS',
+                    help='command line of a check that parses its own arguments, e.g. "VERIFY-VHD-PREREQUISITES=-d UBUNTU"')
+args = parser.parse_args()
+checkArgs = dict((each.split('=', 1)[0], shlex.split(each.split('=', 1)[1])) for each in args.check_args if '=' in each)
+
+
+def RunTest():
+    UpdateState("TestRunning")
+    runner = SuiteRunner(maxWorkers=args.workers, exclusive=SUITE_EXCLUSIVE_CHECKS + args.serial, checkArgs=checkArgs)
+    results = runner.Run(args.checks or None)
+    for result in results:
+        RunLog.info("%s : %s", result.name, result.result)
+    if results and not runner.Failed():
+        ResultLog.info('PASS')
+    else:
+        ResultLog.error('FAIL')
+    UpdateState("TestCompleted")
+
+RunTest()
@@ -3,83 +3,59 @@
 # Licensed under the Apache License.
 from azuremodules import *
 from shutil import copyfile
+import tempfile
 
 white_list_xml = "ignorable-boot-errors.xml"
 wala_white_list_xml = "ignorable-walalog-errors.xml"
 logfile_list = [
     "/var/log/syslog",
-    "/var/log/messages",
-    "/tmp/dmesg"
+    "/var/log/messages"
 ]
 
 
-def _filter_log(keyword):
-    ret = Run("grep -nw '{}.*' {} --ignore-case --no-message".format(
-        keyword, ' '.join(logfile_list))).strip().split('\n')
-    while("" in ret):
-        ret.remove("")
-    return ret
-
-
 def RunTest():
     UpdateState("TestRunning")
-    Run("dmesg > /tmp/dmesg")
+    # a dmesg dump of our own, other checks of the suite may run at the same time
+    fd, dmesg_file = tempfile.mkstemp(prefix='dmesg-')
+    os.close(fd)
+    Run("dmesg > " + dmesg_file)
+    try:
+        ScanLogs(logfile_list + [dmesg_file])
+    finally:
+        os.remove(dmesg_file)
+    UpdateState("TestCompleted")
+    CollectLogs()
+
+
+def ScanLogs(logfile_list):
     RunLog.info(
         "Checking for ERROR/WARNING/FAILURE messages in system logs:{}".format(
             logfile_list))
-    errors = _filter_log('err')
-    warnings = _filter_log('warn')
-    failures = _filter_log('fail')
-    if (not errors and not warnings and not failures):
+    triage = LogTriage()
+    if white_list_xml and os.path.isfile(white_list_xml):
+        RunLog.info(
+            'Checking ignorable boot and wala ERROR/WARNING/FAILURE messages...')
+        triage.AddIgnorableMessagesXml(white_list_xml)
+        triage.AddIgnorableMessagesXml(wala_white_list_xml, allCategories=True)
+    result = triage.Scan(logfile_list)
+    errors = result.hits['errors']
+    warnings = result.hits['warnings']
+    failures = result.hits['failures']
+    if not result.TotalRawHits():
         RunLog.info(
             'Could not find ERROR/WARNING/FAILURE messages in system log files.')
         ResultLog.info('PASS')
+    elif (errors or warnings or failures):
+        RunLog.error('Found ERROR/WARNING/FAILURE messages in logs.')
+        if(errors):
+            SplitLog('Errors', errors)
+        if(warnings):
+            SplitLog('warnings', warnings)
+        if(failures):
+            SplitLog('failures', failures)
+        ResultLog.error('FAIL')
     else:
-        if white_list_xml and os.path.isfile(white_list_xml):
-            try:
-                import xml.etree.cElementTree as ET
-            except ImportError:
-                import xml.etree.ElementTree as ET
-
-            white_list_file = ET.parse(white_list_xml)
-            xml_root = white_list_file.getroot()
-
-            wala_white_list_file = ET.parse(wala_white_list_xml)
-            wala_xml_root = wala_white_list_file.getroot()
-
-            RunLog.info(
-                'Checking ignorable boot ERROR/WARNING/FAILURE messages...')
-            for node in xml_root:
-                if (failures and node.tag == "failures"):
-                    failures = RemoveIgnorableMessages(failures, node)
-                if (errors and node.tag == "errors"):
-                    errors = RemoveIgnorableMessages(errors, node)
-                if (warnings and node.tag == "warnings"):
-                    warnings = RemoveIgnorableMessages(warnings, node)
-
-            RunLog.info(
-                'Checking ignorable wala ERROR/WARNING/FAILURE messages...')
-            for node in wala_xml_root:
-                if failures:
-                    failures = RemoveIgnorableMessages(failures, node)
-                if errors:
-                    errors = RemoveIgnorableMessages(errors, node)
-                if warnings:
-                    warnings = RemoveIgnorableMessages(warnings, node)
-
-        if (errors or warnings or failures):
-            RunLog.error('Found ERROR/WARNING/FAILURE messages in logs.')
-            if(errors):
-                SplitLog('Errors', errors)
-            if(warnings):
-                SplitLog('warnings', warnings)
-            if(failures):
-                SplitLog('failures', failures)
-            ResultLog.error('FAIL')
-        else:
-            ResultLog.info('PASS')
-    UpdateState("TestCompleted")
-    CollectLogs()
+        ResultLog.info('PASS')
 
 
 def SplitLog(logType, logValues):
@@ -87,21 +63,6 @@ def SplitLog(logType, logValues):
         RunLog.info(logType + ': ' + logEntry)
 
 
-def RemoveIgnorableMessages(message_list, keywords_xml_node):
-    valid_list = []
-    for msg in message_list:
-        for keywords in keywords_xml_node:
-            if re.findall(keywords.text, msg, re.M):
-                RunLog.info('Ignorable ERROR/WARNING/FAILURE message: ' + msg)
-                break
-        else:
-            valid_list.append(msg)
-    if len(valid_list) > 0:
-        return valid_list
-    else:
-        return None
-
-
 def CollectLogs():
     logfiles = ['/var/log/messages']
     hostname = os.uname()[1]
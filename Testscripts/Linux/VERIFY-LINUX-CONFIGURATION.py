@@ -29,45 +29,51 @@ def IsBashHistFileEmpty(file):
             return False, f.read()
 
 
+@RecordedCheck
 def VerifySSHDConfig():
     global sshd_config_check_result
     RunLog.info("Checking ClientAliveInterval is into the /etc/ssh/sshd_config file")
-    ClientAliveIntervalLines = Run("cat /etc/ssh/sshd_config | grep -i '^ClientAliveInterval' | wc -l | tr -d ' ' | tr -d '\n'")
-    CommentClientAliveIntervalLines = Run("cat /etc/ssh/sshd_config | grep -i '^#ClientAliveInterval' | wc -l | tr -d ' ' | tr -d '\n'")
+    ClientAliveIntervalMatches = GrepFile("/etc/ssh/sshd_config", r'^ClientAliveInterval', re.I)
+    ClientAliveIntervalLines = len(ClientAliveIntervalMatches)
+    CommentClientAliveIntervalLines = len(GrepFile("/etc/ssh/sshd_config", r'^#ClientAliveInterval', re.I))
 
     if (int(CommentClientAliveIntervalLines) != 0):
-        print ("CLIENT_ALIVE_INTERVAL_COMMENTED")
+        ReportMarker("CLIENT_ALIVE_INTERVAL_COMMENTED")
         RunLog.info("Commented ClientAliveInterval found in /etc/ssh/sshd_config and continue to check the expected interval.")
 
     if (int(ClientAliveIntervalLines) != 1 ):
-        print ("CLIENT_ALIVE_INTERVAL_FAIL")
+        ReportMarker("CLIENT_ALIVE_INTERVAL_FAIL")
         RunLog.error('ClientAliveInterval is not into the /etc/ssh/sshd_config file.')
     else:
         RunLog.info("ClientAliveInterval is into in /etc/ssh/sshd_config.")
         RunLog.info("Checking the interval.")
-        ClientAliveIntervalValue = Run("cat /etc/ssh/sshd_config | grep -i '^ClientAliveInterval' | awk '{print $2}'")
+        ClientAliveIntervalValue = ClientAliveIntervalMatches[0].split()[1]
         if (int(ClientAliveIntervalValue) < 181 and int(ClientAliveIntervalValue) > 0):
-            print ("CLIENT_ALIVE_INTERVAL_SUCCESS")
+            ReportMarker("CLIENT_ALIVE_INTERVAL_SUCCESS")
             RunLog.info("ClientAliveInterval " + 'is ' + ClientAliveIntervalValue)
             sshd_config_check_result = True
         else:
-            print ("CLIENT_ALIVE_INTERVAL_FAIL")
+            ReportMarker("CLIENT_ALIVE_INTERVAL_FAIL")
             RunLog.error("ClientAliveInterval is " + ClientAliveIntervalValue + " is not expected.")
+    return sshd_config_check_result
 
 
+@RecordedCheck
 def VerifyRootPassword():
     global root_password_verify_result
     RunLog.info("Checking if root password is deleted or not...")
 
-    passwd_output = Run("cat /etc/shadow | grep root")
+    passwd_output = "\n".join(GrepFile("/etc/shadow", "root"))
     root_passwd = passwd_output.split(":")[1]
     if ('*' in root_passwd or '!' in root_passwd):
         RunLog.info('root password is deleted in /etc/shadow.')
         root_password_verify_result = True
     else:
         RunLog.error('root password not deleted.%s', passwd_output)
+    return root_password_verify_result
 
 
+@RecordedCheck
 def CheckLastConsole(command):
     global last_console_check_result
     RunLog.info("Checking for last console as console=ttys0 in  kernel boot line.")
@@ -77,8 +83,10 @@ def CheckLastConsole(command):
         last_console_check_result = True
     else:
         RunLog.error('console=ttys0 is not present in kernel boot line as a last console.')
+    return last_console_check_result
 
 
+@RecordedCheck
 def VerifyBashHistory():
     global bash_history_verify_result
     if os.path.exists(root_bash_hist_file_default):
@@ -97,6 +105,7 @@ def VerifyBashHistory():
     else:
         RunLog.error("Not empty, non-expected.")
         RunLog.info("Content:\n%s" % hist_file_content)
+    return bash_history_verify_result
 
 
 def RunTest():
@@ -2,7 +2,6 @@
 # Copyright (c) Microsoft Corporation. All rights reserved.
 # Licensed under the Apache License.
 from azuremodules import *
-import os.path
 import re
 
 swap_check_result = False
@@ -11,19 +10,28 @@ mtab_entry_check_result = False
 verify_UUID_result = False
 
 
-def CheckSwap(command):
+@RecordedCheck
+def CollectProbes():
+    # The checks are independent of each other, gather all their inputs in one parallel phase first.
+    commands = {
+        "swapon": "swapon -s",
+        "lsblk": "lsblk",
+        "dmesg": "dmesg 2>&1",
+        "blkid": "blkid 2>&1"
+    }
+    results = RunMany(commands)
+    probes = dict((name, result.stdout) for name, result in results.items())
+    probes["mtab"] = ReadFile("/etc/mtab")
+    probes["fstab"] = ReadFile("/etc/fstab")
+    probes["root_device_timeout"] = ReadFile("/sys/block/sda/device/timeout")
+    return probes
+
+
+@RecordedCheck
+def CheckSwap(output, lsblkOutput):
     global swap_check_result
     RunLog.info("Checking if swap disk is enable or not..")
-    RunLog.info("Executing swapon -s..")
-    temp = Run(command)
-    lsblkOutput = Run("lsblk")
-    output = temp
-    if os.path.exists("/etc/lsb-release") and int(Run("cat /etc/lsb-release | grep -i coreos | wc -l")) > 0:
-        waagent_conf_file = "/usr/share/oem/waagent.conf"
-    elif (DetectDistro()[0] == 'clear-linux-os'):
-        waagent_conf_file = "/usr/share/defaults/waagent/waagent.conf"
-    else:
-        waagent_conf_file = "/etc/waagent.conf"
+    waagent_conf_file = GetWalaConfPath()
 
     RunLog.info("Read ResourceDisk.EnableSwap from " + waagent_conf_file + "..")
     outputlist=open(waagent_conf_file)
@@ -54,15 +62,16 @@ def CheckSwap(command):
     elif(((output.find("swap")==-1) or ("SWAP" in lsblkOutput)) and (line.strip().split()[0] == "ResourceDisk.EnableSwap=n")):
         RunLog.info('swap is disabled.')
         swap_check_result = True
+    return swap_check_result
 
 
-def CheckMtabEntry(command):
+@RecordedCheck
+def CheckMtabEntry(output):
     global mtab_entry_check_result
     RunLog.info("Checking for resource disk entry in /etc/mtab start...")
     mountpoint = GetResourceDiskMountPoint()
     RunLog.info('Mount point is %s' % mountpoint)
     osdisk = GetOSDisk()
-    output = Run(command)
     if (osdisk == 'sdb') :
         mntresource = "/dev/sda1 " + mountpoint
     else :
@@ -76,9 +85,11 @@ def CheckMtabEntry(command):
                 RunLog.info("%s", each)
     else:
         RunLog.error('Resource disk entry is not present.')
+    return mtab_entry_check_result
 
 
-def VerifyUUID():
+@RecordedCheck
+def VerifyUUID(dmesg_output, blkid_output, fstab_output):
     global verify_UUID_result
     RunLog.info("Verify UUID start...")
     uuid_from_dmesg = 0
@@ -87,8 +98,7 @@ def VerifyUUID():
     uuid_from_dmesg_root = 0
     uuid_from_blkid_root = 0
     uuid_from_fstab_root = 0
-    output = JustRun("dmesg")
-    output = output.lower()
+    output = dmesg_output.lower()
     filter_condition_dmesg = r'uuid(=|/|-)(.*?)([ \t]|[\.])'
     filter_condition_blkid = r'(label=\"(.*?)\"|)[ \t]uuid=\"(.*?)\"[ \t]'
     filter_condition_fstab = r'uuid(/|=)(\S+)[ \t]+\/(.*?)[ \t]+(.*?)[ \t]'
@@ -112,8 +122,7 @@ def VerifyUUID():
         if matchObj:
            uuid_from_dmesg_root = matchObj.groups()
 
-    output = JustRun("blkid")
-    output = output.lower()
+    output = blkid_output.lower()
 
     outputlist = re.split("\n", output)
 
@@ -134,7 +143,7 @@ def VerifyUUID():
 
     uuid_from_fstab = 0
     fstab_dev_count = 0
-    fstab_dev_count = output = JustRun("cat /etc/fstab")
+    output = fstab_output
     fstab_dev_count = output.count('/dev/sd')
 
     outputlist = re.split("\n", output)
@@ -187,12 +196,13 @@ def VerifyUUID():
             RunLog.info('Found disks mounted without using UUID in /etc/fstab.')
 
         RunLog.info("Verify UUID failed.")
+    return verify_UUID_result
 
 
-def CheckRootDeviceTimeout(command):
+@RecordedCheck
+def CheckRootDeviceTimeout(temp):
     global root_device_timeout_check_result
     RunLog.info("Checking root device timeout start...")
-    temp = Run(command)
     rootDeviceTimeout = 300
     output = int(temp)
     if (output == rootDeviceTimeout) :
@@ -200,14 +210,16 @@ def CheckRootDeviceTimeout(command):
         root_device_timeout_check_result = True
     else:
         RunLog.error('SDA timeout value is %s', output)
+    return root_device_timeout_check_result
 
 
 def RunTest():
     UpdateState("TestRunning")
-    CheckSwap("swapon -s")
-    CheckMtabEntry("cat /etc/mtab")
-    VerifyUUID()
-    CheckRootDeviceTimeout("cat /sys/block/sda/device/timeout")
+    probes = CollectProbes()
+    CheckSwap(probes["swapon"], probes["lsblk"])
+    CheckMtabEntry(probes["mtab"])
+    VerifyUUID(probes["dmesg"], probes["blkid"], probes["fstab"])
+    CheckRootDeviceTimeout(probes["root_device_timeout"])
 
     if (swap_check_result and root_device_timeout_check_result and mtab_entry_check_result and verify_UUID_result):
         ResultLog.info('PASS')
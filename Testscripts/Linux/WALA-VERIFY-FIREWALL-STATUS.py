@@ -18,8 +18,7 @@ EXECUTION_USER = "root"
 WIRESERVER_ENDPOINT_FILE = '/var/lib/waagent/WireServerEndpoint'
 VERSIONS_PATH = '/?comp=versions'
 OS_ENABLE_FIREWALL_RX = r'OS.EnableFirewall\s*=\s*(\S+)'
-AGENT_CONFIG_FILE = Run("find / -name waagent.conf")
-AGENT_CONFIG_FILE = AGENT_CONFIG_FILE.rstrip()
+AGENT_CONFIG_FILE = LocateWalaConf()
 
 
 def is_firewall_enabled():
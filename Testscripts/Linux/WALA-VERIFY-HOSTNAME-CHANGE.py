@@ -12,8 +12,10 @@ constants_path = os.path.join(file_path, "constants.sh")
 params = GetParams(constants_path)
 expectedHostname = params["ROLENAME"]
 MONITOR_ENABLED = r'Provisioning.MonitorHostName\s*=\s*(\S+)'
-AGENT_CONFIG_FILE = Run("find / -name waagent.conf")
-AGENT_CONFIG_FILE = AGENT_CONFIG_FILE.rstrip()
+AGENT_CONFIG_FILE = LocateWalaConf()
+WAAGENT_LOG_FILE = '/var/log/waagent.log'
+FAIL_ERROR_WARN_RX = r'fail|error|warning'
+HOSTNAME_CHANGE_TIMEOUT = 120
 
 
 def is_monitor_hostname_enabled():
@@ -36,7 +38,11 @@ def RunTest(expectedHost):
     if not is_monitor_hostname_enabled():
         RunLog.info("The MonitorHostName is not enabled")
         Run("sed -i s/Provisioning.MonitorHostName=n/Provisioning.MonitorHostName=y/g " + AGENT_CONFIG_FILE)
-        Run("(service waagent restart || systemctl restart waagent || service walinuxagent restart || systemctl restart walinuxagent) > /dev/null 2>&1")
+        if not ServiceController().Restart("waagent"):
+            RunLog.error('waagent did not come back with a new PID after the restart')
+            ResultLog.error('FAIL')
+            UpdateState("TestCompleted")
+            return
 
     if CheckHostName(expectedHost) and ChangeHostName(expectedHost):
         Run("hostname " + expectedHost)
@@ -63,14 +69,16 @@ def CheckHostName(expectedHost):
 def ChangeHostName(expectedHost):
     changed_hostname = get_random_alphaNumeric_string(randint(1, 63))
     RunLog.info("Change hostname into " + changed_hostname)
+    follower = LogFollower(WAAGENT_LOG_FILE)
     Run("hostname " + changed_hostname)
-    fail_error_warn_count = Run("tail -f waagent.log | grep -E 'fail|error|warning' | wc -l")
-    RunLog.info("Start to sleep for 120 seconds.")
-    Run("sleep 120")
     expected_filter_string = "Detected hostname change: {0} -> {1}".format(expectedHost, changed_hostname)
-    matchCount = Run("grep -i '"+expected_filter_string+"' /var/log/waagent.log | wc -l")
-    RunLog.info('Get matchCount {0}'.format(matchCount))
-    if int(matchCount.rstrip()) == 1 and CheckHostName(changed_hostname) and int(fail_error_warn_count.rstrip()) == 0:
+    RunLog.info("Waiting up to {0} seconds for waagent to detect the change.".format(HOSTNAME_CHANGE_TIMEOUT))
+    result = follower.WaitFor(re.escape(expected_filter_string), HOSTNAME_CHANGE_TIMEOUT,
+                              countPatterns=[FAIL_ERROR_WARN_RX], flags=re.IGNORECASE)
+    follower.Close()
+    fail_error_warn_count = result.counts[FAIL_ERROR_WARN_RX]
+    RunLog.info('Detected hostname change: {0}, fail/error/warning lines: {1}'.format(result.found, fail_error_warn_count))
+    if result.found and CheckHostName(changed_hostname) and fail_error_warn_count == 0:
         return True
     else:
         return False
@@ -3,8 +3,6 @@
 # Licensed under the Apache License.
 from azuremodules import *
 
-import re
-
 file_path = os.path.dirname(os.path.realpath(__file__))
 constants_path = os.path.join(file_path, "constants.sh")
 params = GetParams(constants_path)
@@ -34,16 +32,15 @@ def CheckHostName(expectedHost):
 
 def CheckFQDN(expectedHost):
     RunLog.info("Checking fqdn...")
-    [current_distro, distro_version] = DetectDistro()
-    nslookupCmd = "nslookup {0}".format(expectedHost)
-    if current_distro == 'coreos':
-        nslookupCmd = "python nslookup.py -n {0}".format(expectedHost)
-    output = Run(nslookupCmd)
-    if re.search("server can't find", output) is None:
-        RunLog.info('nslookup successfully for: {0}'.format(expectedHost))
+    report = ProbeDns(names=[expectedHost])
+    query = report.Query(expectedHost)
+    if query.Succeeded():
+        RunLog.info('nslookup successfully for: {0} ({1} -> {2}, {3:.1f} ms)'.format(expectedHost, query.queried,
+                                                                                  ', '.join(query.Values()),
+                                                                                  query.latency * 1000))
         return True
     else:
-        RunLog.error("nslookup failed for: {0}, {1}".format(expectedHost, output))
+        RunLog.error("nslookup failed for: {0}, {1}".format(expectedHost, query.ToDict()))
         return False
 
 RunTest(expectedHostname)
@@ -10,7 +10,7 @@ def RunTest():
     RunLog.info('Mount point is %s' % mntresource)
     RunLog.info("creating a file in " + mntresource)
     temp = Run("echo DONE > " + mntresource + "/try.txt")
-    temp = Run("cat " + mntresource + "/try.txt")
+    temp = ReadFile(mntresource + "/try.txt")
     output = temp
     if ("DONE" in output) :
         RunLog.info('file is successfully created in %s folder.' % mntresource)
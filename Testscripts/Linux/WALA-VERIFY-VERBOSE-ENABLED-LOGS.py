@@ -6,7 +6,7 @@ from azuremodules import *
 import argparse
 import os
 import platform
-import time
+import re
 import sys
 
 parser = argparse.ArgumentParser()
@@ -74,15 +74,20 @@ def Restartwaagent():
     else:
         Run("echo '"+passwd+"' | sudo -S sed -i s/Logs.Verbose=n/Logs.Verbose=y/g  /etc/waagent.conf")
     RunLog.info("Restart waagent service...")
-    result = Run("echo '"+passwd+"' | sudo -S find / -name systemctl |wc -l | tr -d '\n'")
-    if (distro[0].upper() == "UBUNTU") or (distro[0].upper() == "DEBIAN"):
-        Run("echo '"+passwd+"' | sudo -S service walinuxagent restart")
-    else:
-        if (result == "0") :
-            os.system("echo '"+passwd+"' | sudo -S service waagent restart")
-        else:
-            os.system("echo '"+passwd+"' | sudo -S systemctl restart waagent")
-    time.sleep(60)
+    follower = LogFollower("/var/log/waagent.log")
+    controller = ServiceController("echo '"+passwd+"' | sudo -S ")
+    if not controller.Restart("waagent", timeout=60):
+        follower.Close()
+        return False
+    # Return as soon as the restarted agent writes verbose logs, within the 60 seconds of the former fixed sleep.
+    follower.WaitFor(r"VERBOSE|iptables -I INPUT -p udp --dport", max(0, 60 - controller.lastStatus.elapsed),
+                     flags=re.IGNORECASE)
+    follower.Close()
+    return True
 
-Restartwaagent()
-RunTest()
+if Restartwaagent():
+    RunTest()
+else:
+    RunLog.error('waagent did not come back with a new PID after the restart')
+    ResultLog.error('FAIL')
+    UpdateState("TestCompleted")
@@ -8,7 +8,9 @@ import os.path
 import re
 import subprocess
 import sys
+import threading
 import time
+from collections import deque
 
 try:
     import commands
@@ -16,13 +18,34 @@ except ImportError:
     import subprocess as commands
 
 py_ver_str = sys.version
-print(sys.version)
+
+#Importing this module does no I/O : the log files below are created (and truncated) on the first record written to
+#them, the results recorder and the command tracer are set up on first use, and everything past the modules it has
+#always imported (json, glob, fnmatch, math, signal, stat, argparse, paramiko, tempfile, random, hashlib, ...) is
+#imported by the functions needing them. threading stays : logging loads it anyway, and the module's locks need it.
+
+
+#Checks running side by side in a SuiteRunner share the two log files : their Runtime.log lines are tagged with the
+#check name, and their verdict lines stay out of Summary.log (they are kept in suite-results.json instead).
+class _SuiteTagFormatter(logging.Formatter):
+    def format(self, record):
+        line = logging.Formatter.format(self, record)
+        suiteCheck = _CurrentSuiteCheck()
+        if suiteCheck is None:
+            return line
+        return '[%s] %s' % (suiteCheck.name, line)
+
+
+class _OutsideSuiteFilter(logging.Filter):
+    def filter(self, record):
+        return _CurrentSuiteCheck() is None
+
 
 #THIS LOG WILL COLLECT ALL THE LOGS THAT ARE RUN WHILE THE TEST IS GOING ON...
 RunLog = logging.getLogger("RuntimeLog : ")
-WRunLog = logging.FileHandler('Runtime.log', 'w')
+WRunLog = logging.FileHandler('Runtime.log', 'w', delay=True)
 RunFormatter = logging.Formatter('%(asctime)s : %(levelname)s : %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p')
-WRunLog.setFormatter(RunFormatter)
+WRunLog.setFormatter(_SuiteTagFormatter(RunFormatter._fmt, datefmt=RunFormatter.datefmt))
 RunLog.setLevel(logging.DEBUG)
 RunScreen = logging.StreamHandler()
 RunScreen.setFormatter(RunFormatter)
@@ -31,10 +54,11 @@ RunLog.addHandler(WRunLog)
 
 #This will collect Result from every test case :
 ResultLog = logging.getLogger("Result : ")
-WResultLog = logging.FileHandler('Summary.log', 'w')
+WResultLog = logging.FileHandler('Summary.log', 'w', delay=True)
 #ResultFormatter = logging.Formatter('%(asctime)s : %(levelname)s : %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p')
 ResultFormatter = logging.Formatter('%(message)s')
 WResultLog.setFormatter(ResultFormatter)
+WResultLog.addFilter(_OutsideSuiteFilter())
 ResultLog.setLevel(logging.DEBUG)
 ResultScreen = logging.StreamHandler()
 ResultScreen.setFormatter(ResultFormatter)
@@ -46,12 +70,13 @@ def UpdateRepos(current_distro):
     RunLog.info ("\nUpdating the repository information...")
     if (current_distro.find("ubuntu") != -1) or (current_distro.find("debian") != -1):
         #method 'RunUpdate': fix deadlock when using stdout=PIPE and/or stderr=PIPE and the child process generates enough output to a pipe
-        RunUpdate("until dpkg --force-all --configure -a; sleep 10; do echo 'Trying again...'; done")
-        RunUpdate("apt-get update")
+        #method 'RunStream': also bounds the time a broken mirror or a stuck dpkg lock can hold the VM
+        RunStream("until dpkg --force-all --configure -a; sleep 10; do echo 'Trying again...'; done", timeout=REPO_UPDATE_TIMEOUT)
+        RunStream("apt-get update", timeout=REPO_UPDATE_TIMEOUT)
     elif (current_distro.find("rhel") != -1) or (current_distro.find("Oracle") != -1) or (current_distro.find('centos') != -1):
-        RunUpdate("yum -y update")
+        RunStream("yum -y update", timeout=REPO_UPDATE_TIMEOUT)
     elif (current_distro.find("opensuse") != -1) or (current_distro.find("SUSE") != -1) or (current_distro.find("sles") != -1):
-        RunUpdate("zypper --non-interactive --gpg-auto-import-keys update")
+        RunStream("zypper --non-interactive --gpg-auto-import-keys update", timeout=REPO_UPDATE_TIMEOUT)
     else:
         RunLog.info("Repo update failed on:"+current_distro)
         return False
@@ -63,13 +88,14 @@ def UpdateRepos(current_distro):
 def GetParams(file_path):
     params = dict()
 
-    with open(file_path) as file:
-        lines = file.readlines()
-        for line in lines:
-            if not line.startswith("#"):
-                param_name = line.split("=")[0].strip()
-                param_value = line.split("=")[1].strip().strip('"')
-                params[param_name] = param_value
+    #read through the file cache : checks sharing one process (SuiteRunner) parse constants.sh from memory
+    if not os.path.isfile(file_path):
+        raise IOError("No such file: " + file_path)
+    for line in ReadFileLines(file_path):
+        if not line.startswith("#"):
+            param_name = line.split("=")[0].strip()
+            param_value = line.split("=")[1].strip().strip('"')
+            params[param_name] = param_value
     return params
  
  
@@ -92,15 +118,19 @@ def DownloadUrl(url, destination_folder, output_file=None):
 
 
 def DetectDistro():
+    return [GetSystemFacts().Distro(), GetSystemFacts().Version()]
+
+
+def _ProbeDistro():
     distribution = 'unknown'
     version = 'unknown'
 
     RunLog.info("Detecting Distro ")
-    output = Run("cat /etc/*-release")
+    output = ReadFile("/etc/*-release")
     if output == "" and os.path.isfile("/usr/lib/os-release"):
-        output = Run("cat /usr/lib/os-release")
-    if output == "" and os.path.exists("/etc/lsb-release") and int(Run("cat /etc/lsb-release | grep -i coreos | wc -l")) > 0:
-        output = Run("cat /etc/lsb-release")
+        output = ReadFile("/usr/lib/os-release")
+    if output == "" and IsCoreOS():
+        output = ReadFile("/etc/lsb-release")
 
     outputlist = re.split("\n", output)
 
@@ -151,14 +181,363 @@ def FileGetContents(filename):
         return f.read()
 
 
+#Fork-free replacement for Run("cat <path>") : globs are expanded and concatenated in sorted order like the shell does.
+#Regular files are cached by path, mtime and size so repeated reads in a run are free,
+#/proc and /sys are always read fresh since their mtime does not follow their content, also through a symlink such as
+#/etc/mtab -> /proc/self/mounts.
+_file_cache = {}
+_file_cache_lock = threading.Lock()
+_uncached_prefixes = ('/proc/', '/sys/', '/dev/')
+
+
+def _ReadOneFile(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return ''
+    cacheable = not os.path.realpath(path).startswith(_uncached_prefixes)
+    key = (st.st_mtime, st.st_size)
+    if cacheable:
+        with _file_cache_lock:
+            cached = _file_cache.get(path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+    try:
+        with open(path, 'rb') as f:
+            content = _ToText(f.read())
+    except (IOError, OSError):
+        return ''
+    if cacheable:
+        with _file_cache_lock:
+            _file_cache[path] = (key, content)
+    return content
+
+
+def ReadFile(pattern):
+    import glob
+    if glob.has_magic(pattern):
+        paths = sorted(glob.glob(pattern))
+    else:
+        paths = [pattern]
+    return ''.join([_ReadOneFile(path) for path in paths if not os.path.isdir(path)])
+
+
+def ReadFileLines(pattern):
+    return ReadFile(pattern).splitlines()
+
+
+def GrepFile(pattern, regex, flags=0):
+    #lines of the file(s) matching regex, like grep without forking it
+    compiled = re.compile(regex, flags)
+    return [line for line in ReadFileLines(pattern) if compiled.search(line)]
+
+
+def ClearFileCache():
+    with _file_cache_lock:
+        _file_cache.clear()
+
+
+def IsCoreOS():
+    return len(GrepFile("/etc/lsb-release", "coreos", re.I)) > 0
+
+
+#Single pass log triage : every log file is streamed once, each line is classified into all the categories whose
+#keyword starts a word in it (like 'grep -nw <keyword>.* --ignore-case') and checked against one precompiled
+#alternation of the ignorable patterns of that category. Hits are reported as 'file:line:text' like grep does.
+DEFAULT_TRIAGE_KEYWORDS = {'errors': 'err', 'warnings': 'warn', 'failures': 'fail'}
+
+
+class LogTriageResult(object):
+    def __init__(self, categories):
+        self.hits = dict((category, []) for category in categories)
+        self.ignored = dict((category, 0) for category in categories)
+        self.linesScanned = 0
+        self.filesScanned = 0
+
+    def Counts(self):
+        return dict((category, len(hits)) for category, hits in self.hits.items())
+
+    def TotalHits(self):
+        return sum(self.Counts().values())
+
+    def TotalRawHits(self):
+        return self.TotalHits() + sum(self.ignored.values())
+
+
+class LogTriage(object):
+    def __init__(self, keywords=None):
+        self.keywords = dict(keywords or DEFAULT_TRIAGE_KEYWORDS)
+        self.ignorePatterns = dict((category, []) for category in self.keywords)
+        self.ignoreMatchers = None
+        #one alternation for all keywords, group names tell which categories a line belongs to
+        self.classifier = re.compile(r'(?<!\w)(?:%s)' % '|'.join(
+            ['(?P<%s>%s)' % (category, re.escape(keyword)) for category, keyword in sorted(self.keywords.items())]), re.I)
+
+    def AddIgnorePatterns(self, patterns, category=None):
+        categories = [category] if category else list(self.keywords)
+        for each in categories:
+            if each in self.ignorePatterns:
+                self.ignorePatterns[each].extend([pattern for pattern in patterns if pattern])
+        self.ignoreMatchers = None
+
+    def AddIgnorableMessagesXml(self, xmlPath, allCategories=False):
+        #<messages><errors><keywords>regex</keywords>...</errors>...</messages>, with allCategories
+        #every list applies to every category (the way the waagent whitelist is used)
+        try:
+            import xml.etree.cElementTree as ET
+        except ImportError:
+            import xml.etree.ElementTree as ET
+        for node in ET.parse(xmlPath).getroot():
+            patterns = [keywords.text for keywords in node]
+            self.AddIgnorePatterns(patterns, None if allCategories else node.tag)
+
+    def _Matchers(self):
+        if self.ignoreMatchers is None:
+            self.ignoreMatchers = {}
+            for category, patterns in self.ignorePatterns.items():
+                if not patterns:
+                    continue
+                try:
+                    self.ignoreMatchers[category] = [re.compile('|'.join(['(?:%s)' % pattern for pattern in patterns]), re.M)]
+                except re.error:
+                    #a pattern does not survive the alternation (e.g. numbered back references), keep them separate
+                    self.ignoreMatchers[category] = [re.compile(pattern, re.M) for pattern in patterns]
+        return self.ignoreMatchers
+
+    def _IsIgnorable(self, category, message):
+        for matcher in self._Matchers().get(category, []):
+            if matcher.search(message):
+                return True
+        return False
+
+    def ScanFile(self, path, result):
+        try:
+            logFile = open(path, 'rb')
+        except (IOError, OSError):
+            return result
+        result.filesScanned += 1
+        with logFile:
+            lineNumber = 0
+            for line in logFile:
+                lineNumber += 1
+                line = _ToText(line).rstrip('\n')
+                categories = set()
+                for matchObj in self.classifier.finditer(line):
+                    categories.add(matchObj.lastgroup)
+                if not categories:
+                    continue
+                message = '%s:%s:%s' % (path, lineNumber, line)
+                for category in categories:
+                    if self._IsIgnorable(category, message):
+                        RunLog.info('Ignorable %s message: %s', category, message)
+                        result.ignored[category] += 1
+                    else:
+                        result.hits[category].append(message)
+            result.linesScanned += lineNumber
+        return result
+
+    def Scan(self, paths):
+        result = LogTriageResult(self.keywords)
+        for path in paths:
+            self.ScanFile(path, result)
+        RunLog.info("Log triage : %s lines in %s files, hits %s, ignored %s", result.linesScanned, result.filesScanned,
+                    result.Counts(), result.ignored)
+        return result
+
+
+#Follows a log file from a given offset and returns as soon as a pattern shows up, instead of sleeping for the
+#worst case. Wakeups come from inotify on the parent directory (so rotation and re-creation are seen too) and fall
+#back to polling when inotify is not available. Create the follower before triggering the event to avoid races.
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+LOG_WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+
+class _InotifyWatch(object):
+    def __init__(self, directory):
+        self.fd = None
+        try:
+            import ctypes
+            import ctypes.util
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd < 0:
+                return
+            if libc.inotify_add_watch(fd, directory.encode('utf-8'), LOG_WATCH_MASK) < 0:
+                os.close(fd)
+                return
+            self.fd = fd
+        except (OSError, AttributeError, ImportError) as e:
+            RunLog.info("inotify is not available, polling instead : %s", e)
+
+    def Wait(self, timeout):
+        #returns once something changed in the directory or the timeout expired
+        if self.fd is None:
+            time.sleep(timeout)
+            return
+        import select
+        readable = select.select([self.fd], [], [], timeout)[0]
+        if readable:
+            try:
+                while os.read(self.fd, 65536):
+                    pass
+            except OSError:
+                pass
+
+    def Close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class LogWaitResult(object):
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.found = False
+        self.matchedLine = None
+        self.elapsed = 0.0
+        self.linesRead = 0
+        self.rotations = 0
+        self.counts = {}
+
+
+class LogFollower(object):
+    def __init__(self, path, offset=None):
+        self.path = path
+        self.file = None
+        self.inode = None
+        self.position = 0
+        self.pending = b''
+        self._Open(offset)
+
+    def _Open(self, offset=None):
+        try:
+            self.file = open(self.path, 'rb')
+        except (IOError, OSError):
+            self.file = None
+            self.inode = None
+            self.position = 0
+            return
+        st = os.fstat(self.file.fileno())
+        self.inode = st.st_ino
+        #by default start at the current end, only what is written from now on counts
+        self.position = st.st_size if offset is None else offset
+        self.file.seek(self.position)
+
+    def _ReadLines(self):
+        lines = []
+        if self.file is not None:
+            #seek clears the sticky EOF of python 2 file objects
+            self.file.seek(self.position)
+            data = self.file.read()
+            self.position += len(data)
+            chunks = (self.pending + data).split(b'\n')
+            self.pending = chunks.pop()
+            lines = [_ToText(chunk) for chunk in chunks]
+        return lines
+
+    def ReadNewLines(self):
+        #complete lines written since the last call, for callers polling the file themselves
+        if self.file is None:
+            self._Open(0)
+        return self._ReadLines()
+
+    def _CheckRotation(self, result):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return []
+        if self.file is None:
+            self._Open(0)
+            return []
+        if st.st_ino != self.inode or st.st_size < self.position:
+            #drain what the old file still holds, then follow the new one from its beginning
+            lines = self._ReadLines()
+            if self.pending:
+                lines.append(_ToText(self.pending))
+                self.pending = b''
+            self.file.close()
+            self._Open(0)
+            result.rotations += 1
+            return lines
+        return []
+
+    def WaitFor(self, regex, timeout, countPatterns=None, flags=0, pollInterval=1.0):
+        result = LogWaitResult(regex)
+        matcher = re.compile(regex, flags)
+        counters = [(pattern, re.compile(pattern)) for pattern in (countPatterns or [])]
+        for pattern, counter in counters:
+            result.counts[pattern] = 0
+        startTime = time.time()
+        deadline = startTime + timeout
+        watch = _InotifyWatch(os.path.dirname(os.path.abspath(self.path)))
+        try:
+            while True:
+                lines = self._CheckRotation(result) + self._ReadLines()
+                for line in lines:
+                    result.linesRead += 1
+                    for pattern, counter in counters:
+                        if counter.search(line):
+                            result.counts[pattern] += 1
+                    if matcher.search(line):
+                        result.found = True
+                        result.matchedLine = line
+                        break
+                remaining = deadline - time.time()
+                if result.found or remaining <= 0:
+                    break
+                #inotify wakes us up early, the cap only bounds how late a missed event can be noticed
+                watch.Wait(min(remaining, pollInterval))
+        finally:
+            watch.Close()
+        result.elapsed = time.time() - startTime
+        RunLog.info("WaitForLogPattern : '%s' in %s %s after %.2fs (%s lines, counts %s)", regex, self.path,
+                    "found" if result.found else "not found", result.elapsed, result.linesRead, result.counts)
+        return result
+
+    def Close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def WaitForLogPattern(path, regex, timeout, countPatterns=None, flags=0, offset=None):
+    follower = LogFollower(path, offset)
+    try:
+        return follower.WaitFor(regex, timeout, countPatterns, flags)
+    finally:
+        follower.Close()
+
+
 def ExecMultiCmdsLocalSudo(cmd_list):
-    f = open('/tmp/temp_script.sh', 'w')
+    import tempfile
+    startTime = time.time()
+    #unique script and log per call, checks of a suite run side by side in one process
+    fd, scriptPath = tempfile.mkstemp(prefix='temp_script-', suffix='.sh')
+    f = os.fdopen(fd, 'w')
     for line in cmd_list:
             f.write(line+'\n')
     f.close()
-    Run ("chmod +x /tmp/temp_script.sh")
-    Run ("/tmp/temp_script.sh 2>&1 > /tmp/exec_multi_cmds_local_sudo.log")
-    return FileGetContents("/tmp/exec_multi_cmds_local_sudo.log")
+    fd, logPath = tempfile.mkstemp(prefix='exec_multi_cmds_local_sudo-', suffix='.log')
+    os.close(fd)
+    try:
+        Run ("chmod +x " + scriptPath)
+        Run (scriptPath + " 2>&1 > " + logPath)
+        output = FileGetContents(logPath)
+    finally:
+        for path in (scriptPath, logPath):
+            os.remove(path)
+    tracer = _CommandTracer()
+    if tracer is not None:
+        #the script itself is traced through Run, this entry only groups it under the original commands
+        tracer.Record('ExecMultiCmdsLocalSudo', '; '.join(cmd_list), startTime, None, len(output), grouping=True)
+    return output
 
 
 def DetectLinuxDistro():
@@ -176,10 +555,7 @@ def DetectLinuxDistro():
 
 
 def IsUbuntu():
-        cmd = "cat /etc/issue"
-        tmp = Run(cmd)
-        if type(tmp) == bytes:
-            tmp = tmp.decode("utf-8")
+        tmp = ReadFile("/etc/issue")
         return ("Ubuntu" in tmp)
 
 
@@ -201,7 +577,11 @@ def ParseWalaConf2Dict(walaconfpath):
 
 
 def GetWalaConfPath():
-    if os.path.exists("/etc/lsb-release") and int(Run("cat /etc/lsb-release | grep -i coreos | wc -l")) > 0:
+    return GetSystemFacts().WalaConfPath()
+
+
+def _ProbeWalaConfPath():
+    if IsCoreOS():
         return "/usr/share/oem/waagent.conf"
     elif DetectDistro()[0] == 'clear-linux-os':
         return "/usr/share/defaults/waagent/waagent.conf"
@@ -209,7 +589,88 @@ def GetWalaConfPath():
         return "/etc/waagent.conf"
 
 
+#Locates the waagent.conf the agent really uses without walking the whole filesystem :
+#the distro default first, then the other known install locations, then the agent package file list,
+#and only then a bounded breadth-first search that stays on the root filesystem.
+WALA_CONF_CANDIDATES = [
+    "/etc/waagent.conf",
+    "/usr/share/oem/waagent.conf",
+    "/usr/share/defaults/waagent/waagent.conf",
+    "/etc/waagent/waagent.conf"
+]
+WALA_PACKAGE_FILES_CMD = "(rpm -ql WALinuxAgent python-azure-agent; dpkg -L walinuxagent waagent) 2>/dev/null"
+SEARCH_SKIP_DIRS = ['/proc', '/sys', '/dev', '/run']
+
+
+def LocateWalaConf():
+    return GetSystemFacts().AgentConfigFile()
+
+
+def FindWalaConf(searchFallback=True):
+    candidates = [GetWalaConfPath()] + WALA_CONF_CANDIDATES
+    for path in candidates:
+        if os.path.isfile(path):
+            return path
+    for line in RunStream(WALA_PACKAGE_FILES_CMD, timeout=30).stdout.splitlines():
+        line = line.strip()
+        if line.endswith("/waagent.conf") and os.path.isfile(line):
+            return line
+    if searchFallback:
+        found = SearchFile("waagent.conf")
+        if found:
+            return found
+    RunLog.error("Unable to locate waagent.conf")
+    return ''
+
+
+def SearchFile(name, root='/', maxDepth=6, maxEntries=200000, timeout=10):
+    #breadth-first, same filesystem as root, bounded by depth, number of entries and time
+    import stat
+    deadline = time.time() + timeout
+    try:
+        rootDevice = os.lstat(root).st_dev
+    except OSError:
+        return None
+    pending = deque([(root, 0)])
+    entries = 0
+    while pending:
+        directory, depth = pending.popleft()
+        try:
+            names = sorted(os.listdir(directory))
+        except OSError:
+            continue
+        for each in names:
+            path = os.path.join(directory, each)
+            entries += 1
+            try:
+                st = os.lstat(path)
+            except OSError:
+                continue
+            if each == name and stat.S_ISREG(st.st_mode):
+                return path
+            if stat.S_ISDIR(st.st_mode) and st.st_dev == rootDevice and depth + 1 < maxDepth and path not in SEARCH_SKIP_DIRS:
+                pending.append((path, depth + 1))
+        if entries >= maxEntries or time.time() > deadline:
+            RunLog.info("SearchFile : gave up looking for %s after %s entries", name, entries)
+            break
+    return None
+
+
+def LocateExecutable(name, extraDirs=('/usr/bin', '/bin', '/usr/sbin', '/sbin', '/usr/local/bin', '/usr/local/sbin')):
+    #like 'which', also looks in the sbin directories that are often missing from a non-root PATH
+    dirs = os.environ.get('PATH', '').split(os.pathsep) + list(extraDirs)
+    for directory in dirs:
+        path = os.path.join(directory, name)
+        if directory and os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return None
+
+
 def GetResourceDiskMountPoint():
+    return GetSystemFacts().ResourceDiskMountPoint()
+
+
+def _ProbeResourceDiskMountPoint():
     walacfg_path = GetWalaConfPath()
     walacfg_dict = ParseWalaConf2Dict(walacfg_path)
 
@@ -222,10 +683,12 @@ def GetResourceDiskMountPoint():
 
 
 def RunGetOutput(cmd):
+    startTime = time.time()
     try:
         proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE)
         retval = proc.communicate()
         output = retval[0]
+        _RecordCommand('RunGetOutput', cmd, startTime, proc.returncode, len(output))
 
         output = unicode(output,
                          encoding='utf-8',
@@ -239,9 +702,11 @@ def RunGetOutput(cmd):
 
 
 def Run(cmd):
+        startTime = time.time()
         proc=subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE)
         proc.wait()
         op = proc.stdout.read()
+        _RecordCommand('Run', cmd, startTime, proc.returncode, len(op))
         RunLog.debug(op)
         #ensure type str return
         if py_ver_str[0] == '3':
@@ -253,11 +718,13 @@ def Run(cmd):
 
 
 def RunUpdate(cmd):
+        startTime = time.time()
         proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE)
         retval = proc.communicate()
         op = retval[0]
         RunLog.debug(op)
         code = proc.returncode
+        _RecordCommand('RunUpdate', cmd, startTime, code, len(op))
         if int(code) !=0:
             exception = 1
         else:
@@ -269,13 +736,747 @@ def RunUpdate(cmd):
 
 
 def JustRun(cmd):
-    return commands.getoutput(cmd)
+    startTime = time.time()
+    output = commands.getoutput(cmd)
+    _RecordCommand('JustRun', cmd, startTime, None, len(output))
+    return output
+
+
+#Streaming executor : reads stdout/stderr while the child runs, so chatty commands never fill the pipe,
+#enforces a hard deadline on the whole process group and keeps only a bounded tail of the output in memory.
+DEFAULT_MAX_OUTPUT_BYTES = 1024 * 1024
+INSTALL_TIMEOUT = 1800
+REPO_UPDATE_TIMEOUT = 3600
+#how long the output of an exited command is drained before the readers are left behind
+STREAM_DRAIN_TIMEOUT = 2
+
+
+class CommandResult(object):
+    def __init__(self, cmd):
+        self.cmd = cmd
+        self.exitCode = None
+        self.timedOut = False
+        self.startTime = time.time()
+        self.duration = 0.0
+        self.stdoutBytes = 0
+        self.stderrBytes = 0
+        self.truncated = False
+        self.stdout = ''
+        self.stderr = ''
+        self.spillFile = None
+
+    def Succeeded(self):
+        return self.exitCode == 0 and not self.timedOut
+
+    def ToDict(self):
+        return {
+            'cmd': self.cmd,
+            'exitCode': self.exitCode,
+            'timedOut': self.timedOut,
+            'duration': round(self.duration, 3),
+            'stdoutBytes': self.stdoutBytes,
+            'stderrBytes': self.stderrBytes,
+            'truncated': self.truncated,
+            'spillFile': self.spillFile
+        }
+
+
+class _OutputRing(object):
+    #Keeps the most recent lines up to maxBytes, drops the oldest ones first.
+    def __init__(self, maxBytes):
+        self.maxBytes = maxBytes
+        self.lines = deque()
+        self.size = 0
+        self.total = 0
+        self.truncated = False
+        self.lock = threading.Lock()
+
+    def Append(self, line):
+        with self.lock:
+            self.total += len(line)
+            self.lines.append(line)
+            self.size += len(line)
+            while self.size > self.maxBytes and len(self.lines) > 1:
+                self.size -= len(self.lines.popleft())
+                self.truncated = True
+            if self.size > self.maxBytes:
+                #a single line larger than the whole buffer, keep its tail only
+                tail = self.lines.pop()[-self.maxBytes:]
+                self.lines.append(tail)
+                self.size = len(tail)
+                self.truncated = True
+
+    def Text(self):
+        with self.lock:
+            return _ToText(b''.join(self.lines))
+
+
+def _ToText(data):
+    if isinstance(data, bytes) and py_ver_str[0] == '3':
+        return data.decode('utf-8', 'replace')
+    return data
+
+
+def _PumpStream(stream, ring, callback, spill, spillLock):
+    for line in iter(stream.readline, b''):
+        ring.Append(line)
+        if spill is not None:
+            with spillLock:
+                if not spill.closed:
+                    spill.write(line)
+        if callback is not None:
+            try:
+                callback(_ToText(line).rstrip('\n'))
+            except Exception as e:
+                RunLog.error("Output callback failed : %s", e)
+    stream.close()
+
+
+def _PrepareChild():
+    #own process group so a timeout can kill the whole pipeline, default SIGPIPE like a regular shell
+    import signal
+    os.setsid()
+    signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+
+
+def _KillProcessGroup(proc):
+    import signal
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+        for i in range(20):
+            if proc.poll() is not None:
+                return
+            time.sleep(0.1)
+        os.killpg(proc.pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+def RunStream(cmd, timeout=None, onStdout=None, onStderr=None, maxOutputBytes=DEFAULT_MAX_OUTPUT_BYTES, spillToFile=False):
+    result = CommandResult(cmd)
+    stdoutRing = _OutputRing(maxOutputBytes)
+    stderrRing = _OutputRing(maxOutputBytes)
+    spill = None
+    spillLock = threading.Lock()
+    if spillToFile:
+        import tempfile
+        spill = tempfile.NamedTemporaryFile(prefix='runstream-', suffix='.log', delete=False)
+        result.spillFile = spill.name
+
+    proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            close_fds=True, preexec_fn=_PrepareChild)
+    readers = [
+        threading.Thread(target=_PumpStream, args=(proc.stdout, stdoutRing, onStdout, spill, spillLock)),
+        threading.Thread(target=_PumpStream, args=(proc.stderr, stderrRing, onStderr, spill, spillLock))
+    ]
+    for reader in readers:
+        reader.daemon = True
+        reader.start()
+
+    deadline = None
+    if timeout is not None:
+        deadline = result.startTime + timeout
+    #wait on the process itself, not on the end of its output : a background child that inherited the pipes keeps
+    #them open long after the command has exited
+    while proc.poll() is None:
+        if deadline is not None and time.time() >= deadline:
+            result.timedOut = True
+            RunLog.error("Command timed out after %ss, killing it : %s", timeout, _RedactCommand(cmd))
+            _KillProcessGroup(proc)
+            break
+        alive = [reader for reader in readers if reader.is_alive()]
+        if alive:
+            alive[0].join(0.1 if deadline is None else max(0, min(0.1, deadline - time.time())))
+        else:
+            time.sleep(0.01)
+    result.exitCode = proc.wait()
+    result.duration = time.time() - result.startTime
+    drainDeadline = time.time() + STREAM_DRAIN_TIMEOUT
+    for reader in readers:
+        reader.join(max(0, drainDeadline - time.time()))
+    if any(reader.is_alive() for reader in readers):
+        RunLog.warning("RunStream : a background process still holds the output of '%s', not waiting for it",
+                       _RedactCommand(cmd))
+
+    if spill is not None:
+        with spillLock:
+            spill.close()
+    result.stdout = stdoutRing.Text()
+    result.stderr = stderrRing.Text()
+    result.stdoutBytes = stdoutRing.total
+    result.stderrBytes = stderrRing.total
+    result.truncated = stdoutRing.truncated or stderrRing.truncated
+    _RecordCommand('RunStream', cmd, result.startTime, result.exitCode, result.stdoutBytes + result.stderrBytes)
+    RunLog.debug("RunStream : '%s' exit code %s in %.2fs (%s/%s bytes%s)", _RedactCommand(cmd), result.exitCode,
+                 result.duration, result.stdoutBytes, result.stderrBytes, ", truncated" if result.truncated else "")
+    return result
+
+
+#Runs a batch of independent commands {name : command} on a bounded pool of worker threads,
+#wall-clock time is the slowest command instead of the sum of all of them.
+DEFAULT_PROBE_WORKERS = 8
+
+
+def RunMany(commandsByName, maxWorkers=DEFAULT_PROBE_WORKERS, timeout=None):
+    results = {}
+    pending = deque(sorted(commandsByName.items()))
+    lock = threading.Lock()
+    startTime = time.time()
+    parentCheck = _CurrentCheck()
+    parentSuiteCheck = _CurrentSuiteCheck()
+
+    def worker():
+        _check_context.check = parentCheck
+        _check_context.suiteCheck = parentSuiteCheck
+        while True:
+            with lock:
+                if not pending:
+                    return
+                name, cmd = pending.popleft()
+            try:
+                result = RunStream(cmd, timeout=timeout)
+            except Exception as e:
+                RunLog.error("RunMany : failed to start '%s' : %s", _RedactCommand(cmd), e)
+                result = CommandResult(cmd)
+                result.exitCode = -1
+                result.stderr = str(e)
+            with lock:
+                results[name] = result
+
+    workers = [threading.Thread(target=worker) for i in range(min(maxWorkers, len(pending)))]
+    for each in workers:
+        each.daemon = True
+        each.start()
+    for each in workers:
+        each.join()
+    RunLog.info("RunMany : %s commands on %s workers in %.2fs", len(results), len(workers), time.time() - startTime)
+    return results
+
+
+#Structured results : every sub-check records its verdict, start, duration, the markers it printed and the commands it
+#ran, the overall verdict comes from ResultLog and the state from UpdateState. Everything is written as one compact
+#JSON artifact when the test reaches a final state, so the orchestrator fetches a single file per VM.
+RESULTS_FILE = 'results.json'
+MAX_COMMANDS_PER_CHECK = 200
+FINAL_TEST_STATES = ['TestCompleted', 'TestAborted', 'TestFailed', 'TestSkipped']
+_check_context = threading.local()
+
+
+def _CurrentCheck():
+    return getattr(_check_context, 'check', None)
+
+
+def _CurrentSuiteCheck():
+    return getattr(_check_context, 'suiteCheck', None)
+
+
+class CheckRecord(object):
+    def __init__(self, name):
+        self.name = name
+        self.verdict = None
+        self.start = time.time()
+        self.duration = 0.0
+        self.markers = []
+        self.commands = []
+        self.error = None
+
+    def ToDict(self):
+        return {
+            'name': self.name,
+            'verdict': self.verdict,
+            'start': round(self.start, 3),
+            'duration': round(self.duration, 3),
+            'markers': self.markers,
+            'commands': self.commands,
+            'error': self.error
+        }
+
+
+class _CheckScope(object):
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.record = CheckRecord(name)
+        self.previous = None
+
+    def __enter__(self):
+        self.previous = _CurrentCheck()
+        _check_context.check = self.record
+        suiteCheck = _CurrentSuiteCheck()
+        with self.recorder.lock:
+            if suiteCheck is not None:
+                suiteCheck.checks.append(self.record)
+            else:
+                self.recorder.checks.append(self.record)
+        return self.record
+
+    def __exit__(self, excType, excValue, traceback):
+        self.record.duration = time.time() - self.record.start
+        if excType is not None:
+            self.record.verdict = 'ERROR'
+            self.record.error = str(excValue)
+        _check_context.check = self.previous
+        return False
+
+
+class ResultsRecorder(object):
+    def __init__(self, path=RESULTS_FILE, testName=None, start=None):
+        self.path = path
+        self.testName = testName or os.path.basename(sys.argv[0] or 'python')
+        self.start = start or time.time()
+        self.state = None
+        self.result = None
+        self.checks = []
+        self.commands = []
+        self.markers = []
+        self.lock = threading.Lock()
+
+    def Check(self, name):
+        return _CheckScope(self, name)
+
+    def RecordCommand(self, cmd, startTime, exitCode, outputBytes):
+        entry = {'cmd': _RedactCommand(cmd), 'start': round(startTime, 3),
+                 'duration': round(time.time() - startTime, 3), 'exitCode': exitCode, 'bytes': outputBytes}
+        check = _CurrentCheck()
+        with self.lock:
+            commandList = check.commands if check is not None else self.commands
+            if len(commandList) < MAX_COMMANDS_PER_CHECK:
+                commandList.append(entry)
+
+    def RecordMarker(self, marker):
+        check = _CurrentCheck()
+        with self.lock:
+            if check is not None:
+                check.markers.append(marker)
+            else:
+                self.markers.append(marker)
+
+    def SetResult(self, verdict):
+        self.result = verdict
+
+    def SetState(self, state):
+        self.state = state
+        if state in FINAL_TEST_STATES:
+            self.Save()
+
+    def ToDict(self):
+        with self.lock:
+            return {
+                'test': self.testName,
+                'host': os.uname()[1],
+                'python': py_ver_str.split()[0],
+                'start': round(self.start, 3),
+                'duration': round(time.time() - self.start, 3),
+                'state': self.state,
+                'result': self.result,
+                'checks': [check.ToDict() for check in self.checks],
+                'markers': list(self.markers),
+                'commands': list(self.commands)
+            }
+
+    def Save(self):
+        import json
+        tmpFile = self.path + '.tmp'
+        try:
+            with open(tmpFile, 'w') as f:
+                json.dump(self.ToDict(), f, separators=(',', ':'), sort_keys=True)
+            os.rename(tmpFile, self.path)
+        except (IOError, OSError) as e:
+            RunLog.error("Unable to write %s : %s", self.path, e)
+
+
+#created on first use, the test still counts from the import of the module
+_module_import_time = time.time()
+_results_recorder = None
+_results_recorder_lock = threading.Lock()
+
+
+def GetResultsRecorder():
+    global _results_recorder
+    if _results_recorder is None:
+        with _results_recorder_lock:
+            if _results_recorder is None:
+                _results_recorder = ResultsRecorder(start=_module_import_time)
+    return _results_recorder
+
+
+#secrets that checks pass on command lines, masked before a command is logged, traced or written to results.json :
+#the password piped into sudo -S / chpasswd / passwd --stdin, sshpass -p and --password options
+_SECRET_PATTERNS = [
+    (r"""(\becho\s+(?:-n\s+)?)('[^']*'|"[^"]*"|[^\s|;&]+)(\s*\|\s*(?:sudo\s+-S\b|(?:sudo\s+)?chpasswd\b|"""
+     r"""(?:sudo\s+)?passwd\s+--stdin\b))""", r"\1'***'\3"),
+    (r"""(\bsshpass\s+-p\s*)('[^']*'|"[^"]*"|\S+)""", r"\1'***'"),
+    (r"""(?i)(--?(?:password|passwd)(?:=|\s+))('[^']*'|"[^"]*"|\S+)""", r"\1'***'")
+]
+
+
+def _RedactCommand(cmd):
+    if not cmd:
+        return cmd
+    for pattern, replacement in _SECRET_PATTERNS:
+        cmd = re.sub(pattern, replacement, cmd)
+    return cmd
+
+
+def _RecordCommand(api, cmd, startTime, exitCode, outputBytes):
+    GetResultsRecorder().RecordCommand(cmd, startTime, exitCode, outputBytes)
+    tracer = _CommandTracer()
+    if tracer is not None:
+        tracer.Record(api, cmd, startTime, exitCode, outputBytes)
+
+
+#Opt-in command tracing : AZUREMODULES_TRACE=1 (or =<file>) records every command run through the helpers above with
+#its duration, exit code, output size and calling check, and at exit logs a hot-list (top commands by total time,
+#fork count, commands repeated with identical arguments) and writes it with the raw entries to command-trace.json.
+#AZUREMODULES_PROFILE=<file> additionally dumps a cProfile of the python side, readable with pstats. Both start with
+#the first command run through these helpers.
+TRACE_ENV = 'AZUREMODULES_TRACE'
+PROFILE_ENV = 'AZUREMODULES_PROFILE'
+TRACE_FILE = 'command-trace.json'
+TRACE_TOP_COUNT = 15
+_module_file = os.path.splitext(os.path.abspath(__file__))[0]
+
+
+def _TraceCaller():
+    frame = sys._getframe(2)
+    while frame is not None:
+        fileName = os.path.abspath(frame.f_code.co_filename)
+        if os.path.splitext(fileName)[0] != _module_file and os.path.basename(fileName) != 'threading.py':
+            return '%s:%s' % (os.path.basename(fileName), frame.f_code.co_name)
+        frame = frame.f_back
+    return 'azuremodules'
+
+
+class CommandTracer(object):
+    def __init__(self, path=TRACE_FILE):
+        self.path = path
+        self.start = time.time()
+        self.entries = []
+        self.lock = threading.Lock()
+
+    def Record(self, api, cmd, startTime, exitCode, outputBytes, grouping=False):
+        check = _CurrentCheck()
+        entry = {
+            'api': api,
+            'cmd': _RedactCommand(cmd),
+            'duration': round(time.time() - startTime, 4),
+            'exitCode': exitCode,
+            'bytes': outputBytes,
+            'caller': _TraceCaller(),
+            'check': check.name if check is not None else None,
+            'grouping': grouping
+        }
+        with self.lock:
+            self.entries.append(entry)
+
+    def Summary(self):
+        with self.lock:
+            entries = [entry for entry in self.entries if not entry['grouping']]
+        byCommand = {}
+        for entry in entries:
+            stats = byCommand.setdefault(entry['cmd'], {'cmd': entry['cmd'], 'count': 0, 'totalTime': 0.0, 'callers': []})
+            stats['count'] += 1
+            stats['totalTime'] += entry['duration']
+            caller = entry['check'] or entry['caller']
+            if caller not in stats['callers']:
+                stats['callers'].append(caller)
+        ranked = sorted(byCommand.values(), key=lambda stats: stats['totalTime'], reverse=True)
+        duplicates = sorted([stats for stats in byCommand.values() if stats['count'] > 1], key=lambda stats: stats['count'], reverse=True)
+        return {
+            'forks': len(entries),
+            'commandTime': round(sum([entry['duration'] for entry in entries]), 3),
+            'wallTime': round(time.time() - self.start, 3),
+            'top': ranked[:TRACE_TOP_COUNT],
+            'duplicates': duplicates[:TRACE_TOP_COUNT]
+        }
+
+    def Report(self):
+        import json
+        summary = self.Summary()
+        RunLog.info("Command trace : %s forks, %.2fs in commands, %.2fs wall time", summary['forks'],
+                    summary['commandTime'], summary['wallTime'])
+        for stats in summary['top']:
+            RunLog.info("  %8.3fs %4sx  %s  [%s]", stats['totalTime'], stats['count'], stats['cmd'], ', '.join(stats['callers']))
+        for stats in summary['duplicates']:
+            RunLog.info("  duplicate %sx : %s", stats['count'], stats['cmd'])
+        try:
+            with open(self.path, 'w') as f:
+                json.dump({'summary': summary, 'entries': self.entries}, f, separators=(',', ':'))
+        except (IOError, OSError) as e:
+            RunLog.error("Unable to write %s : %s", self.path, e)
+        return summary
+
+
+def _StartTracing():
+    import atexit
+    tracer = None
+    traceSetting = os.environ.get(TRACE_ENV, '')
+    if traceSetting and traceSetting != '0':
+        tracer = CommandTracer(TRACE_FILE if traceSetting == '1' else traceSetting)
+        atexit.register(tracer.Report)
+    profilePath = os.environ.get(PROFILE_ENV, '')
+    if profilePath:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+        def dumpProfile():
+            profiler.disable()
+            profiler.dump_stats(profilePath)
+        atexit.register(dumpProfile)
+    return tracer
+
+
+_command_tracer = None
+_tracing_started = False
+_tracing_lock = threading.Lock()
+
+
+def _CommandTracer():
+    #tracing (and profiling) start with the first command run, importing the module has no side effects
+    global _command_tracer, _tracing_started
+    if not _tracing_started:
+        with _tracing_lock:
+            if not _tracing_started:
+                _command_tracer = _StartTracing()
+                _tracing_started = True
+    return _command_tracer
+
+
+def RecordedCheck(func):
+    #decorator : runs the function as a sub-check, a True/False return value becomes its PASS/FAIL verdict
+    def wrapper(*args, **kwargs):
+        with GetResultsRecorder().Check(func.__name__) as check:
+            ret = func(*args, **kwargs)
+            if check.verdict is None and isinstance(ret, bool):
+                check.verdict = 'PASS' if ret else 'FAIL'
+            return ret
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+
+def ReportMarker(marker):
+    #sub-check markers like <DISTRO>_TEST_GRUB_VERIFICATION_SUCCESS, still printed for the existing log parsing
+    print(marker)
+    GetResultsRecorder().RecordMarker(marker)
+
+
+class _ResultLogHandler(logging.Handler):
+    def emit(self, record):
+        message = record.getMessage().strip()
+        if message in ('PASS', 'FAIL', 'ABORTED'):
+            suiteCheck = _CurrentSuiteCheck()
+            if suiteCheck is not None:
+                suiteCheck.result = message
+            else:
+                GetResultsRecorder().SetResult(message)
+
+
+ResultLog.addHandler(_ResultLogHandler())
 
 
 def UpdateState(testState):
+    suiteCheck = _CurrentSuiteCheck()
+    if suiteCheck is not None:
+        suiteCheck.state = testState
+        return
     stateFile = open('state.txt', 'w')
     stateFile.write(testState)
     stateFile.close()
+    GetResultsRecorder().SetState(testState)
+
+
+#In-process suite : SuiteRunner loads the WALA-*/VERIFY-* scripts as callables and runs them in one interpreter, so
+#the system facts, file cache, package index and constants.sh are shared instead of being rebuilt per script.
+#Scripts in SUITE_EXCLUSIVE_CHECKS change process or VM wide state (euid, hostname, agent restart) and run one at a
+#time after the concurrent batch. While a script runs in the suite its UpdateState, verdict, sub-checks and log lines
+#go to its own SuiteCheckResult, and all of them are written together to suite-results.json.
+SUITE_RESULTS_FILE = 'suite-results.json'
+SUITE_CHECK_PATTERNS = ['WALA-*.py', 'VERIFY-*.py']
+SUITE_EXCLUSIVE_CHECKS = ['WALA-VERIFY-FIREWALL-STATUS', 'WALA-VERIFY-HOSTNAME-CHANGE', 'WALA-VERIFY-VERBOSE-ENABLED-LOGS']
+#Scripts that parse their own command line also run one at a time, with sys.argv set to the arguments below while they
+#run. '{distro}' is the name DetectLinuxDistro.sh prints, the value the orchestrator passes when it runs them on its own.
+SUITE_CHECK_ARGS = {
+    'VERIFY-VHD-PREREQUISITES': ['--distro', '{distro}']
+}
+DEFAULT_SUITE_WORKERS = 4
+MAX_SUITE_LOG_LINES = 2000
+
+
+class SuiteCheckResult(object):
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        self.state = None
+        self.result = None
+        self.start = None
+        self.duration = 0.0
+        self.error = None
+        self.checks = []
+        self.logLines = []
+
+    def ToDict(self):
+        return {
+            'name': self.name,
+            'state': self.state,
+            'result': self.result,
+            'start': round(self.start or 0, 3),
+            'duration': round(self.duration, 3),
+            'error': self.error,
+            'checks': [check.ToDict() for check in self.checks],
+            'log': list(self.logLines)
+        }
+
+
+class _SuiteLogHandler(logging.Handler):
+    def emit(self, record):
+        suiteCheck = _CurrentSuiteCheck()
+        if suiteCheck is not None and len(suiteCheck.logLines) < MAX_SUITE_LOG_LINES:
+            suiteCheck.logLines.append(self.format(record))
+
+
+_suite_log_handler = _SuiteLogHandler()
+_suite_log_handler.setFormatter(RunFormatter)
+RunLog.addHandler(_suite_log_handler)
+ResultLog.addHandler(_suite_log_handler)
+
+
+class SuiteRunner(object):
+    def __init__(self, directory=None, maxWorkers=DEFAULT_SUITE_WORKERS, exclusive=None, path=SUITE_RESULTS_FILE,
+                 checkArgs=None):
+        #checkArgs : {check name : [arguments]}, added to and overriding SUITE_CHECK_ARGS
+        self.directory = directory or os.path.dirname(os.path.abspath(__file__))
+        self.maxWorkers = maxWorkers
+        self.exclusive = SUITE_EXCLUSIVE_CHECKS if exclusive is None else exclusive
+        self.path = path
+        self.checkArgs = dict(SUITE_CHECK_ARGS)
+        self.checkArgs.update(checkArgs or {})
+        self.results = []
+        self.compiled = {}
+        self.distro = None
+
+    def Discover(self, names=None):
+        #names are script names with or without .py, or glob patterns, default is every WALA-*/VERIFY-* script
+        import glob
+        paths = []
+        for pattern in (names or SUITE_CHECK_PATTERNS):
+            if not pattern.endswith('.py') and not glob.has_magic(pattern):
+                pattern = pattern + '.py'
+            matches = sorted(glob.glob(os.path.join(self.directory, pattern)))
+            if not matches:
+                RunLog.error("SuiteRunner : no check matches %s", pattern)
+            for each in matches:
+                if each not in paths:
+                    paths.append(each)
+        return paths
+
+    def _Source(self, path):
+        with open(path) as f:
+            return f.read()
+
+    def ParsesArguments(self, path):
+        return 'parse_args(' in self._Source(path)
+
+    def IsExclusive(self, path):
+        return os.path.splitext(os.path.basename(path))[0] in self.exclusive or self.ParsesArguments(path)
+
+    def Argv(self, path):
+        #the command line the script would get from the orchestrator
+        arguments = self.checkArgs.get(os.path.splitext(os.path.basename(path))[0], [])
+        if any('{distro}' in each for each in arguments) and self.distro is None:
+            lines = RunStream("bash %s" % os.path.join(self.directory, 'DetectLinuxDistro.sh'), timeout=60).stdout
+            self.distro = (lines.strip().splitlines() or ['Unknown'])[-1].strip()
+        return [path] + [each.replace('{distro}', self.distro or '') for each in arguments]
+
+    def Load(self, path):
+        #compile once, the returned callable runs the script in a fresh namespace like its own interpreter would
+        if path not in self.compiled:
+            self.compiled[path] = compile(self._Source(path), path, 'exec')
+        code = self.compiled[path]
+
+        def check():
+            namespace = {'__name__': '__main__', '__file__': path}
+            exec(code, namespace)
+        return check
+
+    def RunCheck(self, path, argv=None):
+        #argv replaces sys.argv while the check runs, only for checks run one at a time since it is process wide
+        result = SuiteCheckResult(os.path.splitext(os.path.basename(path))[0], path)
+        result.start = time.time()
+        _check_context.suiteCheck = result
+        savedArgv = sys.argv
+        if argv is not None:
+            sys.argv = argv
+        try:
+            self.Load(path)()
+        except SystemExit as e:
+            if e.code not in (None, 0):
+                result.error = "exit status %s" % e.code
+        except Exception as e:
+            import traceback
+            result.error = str(e)
+            RunLog.error("SuiteRunner : %s raised\n%s", result.name, traceback.format_exc())
+        finally:
+            sys.argv = savedArgv
+            _check_context.suiteCheck = None
+            _check_context.check = None
+        result.duration = time.time() - result.start
+        if result.error is not None and result.result is None:
+            result.result = 'ABORTED'
+        RunLog.info("SuiteRunner : %s : %s in %.2fs", result.name, result.result, result.duration)
+        return result
+
+    def Run(self, names=None):
+        startTime = time.time()
+        paths = self.Discover(names)
+        exclusive = [path for path in paths if self.IsExclusive(path)]
+        pending = deque([path for path in paths if path not in exclusive])
+        lock = threading.Lock()
+        resultsByPath = {}
+
+        def worker():
+            while True:
+                with lock:
+                    if not pending:
+                        return
+                    path = pending.popleft()
+                result = self.RunCheck(path)
+                with lock:
+                    resultsByPath[path] = result
+
+        workers = [threading.Thread(target=worker) for i in range(min(self.maxWorkers, len(pending)))]
+        for each in workers:
+            each.daemon = True
+            each.start()
+        for each in workers:
+            each.join()
+        for path in exclusive:
+            resultsByPath[path] = self.RunCheck(path, self.Argv(path))
+        self.results = [resultsByPath[path] for path in paths]
+        RunLog.info("SuiteRunner : %s checks (%s exclusive) on %s workers in %.2fs", len(paths), len(exclusive),
+                    len(workers), time.time() - startTime)
+        self.Save(time.time() - startTime)
+        return self.results
+
+    def Failed(self):
+        return [result for result in self.results if result.result != 'PASS']
+
+    def Save(self, duration=0.0):
+        import json
+        data = {
+            'host': os.uname()[1],
+            'duration': round(duration, 3),
+            'passed': len(self.results) - len(self.Failed()),
+            'failed': [result.name for result in self.Failed()],
+            'checks': [result.ToDict() for result in self.results]
+        }
+        tmpFile = self.path + '.tmp'
+        try:
+            with open(tmpFile, 'w') as f:
+                json.dump(data, f, separators=(',', ':'), sort_keys=True)
+            os.rename(tmpFile, self.path)
+        except (IOError, OSError) as e:
+            RunLog.error("Unable to write %s : %s", self.path, e)
 
 
 def GetFileContents(filepath):
@@ -295,7 +1496,7 @@ def GetFileContents(filepath):
 # Installation routines
 def YumPackageInstall(package):
     RunLog.info(("\nyum_package_install: " + package))
-    output = Run("yum install -y "+package)
+    output = RunStream("yum install -y "+package, timeout=INSTALL_TIMEOUT).stdout
     outputlist = re.split("\n", output)
 
     for line in outputlist:
@@ -370,7 +1571,7 @@ def AptgetPackageInstall(package, dbpasswd = "root"):
 def ZypperPackageInstall(package):
     RunLog.info( "\nzypper_package_install: " + package)
 
-    output = Run("zypper --non-interactive in "+package)
+    output = RunStream("zypper --non-interactive in "+package, timeout=INSTALL_TIMEOUT).stdout
     outputlist = re.split("\n", output)
         
     for line in outputlist:
@@ -415,19 +1616,186 @@ def ZypperPackageRemove(package):
     return False
  
  
+#Name -> version map of the installed packages, loaded from the rpm and/or dpkg database once per process.
+#zypper and yum both sit on top of rpm, so two queries cover every supported distro.
+RPM_QUERY_CMD = "rpm -qa --qf '%{NAME}\\t%{VERSION}-%{RELEASE}\\n' 2>/dev/null"
+DPKG_QUERY_CMD = "dpkg-query -W -f='${Package}\\t${Version}\\t${Status}\\n' 2>/dev/null"
+
+
+class InstalledPackages(object):
+    def __init__(self):
+        self.packages = None
+        self.lock = threading.Lock()
+
+    def _Load(self):
+        packages = {}
+        if LocateExecutable("rpm"):
+            for line in RunStream(RPM_QUERY_CMD, timeout=120).stdout.splitlines():
+                fields = line.split('\t')
+                if len(fields) == 2:
+                    packages[fields[0]] = fields[1]
+        if LocateExecutable("dpkg-query"):
+            for line in RunStream(DPKG_QUERY_CMD, timeout=120).stdout.splitlines():
+                fields = line.split('\t')
+                if len(fields) == 3 and fields[2].endswith(" installed"):
+                    #multiarch packages are listed as name:arch by some tools, index the bare name
+                    packages[fields[0].split(':')[0]] = fields[1]
+        RunLog.info("Loaded %s installed packages", len(packages))
+        return packages
+
+    def _Packages(self):
+        with self.lock:
+            if self.packages is None:
+                self.packages = self._Load()
+            return self.packages
+
+    def Has(self, name):
+        return name in self._Packages()
+
+    def Version(self, name):
+        return self._Packages().get(name)
+
+    def Glob(self, pattern):
+        import fnmatch
+        return sorted([name for name in self._Packages() if fnmatch.fnmatch(name, pattern)])
+
+    def Invalidate(self):
+        with self.lock:
+            self.packages = None
+
+
+_installed_packages = InstalledPackages()
+
+
+def GetInstalledPackages():
+    return _installed_packages
+
+
 def InstallPackage(package):
     RunLog.info( "\nInstall_package: "+package)
+    if GetInstalledPackages().Has(package):
+        RunLog.info(package + ": package is already installed, version " + GetInstalledPackages().Version(package))
+        return True
     [current_distro, distro_version] = DetectDistro()
-    if (("ubuntu" in current_distro) or  ("Debian" in current_distro)):
-        return AptgetPackageInstall(package)
-    elif (("rhel" in current_distro) or ("Oracle" in current_distro) or ("centos" in current_distro) or ("fedora" in current_distro)):
-        return YumPackageInstall(package)
-    elif (("SUSE" in current_distro) or ("opensuse" in current_distro) or ("sles" in current_distro)):
-        return ZypperPackageInstall(package)
+    packageManager = GetPackageManager(current_distro)
+    if packageManager == 'apt':
+        result = AptgetPackageInstall(package)
+    elif packageManager == 'yum':
+        result = YumPackageInstall(package)
+    elif packageManager == 'zypper':
+        result = ZypperPackageInstall(package)
     else:
         RunLog.error((package + ": package installation failed!"))
         RunLog.info((current_distro + ": Unrecognised Distribution OS Linux found!"))
         return False
+    GetInstalledPackages().Invalidate()
+    return result
+
+
+#Installs a list of packages with one package manager transaction : the distro is resolved once, packages already
+#present are skipped through the installed package index and the outcome of every package is reported separately.
+PACKAGE_MANAGER_COMMANDS = {
+    'apt': "DEBIAN_FRONTEND=noninteractive apt-get install -y ",
+    'yum': "yum install -y ",
+    'zypper': "zypper --non-interactive in "
+}
+PACKAGE_NOT_FOUND_PATTERNS = {
+    'apt': [r'^E: Unable to locate package (\S+)', r"^E: Package '(\S+)' has no installation candidate"],
+    'yum': [r'^No package (\S+) available', r'^No match for argument: (\S+)'],
+    'zypper': [r"^No provider of '(\S+)' found", r"^Package '(\S+)' not found"]
+}
+
+
+class PackageInstallResult(object):
+    def __init__(self, packageManager):
+        self.packageManager = packageManager
+        self.status = {}
+        self.commandResults = []
+
+    def Failed(self):
+        return sorted([name for name, status in self.status.items() if status not in ('installed', 'already-installed')])
+
+    def Succeeded(self):
+        return len(self.Failed()) == 0
+
+
+def GetPackageManager(current_distro=None):
+    #the distro test InstallPackage and InstallPackages both go through
+    if current_distro is None:
+        current_distro = DetectDistro()[0]
+    if (("ubuntu" in current_distro) or ("Debian" in current_distro)):
+        return 'apt'
+    elif (("rhel" in current_distro) or ("Oracle" in current_distro) or ("centos" in current_distro) or ("fedora" in current_distro)):
+        return 'yum'
+    elif (("SUSE" in current_distro) or ("opensuse" in current_distro) or ("sles" in current_distro)):
+        return 'zypper'
+    return None
+
+
+def _FindMissingPackages(packageManager, output):
+    missing = set()
+    for line in output.splitlines():
+        for pattern in PACKAGE_NOT_FOUND_PATTERNS[packageManager]:
+            matchObj = re.match(pattern, line.strip(), re.I)
+            if matchObj:
+                missing.add(matchObj.group(1).strip("'."))
+    return missing
+
+
+def InstallPackages(packages):
+    result = PackageInstallResult(None)
+    index = GetInstalledPackages()
+    pending = []
+    for package in packages:
+        if index.Has(package):
+            result.status[package] = 'already-installed'
+        elif package not in pending:
+            pending.append(package)
+    if not pending:
+        return result
+    packageManager = GetPackageManager()
+    result.packageManager = packageManager
+    if packageManager is None:
+        RunLog.error("InstallPackages : unrecognised distribution, cannot install " + ' '.join(pending))
+        for package in pending:
+            result.status[package] = 'failed'
+        return result
+    if packageManager == 'apt' and 'mysql-server' in pending:
+        #needs the debconf answers of AptgetPackageInstall
+        pending.remove('mysql-server')
+        result.status['mysql-server'] = 'installed' if AptgetPackageInstall('mysql-server') else 'failed'
+
+    missing = set()
+    transactionSucceeded = False
+    for attempt in range(2):
+        if not pending:
+            break
+        RunLog.info("InstallPackages : %s %s", packageManager, ' '.join(pending))
+        commandResult = RunStream(PACKAGE_MANAGER_COMMANDS[packageManager] + ' '.join(pending), timeout=INSTALL_TIMEOUT)
+        result.commandResults.append(commandResult)
+        newMissing = _FindMissingPackages(packageManager, commandResult.stdout + commandResult.stderr) & set(pending)
+        missing |= newMissing
+        #apt and dnf abort the whole transaction on a single unknown package, retry once without them
+        if attempt == 0 and commandResult.exitCode != 0 and newMissing:
+            pending = [package for package in pending if package not in newMissing]
+            continue
+        transactionSucceeded = commandResult.Succeeded()
+        break
+
+    index.Invalidate()
+    for package in packages:
+        if package in result.status:
+            continue
+        if package in missing:
+            result.status[package] = 'not-found'
+        elif index.Has(package) or transactionSucceeded:
+            #a clean transaction also covers names that are only provided by another package
+            result.status[package] = 'installed'
+        else:
+            result.status[package] = 'failed'
+    for package in sorted(result.status):
+        RunLog.info("InstallPackages : %s : %s", package, result.status[package])
+    return result
 
 
 def InstallDeb(file_path):
@@ -477,6 +1845,7 @@ def InstallRpm(file_path, package_name):
 
 def GetServerCommand():
         #for error checking
+        argparse = _ImportArgparse()
         parser = argparse.ArgumentParser()
 
         parser.add_argument('-u', '--udp', help='switch : starts the server in udp data packets listening mode.', choices=['yes', 'no'] )
@@ -509,7 +1878,8 @@ def StartServer(server):
     StopServer()
     RunLog.info("Starting iperf server..")
     Run(server)
-    Run("sleep 1")
+    WaitUntil(lambda: "listening" in ReadFile('iperf-server.txt'), timeout=10, initialInterval=0.1, maxInterval=1,
+              description="iperf server listening")
 
     iperfstatus = open('iperf-server.txt', 'r')
     output = iperfstatus.read()
@@ -532,9 +1902,16 @@ def StartServer(server):
 
 
 def AnalyseClientUpdateResult():
+        import json
         iperfstatus = open('iperf-client.txt', 'r')
         output = iperfstatus.read()
         #print output
+        #keep the interval data : the bandwidth statistics go to the log and the whole series to iperf-client.json
+        intervals = IperfParser().Feed(output).Close()
+        if intervals.samples:
+            RunLog.info("iperf bandwidth : %s", intervals.Stats())
+            with open('iperf-client.json', 'w') as f:
+                json.dump(intervals.ToDict(), f, separators=(',', ':'))
         Failure = 0
         RunLog.info("Checking if client was connected to server..")
         if ("connected" in output) :
@@ -589,6 +1966,917 @@ def AnalyseClientUpdateResult():
                         UpdateState("TestCompleted")
 
 
+#iperf output parser : IperfParser takes iperf (2) or iperf3 output, text or JSON (whole document or --json-stream),
+#fed all at once or line by line while the run is still writing it (Follow/Poll), and turns every interval report into
+#an IperfSample per stream (and [SUM]) : bytes, bandwidth, jitter, loss, retransmits. The end-of-test summary lines
+#are kept apart from the time series. Stats() gives mean, p5/p50/p99 and a stability score (1 - coefficient of
+#variation, 1.0 is a perfectly flat run) of the aggregate bandwidth per interval.
+IPERF_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+IPERF_RATE_UNITS = {'': 1, 'K': 1e3, 'M': 1e6, 'G': 1e9, 'T': 1e12}
+#patterns are left to re.match / re.search, which compile them on first use and cache them, not at import
+IPERF_INTERVAL_RX = (r'^\[\s*(?P<stream>\d+|SUM)\]\s+(?P<start>[\d.]+)\s*-\s*(?P<end>[\d.]+)\s+sec\s+'
+                     r'(?P<transfer>[\d.]+)\s+(?P<transferUnit>[KMGT]?)Bytes\s+'
+                     r'(?P<rate>[\d.]+)\s+(?P<rateUnit>[KMGT]?)bits/sec(?P<rest>.*)$')
+IPERF_UDP_RX = r'(?P<jitter>[\d.]+)\s+ms\s+(?P<lost>\d+)\s*/\s*(?P<packets>\d+)'
+IPERF_RETRANSMITS_RX = r'^\s*(?P<retransmits>\d+)\s+[\d.]+\s*[KMGT]?Bytes'
+IPERF_DATAGRAMS_RX = r'^\s*(?P<packets>\d+)\s*$'
+IPERF_SUMMARY_SEPARATOR = '- - - - -'
+
+
+class IperfSample(object):
+    def __init__(self, stream, start, end, bytes, bandwidth):
+        self.stream = stream
+        self.start = start
+        self.end = end
+        self.bytes = bytes
+        self.bandwidth = bandwidth
+        self.jitter = None
+        self.lost = None
+        self.packets = None
+        self.retransmits = None
+
+    def ToDict(self):
+        sample = {'stream': self.stream, 'start': self.start, 'end': self.end, 'bytes': self.bytes,
+                  'bandwidth': self.bandwidth}
+        for name in ('jitter', 'lost', 'packets', 'retransmits'):
+            if getattr(self, name) is not None:
+                sample[name] = getattr(self, name)
+        return sample
+
+
+def _Percentile(sortedValues, percent):
+    #nearest-rank percentile of an already sorted list
+    import math
+    if not sortedValues:
+        return None
+    rank = int(math.ceil(percent / 100.0 * len(sortedValues)))
+    return sortedValues[min(max(rank, 1), len(sortedValues)) - 1]
+
+
+class IperfParser(object):
+    def __init__(self):
+        self.samples = []
+        self.lastSamples = {}
+        self.summary = []
+        self.inSummary = False
+        self.jsonLines = []
+        self.isJson = None
+        self.pending = ''
+        self.follower = None
+        self.errors = []
+
+    def Feed(self, text):
+        #accepts partial lines, only complete lines are parsed
+        lines = (self.pending + text).split('\n')
+        self.pending = lines.pop()
+        for line in lines:
+            self.FeedLine(line)
+        return self
+
+    def FeedLine(self, line):
+        if self.isJson is None and line.strip():
+            self.isJson = line.lstrip().startswith('{')
+        if self.isJson:
+            self._FeedJsonLine(line)
+            return
+        if IPERF_SUMMARY_SEPARATOR in line:
+            self.inSummary = True
+            return
+        match = re.match(IPERF_INTERVAL_RX, line.strip())
+        if match is None:
+            if 'error' in line.lower():
+                self.errors.append(line.strip())
+            return
+        sample = IperfSample(match.group('stream'), float(match.group('start')), float(match.group('end')),
+                             int(float(match.group('transfer')) * IPERF_UNITS[match.group('transferUnit')]),
+                             float(match.group('rate')) * IPERF_RATE_UNITS[match.group('rateUnit')])
+        rest = match.group('rest')
+        udp = re.search(IPERF_UDP_RX, rest)
+        if udp is not None:
+            sample.jitter = float(udp.group('jitter'))
+            sample.lost = int(udp.group('lost'))
+            sample.packets = int(udp.group('packets'))
+        else:
+            #iperf3 client columns : Retr and Cwnd for TCP, Total Datagrams for UDP
+            retransmits = re.match(IPERF_RETRANSMITS_RX, rest)
+            datagrams = re.match(IPERF_DATAGRAMS_RX, rest)
+            if retransmits is not None:
+                sample.retransmits = int(retransmits.group('retransmits'))
+            elif datagrams is not None:
+                sample.packets = int(datagrams.group('packets'))
+        if self.inSummary or self._IsSummary(sample):
+            self.summary.append(sample)
+        else:
+            self.samples.append(sample)
+            self.lastSamples[sample.stream] = sample
+
+    def _IsSummary(self, sample):
+        #iperf 2 has no separator : its summary starts at 0 and spans several of the preceding intervals
+        if sample.start != 0:
+            return False
+        previous = self.lastSamples.get(sample.stream)
+        if previous is None:
+            return False
+        return sample.end - sample.start > 1.5 * (previous.end - previous.start)
+
+    def _FeedJsonLine(self, line):
+        import json
+        stripped = line.strip()
+        if not stripped:
+            return
+        try:
+            event = json.loads(stripped)
+        except ValueError:
+            #a pretty printed document : collected until it parses as a whole
+            self.jsonLines.append(line)
+            try:
+                document = json.loads('\n'.join(self.jsonLines))
+            except ValueError:
+                return
+            self.jsonLines = []
+            self._AddJsonDocument(document)
+            return
+        if self.jsonLines:
+            self.jsonLines.append(line)
+            return
+        if 'event' in event:
+            #iperf3 --json-stream
+            if event['event'] == 'interval':
+                self._AddJsonInterval(event.get('data', {}))
+            elif event['event'] == 'end':
+                self._AddJsonEnd(event.get('data', {}))
+            elif event['event'] == 'error':
+                self.errors.append(str(event.get('data')))
+        else:
+            self._AddJsonDocument(event)
+
+    def _JsonSample(self, stream, data):
+        sample = IperfSample(stream, round(data.get('start', 0), 3), round(data.get('end', 0), 3),
+                             int(data.get('bytes', 0)), float(data.get('bits_per_second', 0)))
+        sample.jitter = data.get('jitter_ms')
+        sample.lost = data.get('lost_packets')
+        sample.packets = data.get('packets')
+        sample.retransmits = data.get('retransmits')
+        return sample
+
+    def _AddJsonInterval(self, interval):
+        for stream in interval.get('streams', []):
+            self.samples.append(self._JsonSample(str(stream.get('socket', '')), stream))
+        if 'sum' in interval and len(interval.get('streams', [])) > 1:
+            self.samples.append(self._JsonSample('SUM', interval['sum']))
+
+    def _AddJsonEnd(self, end):
+        for key in ('sum', 'sum_sent', 'sum_received'):
+            if key in end:
+                sample = self._JsonSample('SUM', end[key])
+                sample.kind = key
+                self.summary.append(sample)
+
+    def _AddJsonDocument(self, document):
+        for interval in document.get('intervals', []):
+            self._AddJsonInterval(interval)
+        self._AddJsonEnd(document.get('end', {}))
+        if document.get('error'):
+            self.errors.append(document['error'])
+
+    def Follow(self, path):
+        #reads a file that iperf is still writing : every Poll() parses what was appended since the previous one
+        self.follower = LogFollower(path, offset=0)
+        return self.Poll()
+
+    def Poll(self):
+        for line in self.follower.ReadNewLines():
+            self.FeedLine(line)
+        return self
+
+    def Close(self):
+        if self.pending:
+            self.FeedLine(self.pending)
+            self.pending = ''
+        if self.follower is not None:
+            if self.follower.pending:
+                self.FeedLine(_ToText(self.follower.pending))
+            self.follower.Close()
+        return self
+
+    def Streams(self):
+        return sorted(set([sample.stream for sample in self.samples]))
+
+    def Series(self, stream=None):
+        #the aggregate time series : the [SUM] lines when there are several streams, else the single stream
+        if stream is None:
+            stream = 'SUM' if 'SUM' in self.Streams() else (self.Streams() or [None])[0]
+        return [sample for sample in self.samples if sample.stream == stream]
+
+    def Stats(self, stream=None):
+        import math
+        series = self.Series(stream)
+        values = sorted([sample.bandwidth for sample in series])
+        if not values:
+            return {'intervals': 0}
+        mean = sum(values) / len(values)
+        deviation = math.sqrt(sum([(value - mean) ** 2 for value in values]) / len(values))
+        stats = {'intervals': len(values), 'mean': mean, 'min': values[0], 'max': values[-1],
+                 'p5': _Percentile(values, 5), 'p50': _Percentile(values, 50), 'p99': _Percentile(values, 99),
+                 'stability': round(max(0.0, 1.0 - deviation / mean), 4) if mean > 0 else 0.0}
+        jitters = [sample.jitter for sample in series if sample.jitter is not None]
+        if jitters:
+            stats['meanJitterMs'] = sum(jitters) / len(jitters)
+        lost = [sample.lost for sample in series if sample.lost is not None]
+        packets = [sample.packets for sample in series if sample.packets is not None]
+        if lost and packets and sum(packets):
+            stats['lossPercent'] = 100.0 * sum(lost) / sum(packets)
+        retransmits = [sample.retransmits for sample in series if sample.retransmits is not None]
+        if retransmits:
+            stats['retransmits'] = sum(retransmits)
+        return stats
+
+    def ToDict(self):
+        return {'streams': self.Streams(), 'stats': self.Stats(), 'errors': list(self.errors),
+                'series': [sample.ToDict() for sample in self.samples],
+                'summary': [sample.ToDict() for sample in self.summary]}
+
+
+def ParseIperfFile(path):
+    parser = IperfParser()
+    with open(path, 'rb') as f:
+        parser.Feed(_ToText(f.read()))
+    return parser.Close()
+
+
+#Throughput tester : a built-in stand-in for the iperf helpers above, for quick network sanity checks on images without
+#iperf. ThroughputServer receives N parallel TCP streams (or UDP streams of sequenced datagrams) into one reused buffer,
+#RunThroughputClient sends for a fixed duration over N streams with sendfile() (TCP, when the platform has it) or
+#memoryview sends, and the ThroughputReport has per-interval samples, per-stream totals, Gbps, TCP retransmits from
+#TCP_INFO where the kernel reports them and, for UDP, the receiver's loss and jitter.
+THROUGHPUT_PORT = 5201
+THROUGHPUT_DURATION = 10
+THROUGHPUT_INTERVAL = 1.0
+THROUGHPUT_BUFFER_SIZE = 128 * 1024
+UDP_DATAGRAM_SIZE = 1400
+UDP_BANDWIDTH = 100 * 1000 * 1000
+THROUGHPUT_RESULTS_FILE = 'throughput.json'
+_UDP_HEADER = '>IQd'
+_UDP_FIN_SEQUENCE = 0xffffffffffffffff
+_TCP_INFO = 11
+_TCP_INFO_TOTAL_RETRANS_OFFSET = 100
+
+
+class StreamStats(object):
+    def __init__(self, streamId, interval=THROUGHPUT_INTERVAL):
+        self.streamId = streamId
+        self.interval = interval
+        self.start = time.time()
+        self.end = None
+        self.bytes = 0
+        self.samples = []
+        self.retransmits = None
+        #UDP : packets sent (the highest sequence + 1 on the receiver), received and lost datagrams
+        self.packets = 0
+        self.received = 0
+        self.lost = 0
+        self.outOfOrder = 0
+        self.jitter = 0.0
+        self.error = None
+
+    def Add(self, count, now=None):
+        now = now or time.time()
+        slot = int((now - self.start) / self.interval)
+        while len(self.samples) <= slot:
+            self.samples.append(0)
+        self.samples[slot] += count
+        self.bytes += count
+
+    def Duration(self):
+        return max((self.end or time.time()) - self.start, 1e-9)
+
+    def Gbps(self):
+        return self.bytes * 8 / self.Duration() / 1e9
+
+    def LossPercent(self):
+        return 100.0 * self.lost / self.packets if self.packets else None
+
+    def ToDict(self):
+        stats = {'stream': self.streamId, 'bytes': self.bytes, 'seconds': round(self.Duration(), 3),
+                 'gbps': round(self.Gbps(), 4), 'samples': list(self.samples), 'error': self.error}
+        if self.retransmits is not None:
+            stats['retransmits'] = self.retransmits
+        if self.packets:
+            stats.update({'packets': self.packets, 'received': self.received, 'lost': self.lost,
+                          'lossPercent': round(self.LossPercent(), 4), 'outOfOrder': self.outOfOrder,
+                          'jitterMs': round(self.jitter * 1000, 3)})
+        return stats
+
+
+class ThroughputReport(object):
+    def __init__(self, protocol, interval=THROUGHPUT_INTERVAL):
+        self.protocol = protocol
+        self.interval = interval
+        self.streams = []
+
+    def Bytes(self):
+        return sum([stream.bytes for stream in self.streams])
+
+    def Duration(self):
+        return max([stream.Duration() for stream in self.streams] or [0])
+
+    def Gbps(self):
+        duration = self.Duration()
+        return self.Bytes() * 8 / duration / 1e9 if duration > 0 else 0.0
+
+    def Intervals(self):
+        count = max([len(stream.samples) for stream in self.streams] or [0])
+        intervals = []
+        for slot in range(count):
+            total = sum([stream.samples[slot] for stream in self.streams if slot < len(stream.samples)])
+            intervals.append({'start': round(slot * self.interval, 3), 'end': round((slot + 1) * self.interval, 3),
+                              'bytes': total, 'gbps': round(total * 8 / self.interval / 1e9, 4)})
+        return intervals
+
+    def Succeeded(self):
+        return bool(self.streams) and self.Bytes() > 0 and not [stream for stream in self.streams if stream.error]
+
+    def ToDict(self):
+        retransmits = [stream.retransmits for stream in self.streams if stream.retransmits is not None]
+        report = {'protocol': self.protocol, 'streams': len(self.streams), 'seconds': round(self.Duration(), 3),
+                  'bytes': self.Bytes(), 'gbps': round(self.Gbps(), 4), 'intervals': self.Intervals(),
+                  'perStream': [stream.ToDict() for stream in self.streams]}
+        if retransmits:
+            report['retransmits'] = sum(retransmits)
+        if self.protocol == 'udp':
+            packets = sum([stream.packets for stream in self.streams])
+            lost = sum([stream.lost for stream in self.streams])
+            report['lossPercent'] = round(100.0 * lost / packets, 4) if packets else None
+        return report
+
+    def Save(self, path=THROUGHPUT_RESULTS_FILE):
+        import json
+        with open(path, 'w') as f:
+            json.dump(self.ToDict(), f, indent=1, sort_keys=True)
+
+
+def _TcpRetransmits(sock):
+    import socket
+    import struct
+    try:
+        info = sock.getsockopt(socket.IPPROTO_TCP, _TCP_INFO, _TCP_INFO_TOTAL_RETRANS_OFFSET + 4)
+        return struct.unpack_from('I', info, _TCP_INFO_TOTAL_RETRANS_OFFSET)[0]
+    except (socket.error, struct.error):
+        return None
+
+
+class ThroughputServer(object):
+    def __init__(self, port=THROUGHPUT_PORT, udp=False, bufferSize=THROUGHPUT_BUFFER_SIZE, interval=THROUGHPUT_INTERVAL,
+                 bindAddress=''):
+        self.port = port
+        self.udp = udp
+        self.bufferSize = bufferSize
+        self.interval = interval
+        self.bindAddress = bindAddress
+        self.report = ThroughputReport('udp' if udp else 'tcp', interval)
+        self.udpStreams = {}
+        self.sock = None
+        self.running = False
+        self.threads = []
+        self.lock = threading.Lock()
+
+    def Start(self):
+        import socket
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM if self.udp else socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.udp:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        self.sock.bind((self.bindAddress, self.port))
+        self.port = self.sock.getsockname()[1]
+        if not self.udp:
+            self.sock.listen(64)
+        self.sock.settimeout(0.5)
+        self.running = True
+        thread = threading.Thread(target=self._ServeUdp if self.udp else self._AcceptTcp)
+        thread.daemon = True
+        thread.start()
+        self.threads.append(thread)
+        RunLog.info("ThroughputServer listening on %s/%s", self.port, self.report.protocol)
+        return self.port
+
+    def _AcceptTcp(self):
+        import socket
+        while self.running:
+            try:
+                connection = self.sock.accept()[0]
+            except socket.timeout:
+                continue
+            except socket.error:
+                break
+            with self.lock:
+                stream = StreamStats(len(self.report.streams), self.interval)
+                self.report.streams.append(stream)
+            thread = threading.Thread(target=self._ReceiveTcp, args=(connection, stream))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def _ReceiveTcp(self, connection, stream):
+        import socket
+        view = memoryview(bytearray(self.bufferSize))
+        connection.settimeout(1.0)
+        try:
+            #read to the end of the stream even once Stop() was called, only an idle connection is given up on
+            while True:
+                try:
+                    count = connection.recv_into(view)
+                except socket.timeout:
+                    if self.running:
+                        continue
+                    break
+                if not count:
+                    break
+                stream.Add(count)
+        except socket.error as e:
+            stream.error = str(e)
+        finally:
+            stream.end = time.time()
+            connection.close()
+
+    def _ServeUdp(self):
+        import json
+        import socket
+        import struct
+        buffer = bytearray(max(self.bufferSize, 65536))
+        view = memoryview(buffer)
+        headerSize = struct.calcsize(_UDP_HEADER)
+        while self.running:
+            try:
+                count, address = self.sock.recvfrom_into(view)
+            except socket.timeout:
+                continue
+            except socket.error:
+                break
+            if count < headerSize:
+                continue
+            now = time.time()
+            streamId, sequence, sentAt = struct.unpack_from(_UDP_HEADER, bytes(buffer[:headerSize]), 0)
+            key = (address, streamId)
+            with self.lock:
+                stream = self.udpStreams.get(key)
+                if stream is None:
+                    stream = StreamStats(len(self.report.streams), self.interval)
+                    stream.highest = -1
+                    stream.transit = None
+                    self.udpStreams[key] = stream
+                    self.report.streams.append(stream)
+            if sequence == _UDP_FIN_SEQUENCE:
+                #the client asks for the receiver's view of its stream
+                stream.end = stream.end or now
+                self.sock.sendto(json.dumps(stream.ToDict()).encode('utf-8'), address)
+                continue
+            stream.Add(count, now)
+            stream.received += 1
+            if sequence > stream.highest:
+                stream.lost += max(0, sequence - stream.highest - 1)
+                stream.highest = sequence
+                stream.packets = sequence + 1
+            else:
+                stream.outOfOrder += 1
+                stream.lost = max(0, stream.lost - 1)
+            #RFC 3550 interarrival jitter
+            transit = now - sentAt
+            if stream.transit is not None:
+                stream.jitter += (abs(transit - stream.transit) - stream.jitter) / 16.0
+            stream.transit = transit
+
+    def Stop(self):
+        self.running = False
+        if self.sock is not None:
+            self.sock.close()
+        for thread in self.threads:
+            thread.join(2)
+        return self.report
+
+
+def _SendTcpStream(host, port, stream, deadline, bufferSize, zeroCopy, payloadFile):
+    import socket
+    import struct
+    sock = socket.create_connection((host, port), 10)
+    try:
+        #a python level timeout makes the socket non-blocking, which sendfile() would see as EAGAIN : the send
+        #timeout is set on the socket itself instead
+        sock.settimeout(None)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO, struct.pack('ll', int(deadline - time.time()) + 10, 0))
+        if zeroCopy and payloadFile is not None:
+            fd = payloadFile.fileno()
+            while time.time() < deadline:
+                stream.Add(os.sendfile(sock.fileno(), fd, 0, bufferSize))
+        else:
+            view = memoryview(bytearray(os.urandom(bufferSize)))
+            while time.time() < deadline:
+                offset = 0
+                while offset < bufferSize:
+                    sent = sock.send(view[offset:])
+                    offset += sent
+                    stream.Add(sent)
+        stream.end = time.time()
+        stream.retransmits = _TcpRetransmits(sock)
+        sock.shutdown(socket.SHUT_WR)
+    finally:
+        sock.close()
+
+
+def _SendUdpStream(host, port, stream, deadline, datagramSize, bandwidth):
+    import json
+    import socket
+    import struct
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        payload = bytearray(os.urandom(max(datagramSize, struct.calcsize(_UDP_HEADER))))
+        gap = datagramSize * 8.0 / bandwidth if bandwidth else 0
+        sequence = 0
+        startTime = time.time()
+        while True:
+            now = time.time()
+            if now >= deadline:
+                break
+            if gap and startTime + sequence * gap > now:
+                time.sleep(min(startTime + sequence * gap - now, 0.01))
+                continue
+            struct.pack_into(_UDP_HEADER, payload, 0, stream.streamId, sequence, now)
+            try:
+                stream.Add(sock.sendto(payload, (host, port)))
+            except socket.error:
+                #ENOBUFS : the local queue is full, the datagram counts as lost on the receiver
+                pass
+            sequence += 1
+        stream.end = time.time()
+        stream.packets = sequence
+        #ask the receiver for its view, the FIN datagram is repeated until it answers
+        sock.settimeout(0.5)
+        for attempt in range(6):
+            struct.pack_into(_UDP_HEADER, payload, 0, stream.streamId, _UDP_FIN_SEQUENCE, time.time())
+            sock.sendto(payload[:struct.calcsize(_UDP_HEADER)], (host, port))
+            try:
+                received = json.loads(_ToText(sock.recvfrom(65536)[0]))
+            except socket.timeout:
+                continue
+            stream.received = received.get('received', 0)
+            stream.lost = max(0, sequence - stream.received)
+            stream.jitter = received.get('jitterMs', 0) / 1000.0
+            stream.outOfOrder = received.get('outOfOrder', 0)
+            return
+        stream.error = 'no report from the receiver'
+    finally:
+        sock.close()
+
+
+def RunThroughputClient(host, port=THROUGHPUT_PORT, streams=1, duration=THROUGHPUT_DURATION, udp=False,
+                        bufferSize=None, bandwidth=UDP_BANDWIDTH, interval=THROUGHPUT_INTERVAL, zeroCopy=True):
+    #bufferSize : TCP send size (THROUGHPUT_BUFFER_SIZE) or UDP datagram size (UDP_DATAGRAM_SIZE),
+    #bandwidth : UDP bits per second per stream, None sends as fast as possible
+    report = ThroughputReport('udp' if udp else 'tcp', interval)
+    bufferSize = bufferSize or (UDP_DATAGRAM_SIZE if udp else THROUGHPUT_BUFFER_SIZE)
+    payloadFile = None
+    if not udp and zeroCopy and hasattr(os, 'sendfile'):
+        import tempfile
+        payloadFile = tempfile.TemporaryFile()
+        payloadFile.write(os.urandom(bufferSize))
+        payloadFile.flush()
+    threads = []
+    deadline = time.time() + duration
+    for streamId in range(streams):
+        stream = StreamStats(streamId, interval)
+        report.streams.append(stream)
+
+        def sender(stream=stream):
+            try:
+                if udp:
+                    _SendUdpStream(host, port, stream, deadline, bufferSize, bandwidth)
+                else:
+                    _SendTcpStream(host, port, stream, deadline, bufferSize, zeroCopy, payloadFile)
+            except Exception as e:
+                stream.error = str(e)
+                stream.end = stream.end or time.time()
+        thread = threading.Thread(target=sender)
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    if payloadFile is not None:
+        payloadFile.close()
+    RunLog.info("Throughput to %s:%s : %s x %s for %.1fs : %.3f Gbps", host, port, streams, report.protocol,
+                report.Duration(), report.Gbps())
+    return report
+
+
+#Latency probe : TCP ping-pong, UDP echo and TCP connect time against LatencyEchoServer, complementing the
+#perf_lagscope.sh runs. Round trips go into a LatencyHistogram, a fixed array of log-linear buckets over nanoseconds :
+#32 linear buckets per power of two keep every value within ~3% of the truth, up to ~18 minutes, in under 5 KB no
+#matter how many samples, and percentiles up to p99.99 are read back from the counts without keeping raw samples.
+LATENCY_PORT = 5202
+LATENCY_COUNT = 10000
+LATENCY_MESSAGE_SIZE = 4
+LATENCY_TIMEOUT = 1.0
+LATENCY_PERCENTILES = [50, 90, 99, 99.9, 99.99]
+LATENCY_RESULTS_FILE = 'latency.json'
+_HISTOGRAM_SUB_BITS = 5
+_HISTOGRAM_MAX_BITS = 40
+_Clock = getattr(time, 'perf_counter', time.time)
+
+
+class LatencyHistogram(object):
+    def __init__(self):
+        import array
+        self.subBuckets = 1 << _HISTOGRAM_SUB_BITS
+        #one linear range below 2^5, then one range per magnitude 2^5 .. 2^40 (the last one also takes larger values)
+        size = self.subBuckets * (_HISTOGRAM_MAX_BITS - _HISTOGRAM_SUB_BITS + 2)
+        self.counts = array.array('I', [0]) * size
+        self.count = 0
+        self.total = 0
+        self.minimum = None
+        self.maximum = None
+
+    def _Index(self, value):
+        if value < self.subBuckets:
+            return value
+        magnitude = min(len(bin(value)) - 3, _HISTOGRAM_MAX_BITS)
+        shift = magnitude - _HISTOGRAM_SUB_BITS
+        offset = min((value >> shift) - self.subBuckets, self.subBuckets - 1)
+        return self.subBuckets + shift * self.subBuckets + offset
+
+    def _Bounds(self, index):
+        #(lowest value, width) of a bucket
+        if index < self.subBuckets:
+            return index, 1
+        shift, offset = divmod(index - self.subBuckets, self.subBuckets)
+        return (self.subBuckets + offset) << shift, 1 << shift
+
+    def Record(self, nanoseconds):
+        value = max(0, int(nanoseconds))
+        self.counts[self._Index(value)] += 1
+        self.count += 1
+        self.total += value
+        if self.minimum is None or value < self.minimum:
+            self.minimum = value
+        if self.maximum is None or value > self.maximum:
+            self.maximum = value
+
+    def RecordSeconds(self, seconds):
+        self.Record(seconds * 1e9)
+
+    def Merge(self, other):
+        for index, count in enumerate(other.counts):
+            if count:
+                self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        for value in (other.minimum, other.maximum):
+            if value is not None:
+                self.minimum = value if self.minimum is None else min(self.minimum, value)
+                self.maximum = value if self.maximum is None else max(self.maximum, value)
+
+    def Mean(self):
+        return float(self.total) / self.count if self.count else None
+
+    def Percentile(self, percent):
+        #the middle of the bucket holding the nearest-rank sample, clamped to the exact min and max
+        import math
+        if not self.count:
+            return None
+        rank = max(1, int(math.ceil(percent / 100.0 * self.count)))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                low, width = self._Bounds(index)
+                return min(max(low + (width - 1) / 2.0, self.minimum), self.maximum)
+        return self.maximum
+
+    def MemoryBytes(self):
+        return self.counts.itemsize * len(self.counts)
+
+    def ToDict(self, percentiles=LATENCY_PERCENTILES):
+        #microseconds, plus the non-empty buckets so histograms from several runs can be merged later
+        def micro(value):
+            return round(value / 1000.0, 3) if value is not None else None
+        return {
+            'count': self.count,
+            'minUs': micro(self.minimum),
+            'meanUs': micro(self.Mean()),
+            'maxUs': micro(self.maximum),
+            'percentilesUs': dict([('p%s' % percent, micro(self.Percentile(percent))) for percent in percentiles]),
+            'buckets': [[index, count] for index, count in enumerate(self.counts) if count]
+        }
+
+
+class LatencyReport(object):
+    def __init__(self, mode, host, port):
+        self.mode = mode
+        self.host = host
+        self.port = port
+        self.histogram = LatencyHistogram()
+        self.timeouts = 0
+        self.errors = []
+        self.duration = 0.0
+
+    def Succeeded(self):
+        return self.histogram.count > 0 and not self.errors
+
+    def ToDict(self):
+        report = {'mode': self.mode, 'host': self.host, 'port': self.port, 'seconds': round(self.duration, 3),
+                  'timeouts': self.timeouts, 'errors': self.errors[:10]}
+        report.update(self.histogram.ToDict())
+        return report
+
+    def Save(self, path=LATENCY_RESULTS_FILE):
+        import json
+        with open(path, 'w') as f:
+            json.dump(self.ToDict(), f, separators=(',', ':'), sort_keys=True)
+
+
+class LatencyEchoServer(object):
+    #echoes TCP streams and UDP datagrams on the same port, a TCP connection closed without data is a connect probe
+    def __init__(self, port=LATENCY_PORT, bindAddress=''):
+        self.port = port
+        self.bindAddress = bindAddress
+        self.running = False
+        self.sockets = []
+        self.threads = []
+
+    def Start(self):
+        import socket
+        tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        tcp.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        tcp.bind((self.bindAddress, self.port))
+        self.port = tcp.getsockname()[1]
+        tcp.listen(128)
+        udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        udp.bind((self.bindAddress, self.port))
+        for sock in (tcp, udp):
+            sock.settimeout(0.5)
+            self.sockets.append(sock)
+        self.running = True
+        for target, sock in ((self._AcceptTcp, tcp), (self._EchoUdp, udp)):
+            thread = threading.Thread(target=target, args=(sock,))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+        RunLog.info("LatencyEchoServer listening on %s", self.port)
+        return self.port
+
+    def _AcceptTcp(self, listener):
+        import socket
+        while self.running:
+            try:
+                connection = listener.accept()[0]
+            except socket.timeout:
+                continue
+            except socket.error:
+                break
+            thread = threading.Thread(target=self._EchoTcp, args=(connection,))
+            thread.daemon = True
+            thread.start()
+
+    def _EchoTcp(self, connection):
+        import socket
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        buffer = bytearray(65536)
+        view = memoryview(buffer)
+        try:
+            while self.running:
+                count = connection.recv_into(view)
+                if not count:
+                    break
+                connection.sendall(view[:count])
+        except socket.error:
+            pass
+        finally:
+            connection.close()
+
+    def _EchoUdp(self, sock):
+        import socket
+        buffer = bytearray(65536)
+        view = memoryview(buffer)
+        while self.running:
+            try:
+                count, address = sock.recvfrom_into(view)
+                sock.sendto(view[:count], address)
+            except socket.timeout:
+                continue
+            except socket.error:
+                if not self.running:
+                    break
+
+    def Stop(self):
+        self.running = False
+        for sock in self.sockets:
+            sock.close()
+        for thread in self.threads:
+            thread.join(2)
+
+
+def _RecvExactly(sock, view, size):
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:size])
+        if not count:
+            raise IOError('connection closed by the server')
+        received += count
+
+
+def _ProbeRounds(count, deadline):
+    #round numbers until count or the deadline, whichever comes first
+    number = 0
+    while number < count and (deadline is None or time.time() < deadline):
+        yield number
+        number += 1
+
+
+def _ProbeTcpPingPong(report, host, port, count, deadline, messageSize, timeout, interval):
+    import socket
+    sock = socket.create_connection((host, port), timeout)
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.settimeout(timeout)
+        message = bytearray(os.urandom(messageSize))
+        view = memoryview(bytearray(messageSize))
+        for each in _ProbeRounds(count, deadline):
+            startTime = _Clock()
+            sock.sendall(message)
+            _RecvExactly(sock, view, messageSize)
+            report.histogram.RecordSeconds(_Clock() - startTime)
+            if interval:
+                time.sleep(interval)
+    finally:
+        sock.close()
+
+
+def _ProbeUdpEcho(report, host, port, count, deadline, messageSize, timeout, interval):
+    import socket
+    import struct
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.connect((host, port))
+        message = bytearray(os.urandom(max(messageSize, 8)))
+        reply = bytearray(len(message))
+        for sequence in _ProbeRounds(count, deadline):
+            struct.pack_into('>Q', message, 0, sequence)
+            startTime = _Clock()
+            sock.send(message)
+            while True:
+                #late replies to earlier, timed out datagrams are skipped by their sequence number
+                remaining = timeout - (_Clock() - startTime)
+                if remaining <= 0:
+                    report.timeouts += 1
+                    break
+                sock.settimeout(remaining)
+                try:
+                    sock.recv_into(reply)
+                except socket.timeout:
+                    report.timeouts += 1
+                    break
+                if struct.unpack_from('>Q', bytes(reply[:8]))[0] == sequence:
+                    report.histogram.RecordSeconds(_Clock() - startTime)
+                    break
+            if interval:
+                time.sleep(interval)
+    finally:
+        sock.close()
+
+
+def _ProbeConnect(report, host, port, count, deadline, messageSize, timeout, interval):
+    import socket
+    for each in _ProbeRounds(count, deadline):
+        startTime = _Clock()
+        try:
+            sock = socket.create_connection((host, port), timeout)
+        except socket.timeout:
+            report.timeouts += 1
+            continue
+        report.histogram.RecordSeconds(_Clock() - startTime)
+        sock.close()
+        if interval:
+            time.sleep(interval)
+
+
+_LATENCY_PROBES = {'tcp': _ProbeTcpPingPong, 'udp': _ProbeUdpEcho, 'connect': _ProbeConnect}
+
+
+def RunLatencyProbe(host, port=LATENCY_PORT, mode='tcp', count=LATENCY_COUNT, duration=None,
+                    messageSize=LATENCY_MESSAGE_SIZE, timeout=LATENCY_TIMEOUT, interval=0):
+    #mode : 'tcp' ping-pong, 'udp' echo or 'connect' time, count round trips or fewer when duration (seconds) runs out
+    report = LatencyReport(mode, host, port)
+    deadline = time.time() + duration if duration else None
+    startTime = time.time()
+    try:
+        _LATENCY_PROBES[mode](report, host, port, count, deadline, messageSize, timeout, interval)
+    except (IOError, OSError) as e:
+        report.errors.append(str(e))
+    report.duration = time.time() - startTime
+    percentiles = report.ToDict()['percentilesUs']
+    RunLog.info("Latency %s to %s:%s : %s samples, p50 %s us, p99 %s us, p99.99 %s us, %s timeouts", mode, host, port,
+                report.histogram.count, percentiles['p50'], percentiles['p99'], percentiles['p99.99'], report.timeouts)
+    return report
+
+
 #________________________________________________________________________________________________________________________________________________
 
 def isProcessRunning(processName):
@@ -615,6 +2903,7 @@ hosts_filepath = ''
 
 
 def SetVnetGlobalParameters():
+    argparse = _ImportArgparse()
     parser = argparse.ArgumentParser()
     parser.add_argument('-d', '--dns_server_ip', help='DNS server IP address', required=True)
     parser.add_argument('-D', '--vnetDomain_db_filepath', help='VNET Domain db filepath', required=True)
@@ -649,36 +2938,106 @@ def GetFileContentsByLines(filepath):
         file.close()
 
 
+#Line editor : an ordered list of rules applied to a file in one streaming pass, written to a temp file that is renamed
+#over the original. Count only counts the lines containing a string, Remove drops them, Replace swaps them for a new
+#line and Append adds text at the end. Rules see the line as left by the rules before them and a removed line stops
+#there. Every rule reports its match count (1/0 for Append), so callers check their own edits without re-reading.
+class LineEditResult(object):
+    def __init__(self, filepath, ruleCount):
+        self.filepath = filepath
+        self.found = False
+        self.written = False
+        self.counts = [0] * ruleCount
+        self.removed = []
+        self.error = None
+
+    def Count(self, ruleIndex):
+        return self.counts[ruleIndex]
+
+
+class LineEditor(object):
+    def __init__(self):
+        self.rules = []
+
+    def Count(self, matchString):
+        self.rules.append(('count', matchString, None))
+        return self
+
+    def Remove(self, matchString):
+        self.rules.append(('remove', matchString, None))
+        return self
+
+    def Replace(self, matchString, newLine):
+        if not newLine.endswith('\n'):
+            newLine = newLine + '\n'
+        self.rules.append(('replace', matchString, newLine))
+        return self
+
+    def Append(self, text):
+        self.rules.append(('append', None, text))
+        return self
+
+    def _Lines(self, sourceFile, result):
+        lastLine = ''
+        for line in sourceFile:
+            for ruleIndex, (action, matchString, newLine) in enumerate(self.rules):
+                if action == 'append' or matchString not in line:
+                    continue
+                result.counts[ruleIndex] += 1
+                if action == 'remove':
+                    result.removed.append(line)
+                    line = None
+                    break
+                if action == 'replace':
+                    line = newLine
+            if line is not None:
+                lastLine = line
+                yield line
+        for ruleIndex, (action, matchString, text) in enumerate(self.rules):
+            if action == 'append':
+                if lastLine and not lastLine.endswith('\n'):
+                    yield '\n'
+                lastLine = text
+                result.counts[ruleIndex] = 1
+                yield text
+
+    def Apply(self, filepath, onlyIf=None):
+        #onlyIf(result) is called after the pass : the file is only replaced when it returns a true value
+        result = LineEditResult(filepath, len(self.rules))
+        try:
+            sourceFile = open(filepath, 'r')
+        except (IOError, OSError) as e:
+            result.error = str(e)
+            return result
+        result.found = True
+        try:
+            with sourceFile:
+                condition = (lambda: onlyIf(result)) if onlyIf is not None else None
+                result.written = _AtomicWriteFile(filepath, self._Lines(sourceFile, result), condition)
+        except (IOError, OSError) as e:
+            result.error = str(e)
+            result.written = False
+        if not result.written:
+            for ruleIndex, (action, matchString, text) in enumerate(self.rules):
+                if action == 'append':
+                    result.counts[ruleIndex] = 0
+        return result
+
+
 def RemoveStringMatchLinesFromFile(filepath, matchString):
-    try:
-        old_file_lines = GetFileContentsByLines(filepath)
-        NewFile =  open(filepath, 'w')
-        for eachLine in old_file_lines:
-            if not matchString in eachLine :
-                NewFile.writelines(eachLine)
-#By the end of this for loop, Selected lines will be removed.
-            else:
-                print("removed %s from %s" % ( eachLine.replace('\n', ''), filepath))
-        NewFile.close()
-    except:
+    result = LineEditor().Remove(matchString).Apply(filepath)
+    if not result.found:
         print ('File : %s not found.' % filepath)
+    for eachLine in result.removed:
+        print("removed %s from %s" % ( eachLine.replace('\n', ''), filepath))
+    return result
 
 
 def ReplaceStringMatchLinesFromFile(filepath, matchString, newLine):
-    try:
-        old_file_lines = GetFileContentsByLines(filepath)
-        NewFile =  open(filepath, 'w')
-        for eachLine in old_file_lines:
-            if matchString in eachLine :
-                if '\n' in newLine:
-                    NewFile.writelines(newLine)
-                else :
-                    NewFile.writelines('%s\n' % newLine)
-            else :
-                NewFile.writelines(eachLine)
-        NewFile.close()
-    except:
+    result = LineEditor().Replace(matchString, newLine).Apply(filepath)
+    if not result.found:
         print ('File : %s not found.' % filepath)
+    return result
 
 
 def GetStringMatchCount(filepath, matchString):
@@ -695,52 +3054,347 @@ def GetStringMatchCount(filepath, matchString):
         print ('File : %s not found.' % filepath)
 
 
+def _AtomicWriteFile(filepath, data, onlyIf=None):
+    #writes a temp file next to the target and renames it over, so a crash leaves either the old or the new content,
+    #a symlinked target (/etc/resolv.conf) is resolved first and the mode and owner of the original are kept.
+    #data is a string or an iterable of lines (streamed), onlyIf() decides after writing whether to rename at all.
+    import stat
+    import tempfile
+    filepath = os.path.realpath(filepath)
+    fd, tmpPath = tempfile.mkstemp(prefix='.' + os.path.basename(filepath) + '.', dir=os.path.dirname(filepath))
+    try:
+        with os.fdopen(fd, 'w') as f:
+            if isinstance(data, type('')):
+                f.write(data)
+            else:
+                f.writelines(data)
+            f.flush()
+            os.fsync(f.fileno())
+        if onlyIf is not None and not onlyIf():
+            os.remove(tmpPath)
+            return False
+        if os.path.exists(filepath):
+            st = os.stat(filepath)
+            os.chmod(tmpPath, stat.S_IMODE(st.st_mode))
+            try:
+                os.chown(tmpPath, st.st_uid, st.st_gid)
+            except OSError:
+                pass
+        os.rename(tmpPath, filepath)
+        return True
+    except:
+        if os.path.exists(tmpPath):
+            os.remove(tmpPath)
+        raise
+
+
+#DNS zone files : DnsZoneFile loads the forward (.db) or reverse (.rev) zone of the VNET once, keeps an index of its
+#lines, applies a batch of Add operations in memory and writes the file once, atomically, on Save().
+#Entries are verified against the index of what was written instead of re-reading the file for every VM.
+#Removals go through LineEditor (RemoveICAVMsFromDBfile/REVfile), both end in the same _AtomicWriteFile.
+ICA_VM_MATCH_STRING = 'ICA-'
+
+
+class DnsZoneFile(object):
+    def __init__(self, filepath):
+        self.filepath = filepath
+        lines = GetFileContentsByLines(filepath)
+        self.exists = lines is not None
+        self.lines = lines or []
+        self.index = {}
+        for line in self.lines:
+            self._Index(line, 1)
+        self.saved = False
+
+    def _Index(self, line, delta):
+        key = line.rstrip('\n')
+        count = self.index.get(key, 0) + delta
+        if count > 0:
+            self.index[key] = count
+        else:
+            self.index.pop(key, None)
+
+    def Add(self, line):
+        if not line.endswith('\n'):
+            line = line + '\n'
+        self.lines.append(line)
+        self._Index(line, 1)
+        self.saved = False
+
+    def Count(self, line):
+        return self.index.get(line.rstrip('\n'), 0)
+
+    def Save(self):
+        #like AppendTextToFile, a zone file that does not exist is not created
+        if not self.exists:
+            print('File %s not found' % self.filepath)
+            return False
+        try:
+            _AtomicWriteFile(self.filepath, ''.join(self.lines))
+            self.saved = True
+        except (IOError, OSError) as e:
+            print('Unable to write %s : %s' % (self.filepath, e))
+            self.saved = False
+        return self.saved
+
+
 def RemoveICAVMsFromDBfile(vnetDomain_db_filepath):
-    matchString = 'ICA-'
-    RemoveStringMatchLinesFromFile(vnetDomain_db_filepath, matchString)
+    RemoveStringMatchLinesFromFile(vnetDomain_db_filepath, ICA_VM_MATCH_STRING)
 
 
 def RemoveICAVMsFromREVfile(vnetDomain_rev_filepath):
-    matchString = 'ICA-'
-    RemoveStringMatchLinesFromFile(vnetDomain_rev_filepath, matchString)
+    RemoveStringMatchLinesFromFile(vnetDomain_rev_filepath, ICA_VM_MATCH_STRING)
+
+
+#Polls a predicate until it returns a true value : the first poll is immediate, the interval then grows
+#exponentially with some jitter up to maxInterval, and everything is bounded by an overall deadline.
+class WaitResult(object):
+    def __init__(self, description):
+        self.description = description
+        self.succeeded = False
+        self.value = None
+        self.attempts = 0
+        self.elapsed = 0.0
+        self.lastError = None
+
+
+def WaitUntil(predicate, timeout=180, initialInterval=1.0, maxInterval=30.0, backoff=2.0, jitter=0.1,
+              maxAttempts=None, description='condition'):
+    import random
+    result = WaitResult(description)
+    startTime = time.time()
+    deadline = startTime + timeout
+    interval = initialInterval
+    while True:
+        result.attempts += 1
+        try:
+            value = predicate()
+            result.value = value
+            if value:
+                result.succeeded = True
+                break
+        except Exception as e:
+            result.lastError = e
+            RunLog.info("WaitUntil : %s : attempt %s raised %s", description, result.attempts, e)
+        remaining = deadline - time.time()
+        if remaining <= 0 or (maxAttempts is not None and result.attempts >= maxAttempts):
+            break
+        sleepTime = min(interval * random.uniform(1 - jitter, 1 + jitter), remaining)
+        time.sleep(max(0, sleepTime))
+        interval = min(interval * backoff, maxInterval)
+    result.elapsed = time.time() - startTime
+    RunLog.info("WaitUntil : %s : %s after %s attempt(s) in %.2fs", description,
+                "succeeded" if result.succeeded else "gave up", result.attempts, result.elapsed)
+    return result
 
 
 def RetryOperation(operation, description, expectResult=None, maxRetryCount=18, retryInterval=10):
-    retryCount = 1
+    #same overall budget and number of attempts as maxRetryCount fixed intervals, but polls faster at the beginning.
+    #An empty expectResult never matches : every attempt is made and the last output is returned, as before.
+    state = {'ret': None, 'count': 0}
+
+    def attempt():
+        state['count'] += 1
+        RunLog.info("Attempt : %s : %s", state['count'], description)
+        state['ret'] = None
+        state['ret'] = Run(operation)
+        return (expectResult and (state['ret'].strip() == expectResult)) or (expectResult == None)
+
+    result = WaitUntil(attempt, timeout=(maxRetryCount - 1) * retryInterval, initialInterval=min(1, retryInterval),
+                       maxInterval=retryInterval, maxAttempts=maxRetryCount, description=description)
+    if result.succeeded:
+        return state['ret']
+    if(expectResult != None):
+        return state['ret']
+    return None
 
-    while True:
-        RunLog.info("Attempt : %s : %s", retryCount, description)
-        ret = None
 
-        try:
-            ret = Run(operation)
-            if (expectResult and (ret.strip() == expectResult)) or (expectResult == None):
-                return ret
-        except:
-            RunLog.info("Retrying Operation")
+#Restarts and queries services through the init system of the VM (detected once and kept with the SystemFacts),
+#under whichever of the distro aliases of the service is installed, and reports readiness from the unit state and
+#main PID instead of sleeping a fixed time after a restart. A restart is only confirmed once the main PID changed.
+SERVICE_ALIASES = {
+    'waagent': ['waagent', 'walinuxagent'],
+    'walinuxagent': ['walinuxagent', 'waagent']
+}
+#installed package -> the service it ships, Debian/Ubuntu name the agent service after the package
+SERVICE_PACKAGES = {
+    'walinuxagent': 'walinuxagent',
+    'WALinuxAgent': 'waagent',
+    'python-azure-agent': 'waagent'
+}
+#command line of the main process, for init systems that do not track it
+SERVICE_PROCESSES = {
+    'waagent': 'waagent -daemon',
+    'walinuxagent': 'waagent -daemon'
+}
+
+
+def _ProbeInitSystem():
+    if os.path.isdir('/run/systemd/system'):
+        return 'systemd'
+    if LocateExecutable('initctl') and os.path.isdir('/etc/init') and \
+            'upstart' in RunStream('initctl version', timeout=10).stdout:
+        return 'upstart'
+    if os.path.exists('/run/openrc') or LocateExecutable('openrc'):
+        return 'openrc'
+    return 'sysvinit'
+
+
+class ServiceStatus(object):
+    def __init__(self, name):
+        self.name = name
+        self.active = False
+        self.ready = False
+        self.state = 'unknown'
+        self.mainPid = 0
+        self.elapsed = 0.0
+
+
+class ServiceController(object):
+    def __init__(self, commandPrefix=''):
+        #commandPrefix e.g. "echo '<password>' | sudo -S " when the check does not run as root
+        self.commandPrefix = commandPrefix
+        self.initSystem = GetSystemFacts().InitSystem()
+        self.resolved = {}
+        self.lastStatus = None
+
+    def _Run(self, cmd, timeout=120):
+        return RunStream(self.commandPrefix + cmd, timeout=timeout)
+
+    def _Installed(self, alias):
+        if self.initSystem == 'systemd':
+            return 'LoadState=loaded' in self._Run("systemctl show -p LoadState %s.service" % alias).stdout
+        return os.path.exists('/etc/init/%s.conf' % alias) or os.path.exists('/etc/init.d/' + alias)
+
+    def Resolve(self, name):
+        if name not in self.resolved:
+            aliases = SERVICE_ALIASES.get(name, [name])
+            #the agent package names the service, the job files only help for services we know no package of
+            packages = GetInstalledPackages()
+            found = [service for package, service in sorted(SERVICE_PACKAGES.items())
+                     if service in aliases and packages.Has(package) and self._Installed(service)]
+            if not found:
+                found = [alias for alias in aliases if self._Installed(alias)]
+            self.resolved[name] = found[0] if found else name
+        return self.resolved[name]
+
+    def _MainPid(self, service):
+        if self.initSystem == 'upstart':
+            match = re.search(r'process (\d+)', self._Run("initctl status %s" % service).stdout)
+            if match:
+                return int(match.group(1))
+        for pidFile in ('/run/%s.pid' % service, '/var/run/%s.pid' % service):
+            pid = ReadFile(pidFile).strip()
+            if pid.isdigit() and os.path.exists('/proc/' + pid):
+                return int(pid)
+        #the bracket keeps pgrep from matching the shell that runs it
+        pattern = SERVICE_PROCESSES.get(service, service)
+        output = RunStream("pgrep -o -f %s" % _ShellQuote('[%s]%s' % (pattern[0], pattern[1:])), timeout=30).stdout
+        pids = output.split()
+        return int(pids[0]) if pids and pids[0].isdigit() else 0
+
+    def Status(self, name):
+        service = self.Resolve(name)
+        status = ServiceStatus(service)
+        if self.initSystem == 'systemd':
+            output = self._Run("systemctl show -p ActiveState -p SubState -p MainPID %s.service" % service).stdout
+            properties = dict(line.split('=', 1) for line in output.splitlines() if '=' in line)
+            status.active = properties.get('ActiveState') == 'active'
+            status.state = '%s/%s' % (properties.get('ActiveState', 'unknown'), properties.get('SubState', 'unknown'))
+            try:
+                status.mainPid = int(properties.get('MainPID', 0))
+            except ValueError:
+                status.mainPid = 0
+            return status
+        if self.initSystem == 'upstart':
+            #"walinuxagent start/running, process 1234"
+            output = self._Run("initctl status %s" % service).stdout
+            status.active = 'start/running' in output
+            status.state = 'start/running' if status.active else (output.split(',')[0].split(' ')[-1] or 'unknown')
+        else:
+            result = self._Run("%s status" % self._ControlPrefix(service))
+            status.active = result.exitCode == 0
+            status.state = 'running' if status.active else 'stopped'
+        if status.active:
+            status.mainPid = self._MainPid(service)
+        return status
+
+    def IsActive(self, name):
+        return self.Status(name).active
+
+    def _ControlPrefix(self, service):
+        #upstart jobs and sysv scripts both go through 'service', which knows how to restart a stopped upstart job
+        if self.initSystem == 'openrc':
+            return "rc-service %s" % service
+        if LocateExecutable('service'):
+            return "service %s" % service
+        return "/etc/init.d/%s" % service
+
+    def _Control(self, name, action):
+        service = self.Resolve(name)
+        if self.initSystem == 'systemd':
+            cmd = "systemctl %s %s.service" % (action, service)
+        else:
+            cmd = "%s %s" % (self._ControlPrefix(service), action)
+        RunLog.info("ServiceController : %s", cmd)
+        result = self._Run(cmd)
+        if not result.Succeeded() and self.initSystem == 'systemd' and LocateExecutable('service'):
+            #units generated from sysv scripts sometimes only work through the script itself
+            RunLog.info("ServiceController : '%s' exited with %s, trying 'service'", cmd, result.exitCode)
+            result = self._Run("service %s %s" % (service, action))
+        return result
+
+    def WaitActive(self, name, timeout=60, previousPid=0):
+        #a restart is only complete once the service is active with a new main PID
+        state = {'status': None}
+
+        def ready():
+            status = self.Status(name)
+            state['status'] = status
+            return status.active and (previousPid == 0 or status.mainPid not in (0, previousPid))
+
+        result = WaitUntil(ready, timeout=timeout, initialInterval=0.5, maxInterval=5,
+                           description="%s active" % self.Resolve(name))
+        status = state['status']
+        status.ready = result.succeeded
+        status.elapsed = result.elapsed
+        self.lastStatus = status
+        if status.ready:
+            RunLog.info("ServiceController : %s is %s (main PID %s) after %.2fs", status.name, status.state,
+                        status.mainPid, status.elapsed)
+        else:
+            RunLog.error("ServiceController : %s is %s (main PID %s, was %s) after %.2fs", status.name, status.state,
+                         status.mainPid, previousPid, status.elapsed)
+        return status
 
-        if retryCount >= maxRetryCount:
-            break
-        retryCount += 1
-        time.sleep(retryInterval)
-    if(expectResult != None):
-        return ret
-    return None
+    def Start(self, name, timeout=60):
+        self._Control(name, 'start')
+        return self.WaitActive(name, timeout).ready
+
+    def Stop(self, name):
+        return self._Control(name, 'stop').Succeeded()
+
+    def Restart(self, name, timeout=60):
+        #True once the service runs again under a new main PID, the details are kept in lastStatus
+        previousPid = self.Status(name).mainPid
+        self._Control(name, 'restart')
+        return self.WaitActive(name, timeout, previousPid).ready
 
 
 def AppendTextToFile(filepath, textString):
     #THIS FUNCTION DONES NOT CREATES ANY FILE. THE FILE MUST PRESENT AT THE SPECIFIED LOCATION.
+    #a single open without O_CREAT : a missing file fails the open itself
     try:
-        fileToEdit = open ( filepath , 'r' )
-        fileToEdit.close()
-        fileToEdit = open ( filepath , 'a' )
-        if not '\n' in textString:
-            fileToEdit.write(textString)
-        else:
-            fileToEdit.writelines(textString)
-        fileToEdit.close()
-    except:
+        fd = os.open(filepath, os.O_WRONLY | os.O_APPEND)
+    except OSError:
         print('File %s not found' % filepath)
+        return False
+    fileToEdit = os.fdopen(fd, 'a')
+    try:
+        fileToEdit.write(textString)
+    finally:
+        fileToEdit.close()
+    return True
 
 
 def AddICAVMsToDnsServer(HostnameDIP, vnetDomain_db_filepath, vnetDomain_rev_filepath):
@@ -750,20 +3404,28 @@ def AddICAVMsToDnsServer(HostnameDIP, vnetDomain_db_filepath, vnetDomain_rev_fil
     separatedVMs = HostnameDIP.split('^')
     vmCounter = 0
     successCount = 0
+    #both zones are edited in memory and written once, each entry is then verified against the written index
+    dbZone = DnsZoneFile(vnetDomain_db_filepath)
+    revZone = DnsZoneFile(vnetDomain_rev_filepath)
+    entries = []
     for eachVM in separatedVMs:
-        vmCounter = vmCounter + 1
         eachVMdata = eachVM.split(':')
         eachVMHostname = eachVMdata[0]
         eachVMDIP = eachVMdata[1]
         lastDigitofVMDIP = eachVMDIP.split('.')[3]
         vnetDomainDBstring = '%s\tIN\tA\t%s\n' % (eachVMHostname, eachVMDIP)
         print(vnetDomainDBstring.replace('\n', ''))
-        AppendTextToFile(vnetDomain_db_filepath, vnetDomainDBstring)
+        dbZone.Add(vnetDomainDBstring)
         vnetDomainREVstring = '%s\tIN\tPTR\t%s.%s.\n' % (lastDigitofVMDIP, eachVMHostname, vnetDomain)
-        AppendTextToFile(vnetDomain_rev_filepath, vnetDomainREVstring)
+        revZone.Add(vnetDomainREVstring)
         print(vnetDomainREVstring.replace('\n', ''))
-        isDBFileEntry =  GetStringMatchCount(vnetDomain_db_filepath, vnetDomainDBstring)
-        isREVFileEntry =  GetStringMatchCount(vnetDomain_rev_filepath, vnetDomainREVstring)
+        entries.append((eachVMHostname, eachVMDIP, vnetDomainDBstring, vnetDomainREVstring))
+    dbZone.Save()
+    revZone.Save()
+    for eachVMHostname, eachVMDIP, vnetDomainDBstring, vnetDomainREVstring in entries:
+        vmCounter = vmCounter + 1
+        isDBFileEntry = dbZone.Count(vnetDomainDBstring) if dbZone.saved else 0
+        isREVFileEntry = revZone.Count(vnetDomainREVstring) if revZone.saved else 0
         if isDBFileEntry >= 1 and isREVFileEntry >= 1:
             print (vnetDomain_db_filepath + " file edited for " + eachVMDIP + " : " + eachVMHostname)
             print (vnetDomain_rev_filepath + " file edited for " + eachVMDIP + " : " + eachVMHostname)
@@ -779,86 +3441,904 @@ def AddICAVMsToDnsServer(HostnameDIP, vnetDomain_db_filepath, vnetDomain_rev_fil
         return 1
 
 
-def RemoteUpload(hostIP, hostPassword, hostUsername, hostPort, filesToUpload, remoteLocation):
-    import paramiko
-#    print ('%s %s' % (hostIP,hostPort))
-    transport = paramiko.Transport((hostIP, int(hostPort)))
+#DNS probe : a small UDP DNS client (A and PTR queries) so many names are resolved concurrently in-process, each query
+#with its latency and response code, without forking nslookup. The server and search domains come from resolv.conf
+#unless given, which also lets the probe run against a stub server on loopback. ProbeDns checks forward names and
+#(hostname, ip) pairs, for which the A record must contain the ip and the PTR record must name the host back, the
+#same pairs AddICAVMsToDnsServer writes to the zone files.
+DNS_PORT = 53
+DNS_TIMEOUT = 2.0
+DNS_RETRIES = 2
+DNS_TYPE_A = 1
+DNS_TYPE_PTR = 12
+DNS_RCODES = {0: 'NOERROR', 1: 'FORMERR', 2: 'SERVFAIL', 3: 'NXDOMAIN', 4: 'NOTIMP', 5: 'REFUSED'}
+RESOLV_CONF_FILE = '/etc/resolv.conf'
+
+
+def GetResolverConfig(resolvConf=RESOLV_CONF_FILE):
+    #(nameservers, search domains) as the libc resolver would use them
+    nameservers = []
+    search = []
+    for line in ReadFileLines(resolvConf):
+        fields = line.split('#')[0].split()
+        if len(fields) < 2:
+            continue
+        if fields[0] == 'nameserver':
+            nameservers.append(fields[1])
+        elif fields[0] in ('search', 'domain'):
+            search = fields[1:]
+    return nameservers, search
+
+
+def ParseHostnameDIP(HostnameDIP):
+    #'host1:10.0.0.4^host2:10.0.0.5' as given to AddICAVMsToDnsServer
+    pairs = []
+    for eachVM in HostnameDIP.split('^'):
+        eachVMdata = eachVM.split(':')
+        if len(eachVMdata) >= 2:
+            pairs.append((eachVMdata[0], eachVMdata[1]))
+    return pairs
+
+
+def ReverseName(ip):
+    return '.'.join(reversed(ip.split('.'))) + '.in-addr.arpa'
+
+
+def _DnsQueryPacket(queryId, name, qtype):
+    import struct
+    packet = bytearray(struct.pack('>HHHHHH', queryId, 0x0100, 1, 0, 0, 0))
+    for label in name.rstrip('.').split('.'):
+        encoded = bytearray(label.encode('ascii'))
+        packet.append(len(encoded))
+        packet.extend(encoded)
+    packet.append(0)
+    packet.extend(struct.pack('>HH', qtype, 1))
+    return bytes(packet)
+
+
+def _DnsReadName(data, offset):
+    labels = []
+    jumped = False
+    end = offset
+    for hop in range(128):
+        length = data[offset]
+        if length & 0xc0 == 0xc0:
+            if not jumped:
+                end = offset + 2
+            offset = ((length & 0x3f) << 8) | data[offset + 1]
+            jumped = True
+            continue
+        if length == 0:
+            if not jumped:
+                end = offset + 1
+            break
+        if offset + 1 + length > len(data):
+            raise ValueError('label past the end of the reply')
+        labels.append(_ToText(bytes(data[offset + 1:offset + 1 + length])))
+        offset += 1 + length
+    else:
+        raise ValueError('compression pointer loop')
+    return '.'.join(labels), end
+
+
+def _DnsParseResponse(response, queryId):
+    #(rcode, [(type, value)]) of the answer section, None when the packet is not the reply to queryId.
+    #A truncated or malformed reply raises IndexError, ValueError or struct.error.
+    import struct
+    data = bytearray(response)
+    if len(data) < 12:
+        return None
+    responseId, flags, qdCount, anCount = struct.unpack('>HHHH', bytes(data[:8]))
+    if responseId != queryId or not flags & 0x8000:
+        return None
+    offset = 12
+    for each in range(qdCount):
+        name, offset = _DnsReadName(data, offset)
+        offset += 4
+    answers = []
+    for each in range(anCount):
+        name, offset = _DnsReadName(data, offset)
+        rtype, rclass, ttl, rdLength = struct.unpack('>HHIH', bytes(data[offset:offset + 10]))
+        offset += 10
+        if offset + rdLength > len(data):
+            raise ValueError('record data past the end of the reply')
+        if rtype == DNS_TYPE_A and rdLength == 4:
+            answers.append((rtype, '.'.join([str(octet) for octet in data[offset:offset + 4]])))
+        elif rtype == DNS_TYPE_PTR:
+            answers.append((rtype, _DnsReadName(data, offset)[0]))
+        offset += rdLength
+    return flags & 0xf, answers
+
+
+class DnsQueryResult(object):
+    def __init__(self, name, qtype, server):
+        self.name = name
+        self.qtype = qtype
+        self.server = server
+        self.queried = name
+        self.rcode = None
+        self.answers = []
+        self.latency = 0.0
+        self.error = None
+
+    def Succeeded(self):
+        return self.rcode == 0 and len(self.answers) > 0
+
+    def Values(self):
+        return [value for rtype, value in self.answers if rtype == self.qtype]
+
+    def ToDict(self):
+        return {'name': self.name, 'queried': self.queried, 'type': 'PTR' if self.qtype == DNS_TYPE_PTR else 'A',
+                'server': self.server, 'rcode': DNS_RCODES.get(self.rcode, self.rcode), 'answers': self.Values(),
+                'latencyMs': round(self.latency * 1000, 2), 'error': self.error}
+
+
+def _DnsExchange(result, name, server, port, timeout, retries):
+    import random
+    import socket
+    import struct
+    queryId = random.randint(0, 0xffff)
+    family = socket.AF_INET6 if ':' in server else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_DGRAM)
     try:
-        print('Connecting to %s'% hostIP),
-        transport.connect(username = hostUsername, password = hostPassword)
-        print('...Connected.')
-        try:
-            sftp = paramiko.SFTPClient.from_transport(transport)
-            filesToUpload =  filesToUpload.split(',')
-            for eachFile in filesToUpload :
-                eachFileName = eachFile.split('/')
-#                print eachFileName
-                eachFileNameLength = len(eachFileName)
-#                print eachFileNameLength
-                exactFileName = eachFileName[eachFileNameLength-1]
-#                print exactFileName
-                if remoteLocation[-1] == '/':
-                    newFile = "%s%s" % (remoteLocation, exactFileName)
-                else:
-                    newFile = "%s/%s" % (remoteLocation, exactFileName)
-#                print ("%s - %s" % (eachFile, newFile))
+        packet = _DnsQueryPacket(queryId, name, result.qtype)
+        for attempt in range(retries + 1):
+            startTime = time.time()
+            sock.sendto(packet, (server, port))
+            deadline = startTime + timeout
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                sock.settimeout(remaining)
+                try:
+                    response = sock.recvfrom(4096)[0]
+                except socket.timeout:
+                    break
                 try:
-                    print ("Uploading %s to %s" % (eachFile, newFile)),
-                    sftp.put(eachFile, newFile)
-                    print ('...OK!')
-                except:
-                    print('...Error!')
+                    parsed = _DnsParseResponse(response, queryId)
+                except (IndexError, ValueError, struct.error) as e:
+                    #the server did answer, asking again would get the same reply
+                    result.latency = time.time() - startTime
+                    result.error = 'malformed reply : %s' % (str(e) or e.__class__.__name__)
+                    return False
+                if parsed is not None:
+                    result.latency = time.time() - startTime
+                    result.rcode, result.answers = parsed
+                    result.error = None
+                    return True
+            result.error = 'timed out'
+        return False
+    finally:
+        sock.close()
+
+
+def _SystemResolve(result):
+    #no nameserver configured : fall back to the libc resolver (hosts file, nss)
+    import socket
+    startTime = time.time()
+    try:
+        if result.qtype == DNS_TYPE_PTR:
+            ip = '.'.join(reversed(result.name.split('.')[:4]))
+            result.answers = [(DNS_TYPE_PTR, socket.gethostbyaddr(ip)[0])]
+        else:
+            result.answers = [(DNS_TYPE_A, ip) for ip in socket.gethostbyname_ex(result.name)[2]]
+        result.rcode = 0
+    except (socket.error, socket.herror, socket.gaierror) as e:
+        result.rcode = 3
+        result.error = str(e)
+    result.latency = time.time() - startTime
+    return result
+
+
+def DnsQuery(name, qtype=DNS_TYPE_A, server=None, port=DNS_PORT, timeout=DNS_TIMEOUT, retries=DNS_RETRIES, search=None):
+    #single-label names are tried with the search domains first, like the libc resolver with ndots:1
+    if server is None:
+        nameservers, configuredSearch = GetResolverConfig()
+        server = nameservers[0] if nameservers else None
+        if search is None:
+            search = configuredSearch
+    result = DnsQueryResult(name, qtype, server)
+    if server is None:
+        return _SystemResolve(result)
+    candidates = [name]
+    if qtype == DNS_TYPE_A and '.' not in name.rstrip('.'):
+        candidates = ['%s.%s' % (name, domain) for domain in (search or [])] + [name]
+    totalLatency = 0.0
+    for candidate in candidates:
+        result.queried = candidate
+        _DnsExchange(result, candidate, server, port, timeout, retries)
+        totalLatency += result.latency
+        if result.Succeeded() or result.error is not None:
+            break
+    result.latency = totalLatency
+    return result
+
+
+class DnsProbeReport(object):
+    def __init__(self):
+        self.queries = []
+        self.mismatches = []
+        self.duration = 0.0
+
+    def Failed(self):
+        return [query for query in self.queries if not query.Succeeded()]
+
+    def Succeeded(self):
+        return len(self.queries) > 0 and not self.Failed() and not self.mismatches
+
+    def Query(self, name, qtype=DNS_TYPE_A):
+        #never None : a name that was not queried gets a failed result saying so
+        for query in self.queries:
+            if query.name == name and query.qtype == qtype:
+                return query
+        result = DnsQueryResult(name, qtype, None)
+        result.error = 'not queried'
+        return result
+
+    def ToDict(self):
+        latencies = sorted([query.latency for query in self.queries if query.rcode is not None])
+        return {
+            'duration': round(self.duration, 3),
+            'queries': len(self.queries),
+            'failed': len(self.Failed()),
+            'mismatches': self.mismatches,
+            'maxLatencyMs': round(latencies[-1] * 1000, 2) if latencies else None,
+            'medianLatencyMs': round(latencies[len(latencies) // 2] * 1000, 2) if latencies else None,
+            'results': [query.ToDict() for query in self.queries]
+        }
+
+
+def _PtrMatchesHost(ptrName, hostname, domain):
+    ptrName = ptrName.rstrip('.').lower()
+    hostname = hostname.rstrip('.').lower()
+    if domain:
+        return ptrName == '%s.%s' % (hostname, domain.rstrip('.').lower())
+    return ptrName == hostname or ptrName.split('.')[0] == hostname.split('.')[0]
+
+
+def ProbeDns(names=None, pairs=None, domain=None, server=None, port=DNS_PORT, timeout=DNS_TIMEOUT, retries=DNS_RETRIES,
+             maxWorkers=DEFAULT_PROBE_WORKERS):
+    #names : forward lookups, pairs : (hostname, ip) whose A and PTR records must agree (see ParseHostnameDIP)
+    report = DnsProbeReport()
+    startTime = time.time()
+    search = None
+    if server is None:
+        nameservers, search = GetResolverConfig()
+        server = nameservers[0] if nameservers else None
+    if domain:
+        search = [domain]
+    pairs = pairs or []
+    queries = [(name, DNS_TYPE_A) for name in (names or [])]
+    for hostname, ip in pairs:
+        queries.append((hostname, DNS_TYPE_A))
+        queries.append((ReverseName(ip), DNS_TYPE_PTR))
+    pending = deque(sorted(set(queries), key=queries.index))
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                name, qtype = pending.popleft()
+            try:
+                if server is None:
+                    result = _SystemResolve(DnsQueryResult(name, qtype, None))
+                else:
+                    result = DnsQuery(name, qtype, server, port, timeout, retries, search)
+            except Exception as e:
+                #every requested name ends up in the report, a query that blew up is a failed one
+                RunLog.error("ProbeDns : %s query for %s failed : %s", 'PTR' if qtype == DNS_TYPE_PTR else 'A', name, e)
+                result = DnsQueryResult(name, qtype, server)
+                result.error = str(e) or e.__class__.__name__
+            with lock:
+                report.queries.append(result)
+
+    workers = [threading.Thread(target=worker) for i in range(min(maxWorkers, len(pending)))]
+    for each in workers:
+        each.daemon = True
+        each.start()
+    for each in workers:
+        each.join()
+    for name, qtype in set(queries):
+        if not [query for query in report.queries if query.name == name and query.qtype == qtype]:
+            report.queries.append(report.Query(name, qtype))
+    report.queries.sort(key=lambda query: queries.index((query.name, query.qtype)))
+
+    for hostname, ip in pairs:
+        forward = report.Query(hostname, DNS_TYPE_A)
+        reverse = report.Query(ReverseName(ip), DNS_TYPE_PTR)
+        if ip not in forward.Values():
+            report.mismatches.append({'host': hostname, 'ip': ip, 'record': 'A', 'found': forward.Values()})
+        if not [ptrName for ptrName in reverse.Values() if _PtrMatchesHost(ptrName, hostname, domain)]:
+            report.mismatches.append({'host': hostname, 'ip': ip, 'record': 'PTR', 'found': reverse.Values()})
+    report.duration = time.time() - startTime
+    RunLog.info("ProbeDns : %s queries against %s in %.2fs, %s failed, %s mismatches", len(report.queries),
+                server or 'the system resolver', report.duration, len(report.Failed()), len(report.mismatches))
+    return report
+
+
+#SSH transfers : authenticated paramiko transports are pooled per (host, port, user) and reused by every RemoteUpload /
+#RemoteDownload call. A multi-file transfer is spread over up to SFTP_CHANNELS concurrent SFTP channels on the pooled
+#transport; paramiko pipelines the writes of put() and prefetches the reads of get(), and every file reports its status
+#and throughput in the returned TransferResult.
+SFTP_CHANNELS = 4
+SSH_CONNECT_TIMEOUT = 30
+
+
+class TransferStatus(object):
+    def __init__(self, source, destination):
+        self.source = source
+        self.destination = destination
+        self.ok = False
+        self.skipped = False
+        self.bytes = 0
+        self.duration = 0.0
+        self.error = None
+
+    def Throughput(self):
+        #bytes per second
+        return self.bytes / self.duration if self.duration > 0 else 0.0
+
+    def ToDict(self):
+        return {'source': self.source, 'destination': self.destination, 'ok': self.ok, 'skipped': self.skipped,
+                'bytes': self.bytes,
+                'duration': round(self.duration, 3), 'throughput': round(self.Throughput(), 1), 'error': self.error}
+
+
+class TransferResult(object):
+    def __init__(self, host, direction):
+        self.host = host
+        self.direction = direction
+        self.files = []
+        self.connectError = None
+        self.duration = 0.0
+
+    def Failed(self):
+        return [status for status in self.files if not status.ok]
+
+    def Succeeded(self):
+        return self.connectError is None and not self.Failed()
+
+    def Bytes(self):
+        return sum([status.bytes for status in self.files])
+
+    def Throughput(self):
+        return self.Bytes() / self.duration if self.duration > 0 else 0.0
+
+    def ToDict(self):
+        return {'host': self.host, 'direction': self.direction, 'connectError': self.connectError,
+                'duration': round(self.duration, 3), 'bytes': self.Bytes(), 'throughput': round(self.Throughput(), 1),
+                'files': [status.ToDict() for status in self.files]}
+
+
+class SSHConnectionPool(object):
+    def __init__(self):
+        self.transports = {}
+        self.keyLocks = {}
+        self.lock = threading.Lock()
+
+    def _KeyLock(self, key):
+        with self.lock:
+            return self.keyLocks.setdefault(key, threading.Lock())
+
+    def Get(self, host, port, username, password):
+        #handshakes to different hosts run in parallel, callers for the same host wait for the first one
+        import paramiko
+        key = (host, int(port), username)
+        with self._KeyLock(key):
+            with self.lock:
+                transport = self.transports.get(key)
+            if transport is not None and transport.is_active():
+                return transport
+            import socket
+            sock = socket.create_connection((host, int(port)), SSH_CONNECT_TIMEOUT)
+            transport = paramiko.Transport(sock)
+            try:
+                transport.connect(username=username, password=password)
+            except Exception:
+                transport.close()
+                raise
+            with self.lock:
+                if not self.transports:
+                    import atexit
+                    atexit.register(self.CloseAll)
+                self.transports[key] = transport
+            return transport
+
+    def Discard(self, host, port, username):
+        with self.lock:
+            transport = self.transports.pop((host, int(port), username), None)
+        if transport is not None:
             transport.close()
-        except:
-            print("Failed to upload to %s" % hostIP)
 
-    except:
-        print("...Failed!")
+    def CloseAll(self):
+        with self.lock:
+            transports = list(self.transports.values())
+            self.transports.clear()
+        for transport in transports:
+            transport.close()
+
+
+_ssh_pool = SSHConnectionPool()
+
+
+def GetSSHConnectionPool():
+    return _ssh_pool
+
 
+def _TransferTarget(path, location):
+    exactFileName = path.split('/')[-1]
+    if location[-1] == '/':
+        return "%s%s" % (location, exactFileName)
+    return "%s/%s" % (location, exactFileName)
 
-def RemoteDownload(hostIP, hostPassword, hostUsername, hostPort, filesToDownload, localLocation):
+
+def _TransferFiles(hostIP, hostPassword, hostUsername, hostPort, pairs, upload, channels):
     import paramiko
-#    print ('%s %s' % (hostIP,hostPort))
-    transport = paramiko.Transport((hostIP, int(hostPort)))
+    result = TransferResult(hostIP, 'upload' if upload else 'download')
+    startTime = time.time()
     try:
-        print('Connecting to %s'% hostIP),
-        transport.connect(username = hostUsername, password = hostPassword)
+        print('Connecting to %s' % hostIP)
+        transport = _ssh_pool.Get(hostIP, hostPort, hostUsername, hostPassword)
         print('...Connected.')
+    except Exception as e:
+        print("...Failed!")
+        result.connectError = str(e)
+        return result
+
+    pending = deque(pairs)
+    lock = threading.Lock()
+
+    def worker():
         try:
             sftp = paramiko.SFTPClient.from_transport(transport)
-            filesToDownload =  filesToDownload.split(',')
-            for eachFile in filesToDownload :
-                eachFileName = eachFile.split('/')
-#                print eachFileName
-                eachFileNameLength = len(eachFileName)
-#                print eachFileNameLength
-                exactFileName = eachFileName[eachFileNameLength-1]
-#                print exactFileName
-                if localLocation[-1] == '/':
-                    newFile = "%s%s" % (localLocation, exactFileName)
-                else:
-                    newFile = "%s/%s" % (localLocation, exactFileName)
-#                print ("%s - %s" % (eachFile, newFile))
+        except Exception as e:
+            RunLog.error("Unable to open an SFTP channel to %s : %s", hostIP, e)
+            return
+        try:
+            while True:
+                with lock:
+                    if not pending:
+                        return
+                    source, destination = pending.popleft()
+                status = TransferStatus(source, destination)
+                fileStart = time.time()
                 try:
-                    print ("Downloading %s to %s" % (eachFile, newFile)),
-                    sftp.get(eachFile, newFile)
-                    print ('...OK!')
-                except:
-                    print('...Error!')
-            transport.close()
-        except:
-            print("Failed to Download to %s" % hostIP)
+                    if upload:
+                        status.bytes = sftp.put(source, destination).st_size or 0
+                    else:
+                        sftp.get(source, destination)
+                        status.bytes = os.path.getsize(destination)
+                    status.ok = True
+                except Exception as e:
+                    status.error = str(e)
+                status.duration = time.time() - fileStart
+                with lock:
+                    result.files.append(status)
+                    print("%s %s to %s...%s" % ('Uploading' if upload else 'Downloading', source, destination,
+                                                'OK! (%.1f KB/s)' % (status.Throughput() / 1024) if status.ok else 'Error!'))
+        finally:
+            sftp.close()
+
+    workers = [threading.Thread(target=worker) for i in range(max(1, min(channels, len(pending))))]
+    for each in workers:
+        each.daemon = True
+        each.start()
+    for each in workers:
+        each.join()
+    for source, destination in pending:
+        #no SFTP channel could be opened
+        status = TransferStatus(source, destination)
+        status.error = 'no SFTP channel'
+        result.files.append(status)
+    if not transport.is_active():
+        _ssh_pool.Discard(hostIP, hostPort, hostUsername)
+    if result.Failed():
+        print("Failed to %s %s file(s) %s %s" % ('upload' if upload else 'download', len(result.Failed()),
+                                               'to' if upload else 'from', hostIP))
+    result.duration = time.time() - startTime
+    return result
+
+
+#Bundle mode : the whole file set travels as one gzip'ed tar stream over a single SSH exec channel and is unpacked on
+#the other side with its modes, so hundreds of small files cost one round trip. When the remote side has no tar the
+#transfer falls back to the per-file SFTP path above.
+TAR_MISSING_EXIT_CODE = 127
+
+
+def _ShellQuote(value):
+    return "'" + value.replace("'", "'\\''") + "'"
+
+
+class _ChannelWriter(object):
+    #unbuffered file-like writer for tarfile's stream mode
+    def __init__(self, channel):
+        self.channel = channel
+
+    def write(self, data):
+        self.channel.sendall(data)
+
+
+def _ReadChannelStderr(channel):
+    stderr = channel.makefile_stderr('rb')
+    try:
+        return _ToText(stderr.read()).strip()
+    finally:
+        stderr.close()
+
+
+def _UniqueNamePairs(result, pairs):
+    #a bundle flattens every file into one directory : files sharing a name would overwrite each other there, so they
+    #are all reported as failed instead of being sent
+    names = {}
+    for source, destination in pairs:
+        names[os.path.basename(source)] = names.get(os.path.basename(source), 0) + 1
+    unique = []
+    for source, destination in pairs:
+        if names[os.path.basename(source)] > 1:
+            status = TransferStatus(source, destination)
+            status.error = 'Another file of the bundle is also named %s' % os.path.basename(source)
+            result.files.append(status)
+        else:
+            unique.append((source, destination))
+    return unique
 
-    except:
+
+def _BundleUpload(transport, result, pairs, remoteLocation):
+    import tarfile
+    bundled = []
+    for source, destination in _UniqueNamePairs(result, pairs):
+        if os.path.isfile(source):
+            bundled.append((source, destination))
+        else:
+            status = TransferStatus(source, destination)
+            status.error = 'No such file'
+            result.files.append(status)
+    channel = transport.open_session()
+    try:
+        channel.exec_command("command -v tar >/dev/null || exit %s; mkdir -p %s && tar -xzpf - -C %s" % (
+            TAR_MISSING_EXIT_CODE, _ShellQuote(remoteLocation), _ShellQuote(remoteLocation)))
+        try:
+            tar = tarfile.open(fileobj=_ChannelWriter(channel), mode='w|gz')
+            for source, destination in bundled:
+                tar.add(source, arcname=os.path.basename(destination))
+            tar.close()
+        except (IOError, OSError, EOFError) as e:
+            #the remote side went away (tar missing), the exit status below tells
+            RunLog.info("Bundle upload to %s interrupted : %s", result.host, e)
+        channel.shutdown_write()
+        exitCode = channel.recv_exit_status()
+        error = _ReadChannelStderr(channel)
+    finally:
+        channel.close()
+    if exitCode == TAR_MISSING_EXIT_CODE:
+        return None
+    for source, destination in bundled:
+        status = TransferStatus(source, destination)
+        status.ok = exitCode == 0
+        status.bytes = os.path.getsize(source) if status.ok else 0
+        status.error = None if status.ok else (error or 'tar exited with %s' % exitCode)
+        result.files.append(status)
+    return result
+
+
+def _BundleDownload(transport, result, pairs, localLocation):
+    import shutil
+    import tarfile
+    pairs = _UniqueNamePairs(result, pairs)
+    if not pairs:
+        return result
+    #the tar members are named after the file only, which is unique in the bundle : back to the full remote path
+    sources = dict([(os.path.basename(source), source) for source, destination in pairs])
+    members = ' '.join(["-C %s %s" % (_ShellQuote(os.path.dirname(source) or '.'), _ShellQuote(os.path.basename(source)))
+                        for source, destination in pairs])
+    channel = transport.open_session()
+    received = {}
+    try:
+        channel.exec_command("command -v tar >/dev/null || exit %s; tar -czf - %s" % (TAR_MISSING_EXIT_CODE, members))
+        stream = channel.makefile('rb')
+        try:
+            tar = tarfile.open(fileobj=stream, mode='r|gz')
+            for member in tar:
+                if not member.isfile() or member.name not in sources:
+                    continue
+                destination = _TransferTarget(member.name, localLocation)
+                source = tar.extractfile(member)
+                with open(destination, 'wb') as f:
+                    shutil.copyfileobj(source, f)
+                os.chmod(destination, member.mode)
+                received[sources[member.name]] = member.size
+            tar.close()
+        except (tarfile.TarError, IOError, OSError, EOFError) as e:
+            RunLog.info("Bundle download from %s interrupted : %s", result.host, e)
+        finally:
+            stream.close()
+        exitCode = channel.recv_exit_status()
+        error = _ReadChannelStderr(channel)
+    finally:
+        channel.close()
+    if exitCode == TAR_MISSING_EXIT_CODE:
+        return None
+    for source, destination in pairs:
+        status = TransferStatus(source, destination)
+        status.ok = source in received
+        status.bytes = received.get(source, 0)
+        status.error = None if status.ok else (error or 'not in the tar stream')
+        result.files.append(status)
+    return result
+
+
+def _TransferBundle(hostIP, hostPassword, hostUsername, hostPort, pairs, upload, location, channels):
+    result = TransferResult(hostIP, 'upload' if upload else 'download')
+    startTime = time.time()
+    try:
+        print('Connecting to %s' % hostIP)
+        transport = _ssh_pool.Get(hostIP, hostPort, hostUsername, hostPassword)
+        print('...Connected.')
+    except Exception as e:
         print("...Failed!")
+        result.connectError = str(e)
+        return result
+    try:
+        if upload:
+            bundleResult = _BundleUpload(transport, result, pairs, location)
+        else:
+            bundleResult = _BundleDownload(transport, result, pairs, location)
+    except Exception as e:
+        RunLog.info("Bundle %s with %s failed : %s", result.direction, hostIP, e)
+        bundleResult = None
+    if bundleResult is None:
+        RunLog.info("No tar bundle with %s, falling back to SFTP", hostIP)
+        return _TransferFiles(hostIP, hostPassword, hostUsername, hostPort, pairs, upload, channels)
+    result.duration = time.time() - startTime
+    print("%s %s file(s) %s %s in one bundle : %s failed, %.1f KB/s" % (
+        'Uploaded' if upload else 'Downloaded', len(result.files), 'to' if upload else 'from', hostIP,
+        len(result.Failed()), result.Throughput() / 1024))
+    return result
+
+
+def RemoteUpload(hostIP, hostPassword, hostUsername, hostPort, filesToUpload, remoteLocation, channels=SFTP_CHANNELS,
+                 bundle=False):
+    pairs = [(eachFile, _TransferTarget(eachFile, remoteLocation)) for eachFile in filesToUpload.split(',')]
+    if bundle:
+        return _TransferBundle(hostIP, hostPassword, hostUsername, hostPort, pairs, True, remoteLocation, channels)
+    return _TransferFiles(hostIP, hostPassword, hostUsername, hostPort, pairs, True, channels)
+
+
+def RemoteDownload(hostIP, hostPassword, hostUsername, hostPort, filesToDownload, localLocation, channels=SFTP_CHANNELS,
+                   bundle=False):
+    pairs = [(eachFile, _TransferTarget(eachFile, localLocation)) for eachFile in filesToDownload.split(',')]
+    if bundle:
+        return _TransferBundle(hostIP, hostPassword, hostUsername, hostPort, pairs, False, localLocation, channels)
+    return _TransferFiles(hostIP, hostPassword, hostUsername, hostPort, pairs, False, channels)
+
+
+#Delta sync : RemoteSync hashes the local files and, in one exec round trip, runs sha256sum on the files already in the
+#remote directory. Only new or changed files are sent (as a bundle by default), so pushing an unchanged tree again
+#costs a single round trip. The listing is only trusted when the remote side printed SYNC_HASHES_MARKER, i.e. when
+#sha256sum really ran there : an empty listing then means the files are missing. Without the marker (no directory,
+#no sha256sum) every file is sent.
+SYNC_HASHES_MARKER = '--- sha256sum ---'
+
+
+def _FileSha256(path):
+    import hashlib
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(1024 * 1024)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _ParseSha256Sums(text):
+    #sha256sum format : "<hash>  <name>", escaped names (leading backslash) are skipped and simply sent again
+    hashes = {}
+    for line in text.splitlines():
+        if len(line) > 66 and line[64:66] in ('  ', ' *') and not line.startswith('\\'):
+            hashes[line[66:]] = line[:64]
+    return hashes
+
+
+def _RemoteExec(transport, command, inputData=None):
+    channel = transport.open_session()
+    try:
+        channel.exec_command(command)
+        if inputData is not None:
+            channel.sendall(inputData.encode('utf-8') if not isinstance(inputData, bytes) else inputData)
+        channel.shutdown_write()
+        stdout = channel.makefile('rb')
+        stderr = channel.makefile_stderr('rb')
+        output = stdout.read()
+        error = stderr.read()
+        stdout.close()
+        stderr.close()
+        exitCode = channel.recv_exit_status()
+    finally:
+        channel.close()
+    return exitCode, _ToText(output), _ToText(error)
+
+
+def RemoteSync(hostIP, hostPassword, hostUsername, hostPort, filesToUpload, remoteLocation, channels=SFTP_CHANNELS,
+               bundle=True):
+    pairs = [(eachFile, _TransferTarget(eachFile, remoteLocation)) for eachFile in filesToUpload.split(',')]
+    result = TransferResult(hostIP, 'sync')
+    startTime = time.time()
+    localHashes = {}
+    for source, destination in pairs:
+        if os.path.isfile(source):
+            localHashes[os.path.basename(destination)] = _FileSha256(source)
+    try:
+        transport = _ssh_pool.Get(hostIP, hostPort, hostUsername, hostPassword)
+        names = ' '.join([_ShellQuote(name) for name in sorted(localHashes)])
+        exitCode, output, error = _RemoteExec(transport, "cd %s 2>/dev/null || exit 0; command -v sha256sum >/dev/null "
+                                              "|| exit 0; echo '%s'; sha256sum -- %s 2>/dev/null; exit 0" % (
+                                                  _ShellQuote(remoteLocation), SYNC_HASHES_MARKER, names or '/dev/null'))
+    except Exception as e:
+        print("Sync to %s ...Failed!" % hostIP)
+        result.connectError = str(e)
+        return result
+    marker, listing = output.partition(SYNC_HASHES_MARKER + '\n')[1:]
+    if marker:
+        remoteHashes = _ParseSha256Sums(listing)
+    else:
+        RunLog.info("RemoteSync : no remote hashes from %s:%s, sending every file", hostIP, remoteLocation)
+        remoteHashes = {}
+
+    changed = []
+    for source, destination in pairs:
+        name = os.path.basename(destination)
+        if name in localHashes and remoteHashes.get(name) == localHashes[name]:
+            status = TransferStatus(source, destination)
+            status.ok = True
+            status.skipped = True
+            result.files.append(status)
+        else:
+            changed.append(source)
+    if changed:
+        if bundle:
+            sent = RemoteUpload(hostIP, hostPassword, hostUsername, hostPort, ','.join(changed), remoteLocation,
+                                channels=channels, bundle=True)
+        else:
+            sent = RemoteUpload(hostIP, hostPassword, hostUsername, hostPort, ','.join(changed), remoteLocation,
+                                channels=channels)
+        result.connectError = sent.connectError
+        result.files.extend(sent.files)
+    result.duration = time.time() - startTime
+    print("Synced %s file(s) to %s : %s changed, %s failed" % (len(result.files), hostIP, len(changed),
+                                                             len(result.Failed())))
+    return result
+
+
+#Fan-out : the same payload goes to every host of a cluster concurrently, at most maxHosts at a time, so the total
+#time stays close to the slowest host. A host whose transfer fails is retried for the failed files only, after
+#dropping its pooled connection, and every host reports its attempts, progress and throughput.
+DEFAULT_FANOUT_HOSTS = 8
+FANOUT_RETRIES = 2
+FANOUT_RETRY_INTERVAL = 5
+
+
+class FanOutResult(object):
+    def __init__(self):
+        self.hosts = {}
+        self.attempts = {}
+        self.duration = 0.0
+
+    def Failed(self):
+        return sorted([host for host, result in self.hosts.items() if not result.Succeeded()])
+
+    def Succeeded(self):
+        return not self.Failed()
+
+    def Bytes(self):
+        return sum([result.Bytes() for result in self.hosts.values()])
+
+    def Throughput(self):
+        return self.Bytes() / self.duration if self.duration > 0 else 0.0
+
+    def ToDict(self):
+        hosts = {}
+        for host, result in self.hosts.items():
+            hosts[host] = result.ToDict()
+            hosts[host]['attempts'] = self.attempts.get(host, 0)
+        return {'duration': round(self.duration, 3), 'bytes': self.Bytes(), 'throughput': round(self.Throughput(), 1),
+                'failed': self.Failed(), 'hosts': hosts}
+
+
+def _FanOutKey(host):
+    return "%s@%s:%s" % (host[2], host[0], host[3])
+
+
+def _UploadToHost(host, filesToUpload, remoteLocation, mode, channels, retries, retryInterval, fanOut, lock):
+    hostIP, hostPassword, hostUsername, hostPort = host
+    key = _FanOutKey(host)
+    files = filesToUpload.split(',')
+    merged = None
+    attempt = 0
+    while files:
+        attempt += 1
+        if mode == 'sync':
+            result = RemoteSync(hostIP, hostPassword, hostUsername, hostPort, ','.join(files), remoteLocation,
+                                channels=channels)
+        else:
+            result = RemoteUpload(hostIP, hostPassword, hostUsername, hostPort, ','.join(files), remoteLocation,
+                                  channels=channels, bundle=(mode == 'bundle'))
+        if merged is None:
+            merged = result
+        else:
+            #keep the earlier successes, replace the statuses of the files sent again
+            resent = set(files)
+            merged.files = [status for status in merged.files if status.source not in resent] + result.files
+            merged.connectError = result.connectError
+            merged.duration += result.duration
+        if result.connectError is not None:
+            failed = files
+        else:
+            failed = [status.source for status in result.files if not status.ok and os.path.exists(status.source)]
+        RunLog.info("FanOut : %s attempt %s : %s/%s files, %.1f KB/s%s", key, attempt, len(files) - len(failed),
+                    len(files), result.Throughput() / 1024,
+                    " : " + result.connectError if result.connectError else "")
+        if not failed or attempt > retries:
+            break
+        _ssh_pool.Discard(hostIP, hostPort, hostUsername)
+        time.sleep(retryInterval)
+        files = failed
+    with lock:
+        fanOut.hosts[key] = merged
+        fanOut.attempts[key] = attempt
+        print("FanOut : %s done (%s/%s hosts)" % (key, len(fanOut.hosts), fanOut.total))
+
+
+def RemoteUploadToHosts(hosts, filesToUpload, remoteLocation, maxHosts=DEFAULT_FANOUT_HOSTS, mode='sftp',
+                        channels=SFTP_CHANNELS, retries=FANOUT_RETRIES, retryInterval=FANOUT_RETRY_INTERVAL):
+    #hosts : list of (hostIP, hostPassword, hostUsername, hostPort), mode : 'sftp', 'bundle' or 'sync'
+    fanOut = FanOutResult()
+    fanOut.total = len(hosts)
+    pending = deque(hosts)
+    lock = threading.Lock()
+    startTime = time.time()
+
+    def worker():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                host = pending.popleft()
+            try:
+                _UploadToHost(host, filesToUpload, remoteLocation, mode, channels, retries, retryInterval, fanOut, lock)
+            except Exception as e:
+                RunLog.error("FanOut : %s failed : %s", _FanOutKey(host), e)
+                result = TransferResult(host[0], 'upload')
+                result.connectError = str(e)
+                with lock:
+                    fanOut.hosts[_FanOutKey(host)] = result
+
+    workers = [threading.Thread(target=worker) for i in range(min(maxHosts, len(pending)))]
+    for each in workers:
+        each.daemon = True
+        each.start()
+    for each in workers:
+        each.join()
+    fanOut.duration = time.time() - startTime
+    RunLog.info("FanOut : %s hosts in %.2fs, %.1f KB/s, failed : %s", len(hosts), fanOut.duration,
+                fanOut.Throughput() / 1024, fanOut.Failed())
+    return fanOut
 
 
 def ConfigureResolvConf(resolv_conf_filepath, dns_server_ip, vnetDomain):
-    isDnsEntry =  GetStringMatchCount(resolv_conf_filepath, dns_server_ip)
+    #one pass : the search line is only rewritten when the DNS server IP is present exactly once
+    domainReplaceString="search " + vnetDomain
+    result = LineEditor().Count(dns_server_ip).Replace('search', domainReplaceString).Apply(
+        resolv_conf_filepath, onlyIf=lambda result: result.Count(0) == 1)
+    if not result.found:
+        print ('File : %s not found.' % resolv_conf_filepath)
+    isDnsEntry = result.Count(0)
     if isDnsEntry == 1:
-        domainReplaceString="search " + vnetDomain
-        ReplaceStringMatchLinesFromFile(resolv_conf_filepath, 'search', domainReplaceString)
-        isDnsNameEntry =  GetStringMatchCount(resolv_conf_filepath, domainReplaceString)
+        isDnsNameEntry = result.Count(1) if result.written else 0
         if isDnsNameEntry == 1:
             print('Added string "search ' + vnetDomain + '" to ' + resolv_conf_filepath)
             return 0
@@ -872,8 +4352,7 @@ def ConfigureResolvConf(resolv_conf_filepath, dns_server_ip, vnetDomain):
 
 def ConfigureHostsFile(hosts_filepath):
     hostName = JustRun('hostname')
-    AppendTextToFile(hosts_filepath, "127.0.0.1 %s\n" % hostName)
-    isHostsEdited = GetStringMatchCount(hosts_filepath, hostName)
+    isHostsEdited = 1 if AppendTextToFile(hosts_filepath, "127.0.0.1 %s\n" % hostName) else 0
     if isHostsEdited >= 1:
         print('Added string "127.0.0.1 ' + hostName + '" to ' + hosts_filepath)
         return 0
@@ -883,14 +4362,171 @@ def ConfigureHostsFile(hosts_filepath):
 
 
 def GetOSDisk():
-    resourceDiskPartition = JustRun("grep -i '%s' /etc/mtab | awk '{print $1;}' | tr -d '\n'" % GetResourceDiskMountPoint())
+    return GetSystemFacts().OSDisk()
+
+
+def _ProbeOSDisk():
+    mtabLines = GrepFile("/etc/mtab", re.escape(GetResourceDiskMountPoint()), re.I)
+    resourceDiskPartition = ''.join([line.split()[0] for line in mtabLines if line.split()])
     if 'sda' in resourceDiskPartition:
         return 'sdb'
     else :
         return 'sda'
 
-try:
-   import argparse
-except ImportError:
-   InstallPackage("python-argparse")
-   import argparse
+
+#Facts about the VM that cannot change while it is up. They are computed once per process on first use and
+#persisted to a JSON file in the test working directory, so later WALA-*/VERIFY-* scripts of the same session
+#load them instead of probing again. The cache is keyed by the boot id, a reboot (e.g. into a new kernel) invalidates it.
+#Facts read from waagent.conf can change within a boot, the WALA checks edit that file : they are kept together with
+#the path, inode, mtime and size of the file they came from and probed again as soon as it differs. Facts read from the
+#mount table also follow it, a remount changes them.
+SYSTEM_FACTS_FILE = 'system-facts.json'
+CONF_DERIVED_FACTS = ['resourceDiskMountPoint', 'osDisk', 'agentConfigFile']
+MOUNT_DERIVED_FACTS = ['osDisk']
+MOUNT_TABLES = ['/etc/mtab', '/proc/mounts']
+
+
+def _FileStamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return '%s:missing' % path
+    return '%s:%s:%.6f:%s' % (path, st.st_ino, st.st_mtime, st.st_size)
+
+
+def _ContentStamp(path):
+    #files under /proc report no size and a fixed mtime, only their content tells a change
+    import hashlib
+    try:
+        with open(path, 'rb') as f:
+            return '%s:%s' % (path, hashlib.sha256(f.read()).hexdigest())
+    except (IOError, OSError):
+        return '%s:missing' % path
+
+
+class SystemFacts(object):
+    def __init__(self, cacheFile=SYSTEM_FACTS_FILE):
+        self.cacheFile = cacheFile
+        self.bootId = ReadFile('/proc/sys/kernel/random/boot_id').strip()
+        self.values = {}
+        self.stamps = {}
+        self.lock = threading.RLock()
+        self._Load()
+
+    def _Load(self):
+        import json
+        if not self.cacheFile or not os.path.exists(self.cacheFile):
+            return
+        try:
+            with open(self.cacheFile) as f:
+                cached = json.load(f)
+            if cached.get('bootId') == self.bootId:
+                #all facts are plain strings, keep them str rather than unicode on python 2
+                self.values = dict((str(k), str(v)) for k, v in cached.get('facts', {}).items())
+                self.stamps = dict((str(k), str(v)) for k, v in cached.get('stamps', {}).items())
+        except (IOError, OSError, ValueError) as e:
+            RunLog.info("Ignoring unreadable %s : %s", self.cacheFile, e)
+
+    def _Save(self):
+        import json
+        if not self.cacheFile:
+            return
+        tmpFile = '%s.%s.tmp' % (self.cacheFile, os.getpid())
+        try:
+            with open(tmpFile, 'w') as f:
+                json.dump({'bootId': self.bootId, 'facts': self.values, 'stamps': self.stamps}, f, indent=1,
+                          sort_keys=True)
+            os.rename(tmpFile, self.cacheFile)
+        except (IOError, OSError) as e:
+            RunLog.info("Unable to save %s : %s", self.cacheFile, e)
+
+    def _Probe(self, name):
+        if name in ('distro', 'version'):
+            distribution, version = _ProbeDistro()
+            return {'distro': distribution, 'version': version}
+        if name == 'walaConfPath':
+            return {name: _ProbeWalaConfPath()}
+        if name == 'resourceDiskMountPoint':
+            return {name: _ProbeResourceDiskMountPoint()}
+        if name == 'osDisk':
+            return {name: _ProbeOSDisk()}
+        if name == 'kernelRelease':
+            return {name: os.uname()[2]}
+        if name == 'agentConfigFile':
+            return {name: FindWalaConf()}
+        if name == 'initSystem':
+            return {name: _ProbeInitSystem()}
+        raise KeyError(name)
+
+    def _ConfStamp(self, name):
+        #agentConfigFile depends on the file it found, the other facts on the distro's waagent.conf
+        path = self.values.get(name) if name == 'agentConfigFile' else None
+        stamp = _FileStamp(path or self.Get('walaConfPath'))
+        if name in MOUNT_DERIVED_FACTS:
+            stamp = ' '.join([stamp] + [_FileStamp(each) + ' ' + _ContentStamp(each) for each in MOUNT_TABLES])
+        return stamp
+
+    def Get(self, name):
+        with self.lock:
+            if name in CONF_DERIVED_FACTS and name in self.values and self.stamps.get(name) != self._ConfStamp(name):
+                del self.values[name]
+            if name not in self.values:
+                probed = self._Probe(name)
+                self.values.update(probed)
+                for each in probed:
+                    if each in CONF_DERIVED_FACTS:
+                        self.stamps[each] = self._ConfStamp(each)
+                self._Save()
+            return self.values[name]
+
+    def Refresh(self):
+        with self.lock:
+            self.values = {}
+            self.stamps = {}
+            if self.cacheFile and os.path.exists(self.cacheFile):
+                os.remove(self.cacheFile)
+
+    def Distro(self):
+        return self.Get('distro')
+
+    def Version(self):
+        return self.Get('version')
+
+    def WalaConfPath(self):
+        return self.Get('walaConfPath')
+
+    def ResourceDiskMountPoint(self):
+        return self.Get('resourceDiskMountPoint')
+
+    def OSDisk(self):
+        return self.Get('osDisk')
+
+    def KernelRelease(self):
+        return self.Get('kernelRelease')
+
+    def AgentConfigFile(self):
+        return self.Get('agentConfigFile')
+
+    def InitSystem(self):
+        return self.Get('initSystem')
+
+
+_system_facts = None
+_system_facts_lock = threading.Lock()
+
+
+def GetSystemFacts():
+    global _system_facts
+    with _system_facts_lock:
+        if _system_facts is None:
+            _system_facts = SystemFacts()
+        return _system_facts
+
+
+def _ImportArgparse():
+    try:
+        import argparse
+    except ImportError:
+        InstallPackage("python-argparse")
+        import argparse
+    return argparse
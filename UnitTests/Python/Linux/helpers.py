@@ -0,0 +1,17 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the Apache License.
+import os
+import sys
+import tempfile
+
+LINUX_SCRIPTS = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..', 'Testscripts', 'Linux'))
+
+
+def ImportAzureModules():
+    #azuremodules writes Runtime.log, Summary.log and state.txt to the working directory, keep them out of the tree
+    if 'azuremodules' not in sys.modules:
+        os.chdir(tempfile.mkdtemp(prefix='azuremodules-tests-'))
+        if LINUX_SCRIPTS not in sys.path:
+            sys.path.insert(0, LINUX_SCRIPTS)
+    import azuremodules
+    return azuremodules
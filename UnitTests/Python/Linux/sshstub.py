@@ -0,0 +1,142 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the Apache License.
+#
+# Minimal loopback SSH server for the transfer tests : password auth, exec channels run through the local shell and
+# an SFTP subsystem on the local filesystem. Requires paramiko, like the helpers it serves.
+import os
+import socket
+import subprocess
+import threading
+
+import paramiko
+
+PASSWORD = 'password'
+
+
+class _Server(paramiko.ServerInterface):
+    def __init__(self, stub):
+        self.stub = stub
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL if password == PASSWORD else paramiko.AUTH_FAILED
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_channel_exec_request(self, channel, command):
+        self.stub.commands.append(command)
+        thread = threading.Thread(target=_Exec, args=(channel, command, self.stub.env))
+        thread.daemon = True
+        thread.start()
+        return True
+
+
+def _Exec(channel, command, env):
+    proc = subprocess.Popen(command, shell=True, env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE)
+
+    def feed():
+        while True:
+            data = channel.recv(65536)
+            if not data:
+                break
+            proc.stdin.write(data)
+        proc.stdin.close()
+    feeder = threading.Thread(target=feed)
+    feeder.daemon = True
+    feeder.start()
+    while True:
+        data = proc.stdout.read(65536)
+        if not data:
+            break
+        channel.sendall(data)
+    error = proc.stderr.read()
+    if error:
+        channel.sendall_stderr(error)
+    proc.stdout.close()
+    proc.stderr.close()
+    channel.send_exit_status(proc.wait())
+    channel.close()
+
+
+class _Handle(paramiko.SFTPHandle):
+    def stat(self):
+        return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+
+
+class _SFTP(paramiko.SFTPServerInterface):
+    def open(self, path, flags, attr):
+        try:
+            fd = os.open(path, flags, 0o644)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        if flags & (os.O_WRONLY | os.O_RDWR) == 0:
+            mode = 'rb'
+        elif flags & os.O_WRONLY:
+            mode = 'wb'
+        else:
+            mode = 'r+b'
+        handle = _Handle(flags)
+        handle.filename = path
+        handle.readfile = handle.writefile = os.fdopen(fd, mode)
+        return handle
+
+    def stat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    lstat = stat
+
+    def chattr(self, path, attr):
+        if attr.st_mode is not None:
+            os.chmod(path, attr.st_mode)
+        return paramiko.SFTP_OK
+
+    def mkdir(self, path, attr):
+        os.mkdir(path)
+        return paramiko.SFTP_OK
+
+
+class SSHStub(object):
+    def __init__(self, env=None):
+        #env : environment of the exec'd commands, e.g. a PATH without sha256sum
+        self.env = env
+        self.key = paramiko.RSAKey.generate(2048)
+        self.commands = []
+        self.connections = 0
+        self.transports = []
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(16)
+        self.port = self.listener.getsockname()[1]
+        thread = threading.Thread(target=self._Accept)
+        thread.daemon = True
+        thread.start()
+
+    def _Accept(self):
+        while True:
+            try:
+                sock = self.listener.accept()[0]
+            except socket.error:
+                return
+            self.connections += 1
+            transport = paramiko.Transport(sock)
+            transport.add_server_key(self.key)
+            transport.set_subsystem_handler('sftp', paramiko.SFTPServer, _SFTP)
+            self.transports.append(transport)
+            transport.start_server(server=_Server(self))
+
+    def Host(self):
+        #(hostIP, hostPassword, hostUsername, hostPort) as RemoteUploadToHosts takes them
+        return ('127.0.0.1', PASSWORD, 'user', self.port)
+
+    def Close(self):
+        self.listener.close()
+        for transport in self.transports:
+            transport.close()
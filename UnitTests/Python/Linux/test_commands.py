@@ -0,0 +1,104 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the Apache License.
+import errno
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import helpers
+
+azuremodules = helpers.ImportAzureModules()
+
+
+def _Alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno != errno.ESRCH
+    #a killed child of the test process itself is a zombie until reaped, it no longer runs
+    try:
+        with open('/proc/%s/stat' % pid) as f:
+            return f.read().split(')')[-1].split()[0] != 'Z'
+    except IOError:
+        return False
+
+
+class RunStreamTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='azuremodules-commands-')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_output_and_exit_code(self):
+        lines = []
+        result = azuremodules.RunStream('echo one; echo two >&2; echo three; exit 3', onStdout=lines.append)
+        self.assertEqual(result.exitCode, 3)
+        self.assertFalse(result.Succeeded())
+        self.assertEqual(result.stdout, 'one\nthree\n')
+        self.assertEqual(result.stderr, 'two\n')
+        self.assertEqual(lines, ['one', 'three'])
+
+    def test_timeout_kills_the_process_group(self):
+        pidFile = os.path.join(self.directory, 'pid')
+        startTime = time.time()
+        result = azuremodules.RunStream('sleep 30 & echo $! > %s; wait' % pidFile, timeout=0.5)
+        self.assertTrue(time.time() - startTime < 5)
+        self.assertTrue(result.timedOut)
+        self.assertFalse(result.Succeeded())
+        with open(pidFile) as f:
+            pid = int(f.read())
+        for attempt in range(20):
+            if not _Alive(pid):
+                break
+            time.sleep(0.1)
+        self.assertFalse(_Alive(pid))
+
+    def test_background_child_does_not_hold_the_result(self):
+        #the command exits at once but its background child keeps stdout and stderr open
+        startTime = time.time()
+        result = azuremodules.RunStream('echo started; sleep 10 &', timeout=60)
+        self.assertTrue(time.time() - startTime < azuremodules.STREAM_DRAIN_TIMEOUT + 3)
+        self.assertEqual(result.exitCode, 0)
+        self.assertFalse(result.timedOut)
+        self.assertEqual(result.stdout, 'started\n')
+
+    def test_output_is_bounded(self):
+        result = azuremodules.RunStream('seq 1 100000', maxOutputBytes=1000, spillToFile=True)
+        try:
+            self.assertTrue(result.truncated)
+            self.assertTrue(len(result.stdout) <= 1000)
+            self.assertTrue(result.stdout.endswith('99999\n100000\n'))
+            self.assertEqual(result.stdoutBytes, os.path.getsize(result.spillFile))
+            with open(result.spillFile) as f:
+                self.assertEqual(f.readline(), '1\n')
+        finally:
+            os.remove(result.spillFile)
+
+
+class RunManyTest(unittest.TestCase):
+    def test_results_by_name(self):
+        results = azuremodules.RunMany({'ok': 'echo ok', 'fails': 'exit 2', 'err': 'echo no >&2'})
+        self.assertEqual(sorted(results), ['err', 'fails', 'ok'])
+        self.assertEqual(results['ok'].stdout, 'ok\n')
+        self.assertEqual(results['fails'].exitCode, 2)
+        self.assertEqual(results['err'].stderr, 'no\n')
+
+    def test_commands_run_in_parallel(self):
+        startTime = time.time()
+        results = azuremodules.RunMany(dict([('sleep%s' % index, 'sleep 0.5') for index in range(6)]), maxWorkers=6)
+        self.assertTrue(time.time() - startTime < 2)
+        self.assertTrue(all([result.Succeeded() for result in results.values()]))
+
+    def test_timeout_applies_to_each_command(self):
+        startTime = time.time()
+        results = azuremodules.RunMany({'fast': 'echo done', 'slow': 'sleep 30', 'slower': 'sleep 60'}, timeout=0.5)
+        self.assertTrue(time.time() - startTime < 5)
+        self.assertTrue(results['fast'].Succeeded())
+        self.assertTrue(results['slow'].timedOut and results['slower'].timedOut)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the Apache License.
+import socket
+import struct
+import threading
+import unittest
+
+import helpers
+
+azuremodules = helpers.ImportAzureModules()
+
+QUERY_ID = 0x1234
+
+
+def _Name(name):
+    packet = bytearray()
+    for label in name.split('.'):
+        packet.append(len(label))
+        packet.extend(label.encode('ascii'))
+    packet.append(0)
+    return bytes(packet)
+
+
+def _Reply(queryId, name, qtype, answers, rcode=0):
+    #answers : [(type, rdata)], the owner names are compression pointers to the question at offset 12
+    packet = struct.pack('>HHHHHH', queryId, 0x8180 | rcode, 1, len(answers), 0, 0)
+    packet += _Name(name) + struct.pack('>HH', qtype, 1)
+    for rtype, rdata in answers:
+        packet += struct.pack('>HHHIH', 0xc00c, rtype, 1, 300, len(rdata)) + rdata
+    return packet
+
+
+class DnsServer(object):
+    #answers every query on loopback with Reply(queryId, name, qtype)
+    def __init__(self, reply):
+        self.reply = reply
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.port = self.sock.getsockname()[1]
+        thread = threading.Thread(target=self._Serve)
+        thread.daemon = True
+        thread.start()
+
+    def _Serve(self):
+        while True:
+            try:
+                query, address = self.sock.recvfrom(4096)
+            except socket.error:
+                return
+            queryId = struct.unpack('>H', query[:2])[0]
+            name, offset = azuremodules._DnsReadName(bytearray(query), 12)
+            qtype = struct.unpack('>H', query[offset:offset + 2])[0]
+            self.sock.sendto(self.reply(queryId, name, qtype), address)
+
+    def Close(self):
+        self.sock.close()
+
+
+class ParseResponseTest(unittest.TestCase):
+    def test_a_record(self):
+        reply = _Reply(QUERY_ID, 'vm1.example.com', azuremodules.DNS_TYPE_A,
+                       [(azuremodules.DNS_TYPE_A, bytes(bytearray([10, 0, 0, 4])))])
+        self.assertEqual(azuremodules._DnsParseResponse(reply, QUERY_ID), (0, [(azuremodules.DNS_TYPE_A, '10.0.0.4')]))
+
+    def test_ptr_record_with_compressed_name(self):
+        #the PTR target ends with a pointer back into the question name
+        question = '4.0.0.10.in-addr.arpa'
+        rdata = bytes(bytearray([3])) + b'vm1' + struct.pack('>H', 0xc000 | (12 + len(question) + 1))
+        reply = _Reply(QUERY_ID, question + '.example', azuremodules.DNS_TYPE_PTR, [(azuremodules.DNS_TYPE_PTR, rdata)])
+        self.assertEqual(azuremodules._DnsParseResponse(reply, QUERY_ID),
+                         (0, [(azuremodules.DNS_TYPE_PTR, 'vm1.example')]))
+
+    def test_rcode_and_foreign_packets(self):
+        reply = _Reply(QUERY_ID, 'missing.example.com', azuremodules.DNS_TYPE_A, [], rcode=3)
+        self.assertEqual(azuremodules._DnsParseResponse(reply, QUERY_ID), (3, []))
+        self.assertEqual(azuremodules._DnsParseResponse(reply, QUERY_ID + 1), None)
+        self.assertEqual(azuremodules._DnsParseResponse(reply[:11], QUERY_ID), None)
+
+    def test_malformed_replies_raise(self):
+        valid = _Reply(QUERY_ID, 'vm1.example.com', azuremodules.DNS_TYPE_A,
+                       [(azuremodules.DNS_TYPE_A, bytes(bytearray([10, 0, 0, 4])))])
+        header = struct.pack('>HHHHHH', QUERY_ID, 0x8180, 1, 1, 0, 0)
+        loop = header + struct.pack('>H', 0xc00c)
+        for reply in [valid[:-2], valid[:-12], valid[:20], header, loop]:
+            self.assertRaises((IndexError, ValueError, struct.error), azuremodules._DnsParseResponse, reply, QUERY_ID)
+
+
+class ProbeDnsTest(unittest.TestCase):
+    def Probe(self, reply, **kwargs):
+        server = DnsServer(reply)
+        try:
+            return azuremodules.ProbeDns(server='127.0.0.1', port=server.port, timeout=0.5, retries=0, **kwargs)
+        finally:
+            server.Close()
+
+    def test_forward_and_reverse_lookups_agree(self):
+        def reply(queryId, name, qtype):
+            if qtype == azuremodules.DNS_TYPE_PTR:
+                return _Reply(queryId, name, qtype, [(qtype, _Name('vm1.example.com'))])
+            return _Reply(queryId, name, qtype, [(qtype, bytes(bytearray([10, 0, 0, 4])))])
+        report = self.Probe(reply, pairs=[('vm1.example.com', '10.0.0.4')])
+        self.assertTrue(report.Succeeded())
+        self.assertEqual(report.Query('vm1.example.com').Values(), ['10.0.0.4'])
+
+    def test_malformed_reply_is_a_failed_query(self):
+        #the answer count says one record but the reply ends after the question
+        def reply(queryId, name, qtype):
+            packet = _Reply(queryId, name, qtype, [])
+            return packet[:6] + struct.pack('>H', 1) + packet[8:]
+        report = self.Probe(reply, names=['vm1.example.com'])
+        self.assertFalse(report.Succeeded())
+        self.assertEqual(len(report.queries), 1)
+        query = report.Query('vm1.example.com')
+        self.assertFalse(query.Succeeded())
+        self.assertTrue(query.error.startswith('malformed reply'))
+
+        report = self.Probe(reply, pairs=[('vm1.example.com', '10.0.0.4')])
+        self.assertFalse(report.Succeeded())
+        self.assertEqual(len(report.Failed()), 2)
+        self.assertEqual(len(report.mismatches), 2)
+
+    def test_query_is_never_none(self):
+        report = azuremodules.DnsProbeReport()
+        self.assertFalse(report.Succeeded())
+        query = report.Query('vm1.example.com')
+        self.assertFalse(query.Succeeded())
+        self.assertEqual(query.error, 'not queried')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the Apache License.
+import os
+import shutil
+import tempfile
+import unittest
+
+import helpers
+
+azuremodules = helpers.ImportAzureModules()
+
+
+class SystemFactsTest(unittest.TestCase):
+    #the probes and mount tables are replaced : these tests only drive the cache invalidation around them
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='azuremodules-facts-')
+        self.saved = dict((name, getattr(azuremodules, name)) for name in ('_ProbeOSDisk', 'MOUNT_TABLES'))
+        self.conf = self.Write('waagent.conf', 'ResourceDisk.MountPoint=/mnt/resource\n')
+        self.mtab = self.Write('mtab', '/dev/sdb1 /mnt/resource ext4 rw 0 0\n')
+        azuremodules.MOUNT_TABLES = [self.mtab]
+        self.probes = []
+        azuremodules._ProbeOSDisk = lambda: self.probes.append(1) or 'sda'
+        self.facts = azuremodules.SystemFacts(cacheFile=os.path.join(self.directory, 'system-facts.json'))
+        self.facts.values['walaConfPath'] = self.conf
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(azuremodules, name, value)
+        shutil.rmtree(self.directory)
+
+    def Write(self, name, text):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def test_os_disk_is_probed_once(self):
+        self.assertEqual([self.facts.Get('osDisk') for each in range(3)], ['sda'] * 3)
+        self.assertEqual(len(self.probes), 1)
+
+    def test_os_disk_follows_the_mount_table(self):
+        self.facts.Get('osDisk')
+        #same size and mtime, like /proc/mounts after a remount : only the content differs
+        stat = os.stat(self.mtab)
+        self.Write('mtab', '/dev/sda1 /mnt/resource ext4 rw 0 0\n')
+        os.utime(self.mtab, (stat.st_atime, stat.st_mtime))
+        self.facts.Get('osDisk')
+        self.assertEqual(len(self.probes), 2)
+        self.facts.Get('osDisk')
+        self.assertEqual(len(self.probes), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the Apache License.
+import os
+import py_compile
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import helpers
+
+#the module's own import cost, on top of the standard modules azuremodules has always imported : anything else it
+#needs is imported by the functions using it, so that cost is only paid by the checks calling them
+IMPORT_BUDGET_MS = 10
+IMPORT_RUNS = 5
+BASELINE_MODULES = 'logging, os, re, subprocess, sys, time'
+#python 2 only, the shell helpers of the original module
+BASELINE_EXTRA_MODULES = ['commands']
+
+
+def _RunPython(code, cwd, env=None):
+    proc = subprocess.Popen([sys.executable, '-c', code], cwd=cwd, env=env, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE)
+    out, err = proc.communicate()
+    return proc.returncode, out.decode('utf-8'), err.decode('utf-8')
+
+
+class ImportTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='azuremodules-import-')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_import_has_no_side_effects(self):
+        #tracing and profiling are requested, yet nothing may start before the first command
+        env = dict(os.environ, AZUREMODULES_TRACE='1', AZUREMODULES_PROFILE=os.path.join(self.directory, 'profile'))
+        code = ("import sys, threading\n"
+                "sys.path.insert(0, %r)\n"
+                "import azuremodules\n"
+                "sys.stdout.write('%%s %%s %%s' %% (threading.active_count(), azuremodules._command_tracer,\n"
+                "                                azuremodules._results_recorder))\n") % helpers.LINUX_SCRIPTS
+        exitCode, out, err = _RunPython(code, self.directory, env)
+        self.assertEqual((exitCode, err), (0, ''))
+        self.assertEqual(out, '1 None None')
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_import_time_budget(self):
+        #from a compiled module, the way every script after the first one of a run gets it
+        shutil.copy(os.path.join(helpers.LINUX_SCRIPTS, 'azuremodules.py'), self.directory)
+        py_compile.compile(os.path.join(self.directory, 'azuremodules.py'), doraise=True)
+        code = ("import %s\n"
+                "startTime = time.time()\n"
+                "import azuremodules\n"
+                "sys.stdout.write('%%f' %% ((time.time() - startTime) * 1000))\n") % BASELINE_MODULES
+        timings = []
+        for each in range(IMPORT_RUNS):
+            exitCode, out, err = _RunPython(code, self.directory)
+            self.assertEqual((exitCode, err), (0, ''))
+            timings.append(float(out))
+        self.assertLess(min(timings), IMPORT_BUDGET_MS, "import took %s ms" % ', '.join(['%.1f' % t for t in timings]))
+
+    def test_import_loads_no_other_modules(self):
+        code = ("import %s\n"
+                "before = set(sys.modules)\n"
+                "sys.path.insert(0, %r)\n"
+                "import azuremodules\n"
+                "sys.stdout.write(' '.join(sorted(set(sys.modules) - before)))\n") % (BASELINE_MODULES,
+                                                                                     helpers.LINUX_SCRIPTS)
+        exitCode, out, err = _RunPython(code, self.directory)
+        self.assertEqual((exitCode, err), (0, ''))
+        self.assertEqual([name for name in out.split() if name not in BASELINE_EXTRA_MODULES], ['azuremodules'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the Apache License.
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import helpers
+
+azuremodules = helpers.ImportAzureModules()
+
+IPERF3_TCP = '''Connecting to host 10.0.0.5, port 5201
+[  5] local 10.0.0.4 port 50000 connected to 10.0.0.5 port 5201
+[ ID] Interval           Transfer     Bitrate         Retr  Cwnd
+[  5]   0.00-1.00   sec   112 MBytes   940 Mbits/sec    0    3.00 MBytes
+[  5]   1.00-2.00   sec   112 MBytes   960 Mbits/sec    2    3.00 MBytes
+[  5]   2.00-3.00   sec   110 MBytes   920 Mbits/sec    1    3.00 MBytes
+- - - - - - - - - - - - - - - - - - - - - - - - -
+[ ID] Interval           Transfer     Bitrate         Retr
+[  5]   0.00-3.00   sec   334 MBytes   940 Mbits/sec    3             sender
+[  5]   0.00-3.00   sec   333 MBytes   938 Mbits/sec                  receiver
+
+iperf Done.
+'''
+
+IPERF2_UDP_SERVER = '''------------------------------------------------------------
+Server listening on UDP port 5001
+------------------------------------------------------------
+[  3] local 10.0.0.5 port 5001 connected with 10.0.0.4 port 40000
+[  3]  0.0- 1.0 sec   128 KBytes  1.05 Mbits/sec   0.020 ms    0/   89 (0%)
+[  3]  1.0- 2.0 sec   128 KBytes  1.05 Mbits/sec   0.010 ms    1/   89 (1.1%)
+[  3]  0.0- 2.0 sec   256 KBytes  1.05 Mbits/sec   0.010 ms    1/  178 (0.56%)
+'''
+
+IPERF2_TCP_STREAMS = '''[  4]  0.0- 1.0 sec  50.0 MBytes   400 Mbits/sec
+[  3]  0.0- 1.0 sec  50.0 MBytes   420 Mbits/sec
+[SUM]  0.0- 1.0 sec   100 MBytes   820 Mbits/sec
+[  4]  1.0- 2.0 sec  50.0 MBytes   410 Mbits/sec
+[  3]  1.0- 2.0 sec  50.0 MBytes   410 Mbits/sec
+[SUM]  1.0- 2.0 sec   100 MBytes   820 Mbits/sec
+[  4]  0.0- 2.0 sec   100 MBytes   405 Mbits/sec
+[  3]  0.0- 2.0 sec   100 MBytes   415 Mbits/sec
+[SUM]  0.0- 2.0 sec   200 MBytes   820 Mbits/sec
+'''
+
+
+def _JsonInterval(start, bitsPerSecond):
+    stream = {'socket': 5, 'start': start, 'end': start + 1, 'bytes': int(bitsPerSecond / 8),
+              'bits_per_second': bitsPerSecond, 'retransmits': 0}
+    return {'streams': [stream], 'sum': dict(stream)}
+
+
+class IperfParserTest(unittest.TestCase):
+    def test_iperf3_tcp_text(self):
+        parser = azuremodules.IperfParser().Feed(IPERF3_TCP).Close()
+        self.assertEqual(parser.Streams(), ['5'])
+        self.assertEqual([sample.bandwidth for sample in parser.Series()], [940e6, 960e6, 920e6])
+        self.assertEqual(parser.samples[0].bytes, 112 * 1024 ** 2)
+        self.assertEqual(len(parser.summary), 2)
+        stats = parser.Stats()
+        self.assertEqual(stats['intervals'], 3)
+        self.assertAlmostEqual(stats['mean'], 940e6)
+        self.assertEqual((stats['min'], stats['p50'], stats['max']), (920e6, 940e6, 960e6))
+        self.assertEqual(stats['retransmits'], 3)
+        self.assertTrue(0.98 < stats['stability'] < 1.0)
+
+    def test_iperf2_udp_summary_is_not_an_interval(self):
+        parser = azuremodules.IperfParser().Feed(IPERF2_UDP_SERVER).Close()
+        self.assertEqual(len(parser.samples), 2)
+        self.assertEqual(len(parser.summary), 1)
+        stats = parser.Stats()
+        self.assertAlmostEqual(stats['meanJitterMs'], 0.015)
+        self.assertAlmostEqual(stats['lossPercent'], 100.0 / 178)
+        self.assertEqual(stats['stability'], 1.0)
+
+    def test_iperf2_parallel_streams_use_the_sum_series(self):
+        parser = azuremodules.IperfParser().Feed(IPERF2_TCP_STREAMS).Close()
+        self.assertEqual(parser.Streams(), ['3', '4', 'SUM'])
+        self.assertEqual([sample.bandwidth for sample in parser.Series()], [820e6, 820e6])
+        self.assertEqual([sample.bandwidth for sample in parser.Series('4')], [400e6, 410e6])
+        self.assertEqual(len(parser.summary), 3)
+
+    def test_partial_lines(self):
+        whole = azuremodules.IperfParser().Feed(IPERF3_TCP).Close()
+        chunked = azuremodules.IperfParser()
+        for index in range(0, len(IPERF3_TCP), 7):
+            chunked.Feed(IPERF3_TCP[index:index + 7])
+        self.assertEqual(chunked.Close().ToDict(), whole.ToDict())
+
+    def test_json_document_and_stream(self):
+        intervals = [_JsonInterval(0, 8e8), _JsonInterval(1, 1e9)]
+        end = {'sum_sent': {'start': 0, 'end': 2, 'bytes': int(1.8e9 / 8), 'bits_per_second': 9e8}}
+        document = json.dumps({'start': {}, 'intervals': intervals, 'end': end}, indent=4)
+        events = '\n'.join([json.dumps({'event': 'interval', 'data': interval}) for interval in intervals] +
+                           [json.dumps({'event': 'end', 'data': end})]) + '\n'
+        for text in [document + '\n', events]:
+            parser = azuremodules.IperfParser().Feed(text).Close()
+            self.assertEqual([sample.bandwidth for sample in parser.Series()], [8e8, 1e9])
+            self.assertEqual(parser.Stats()['mean'], 9e8)
+            self.assertEqual([sample.kind for sample in parser.summary], ['sum_sent'])
+
+    def test_long_runs_parse_in_linear_time(self):
+        #20000 one second intervals, a full day of streaming run took seconds when every line rescanned the series
+        text = ''.join(['[  5] %7.2f-%7.2f sec   112 MBytes   940 Mbits/sec    0    3.00 MBytes\n' % (index, index + 1)
+                        for index in range(20000)])
+        startTime = time.time()
+        parser = azuremodules.IperfParser().Feed(text).Close()
+        self.assertTrue(time.time() - startTime < 2)
+        self.assertEqual(len(parser.samples), 20000)
+        self.assertEqual(parser.summary, [])
+
+    def test_errors_are_collected(self):
+        parser = azuremodules.IperfParser().Feed('iperf3: error - unable to connect to server\n').Close()
+        self.assertEqual(parser.Stats(), {'intervals': 0})
+        self.assertEqual(parser.errors, ['iperf3: error - unable to connect to server'])
+
+    def test_follow_a_growing_file(self):
+        directory = tempfile.mkdtemp(prefix='azuremodules-iperf-')
+        try:
+            path = os.path.join(directory, 'iperf-client.txt')
+            lines = IPERF3_TCP.splitlines(True)
+            with open(path, 'w') as f:
+                f.writelines(lines[:4])
+                f.write(lines[4][:20])
+            parser = azuremodules.IperfParser().Follow(path)
+            self.assertEqual(len(parser.samples), 1)
+            with open(path, 'a') as f:
+                f.write(lines[4][20:])
+                f.writelines(lines[5:])
+            parser.Poll().Close()
+            self.assertEqual(len(parser.samples), 3)
+            self.assertEqual(parser.ToDict(), azuremodules.ParseIperfFile(path).ToDict())
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
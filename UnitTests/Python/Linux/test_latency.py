@@ -0,0 +1,98 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the Apache License.
+import random
+import socket
+import unittest
+
+import helpers
+
+azuremodules = helpers.ImportAzureModules()
+
+
+def _NearestRank(sortedValues, percent):
+    return azuremodules._Percentile(sortedValues, percent)
+
+
+class LatencyHistogramTest(unittest.TestCase):
+    def test_percentiles_within_three_percent(self):
+        generator = random.Random(7)
+        values = [int(generator.lognormvariate(11, 1.5)) for each in range(50000)]
+        histogram = azuremodules.LatencyHistogram()
+        for value in values:
+            histogram.Record(value)
+        values.sort()
+        for percent in azuremodules.LATENCY_PERCENTILES + [0.1, 25, 75, 100]:
+            exact = _NearestRank(values, percent)
+            self.assertTrue(abs(histogram.Percentile(percent) - exact) <= 0.03 * exact,
+                            'p%s : %s, exact %s' % (percent, histogram.Percentile(percent), exact))
+        self.assertEqual((histogram.minimum, histogram.maximum), (values[0], values[-1]))
+        self.assertAlmostEqual(histogram.Mean(), float(sum(values)) / len(values))
+
+    def test_small_values_are_exact(self):
+        histogram = azuremodules.LatencyHistogram()
+        for value in range(1, 33):
+            histogram.Record(value)
+        self.assertEqual(histogram.Percentile(50), 16)
+        self.assertEqual(histogram.Percentile(0), 1)
+
+    def test_memory_is_fixed(self):
+        histogram = azuremodules.LatencyHistogram()
+        size = histogram.MemoryBytes()
+        self.assertTrue(size < 5 * 1024)
+        for value in range(0, 10 ** 7, 997):
+            histogram.Record(value)
+        histogram.RecordSeconds(3600)
+        self.assertEqual(histogram.MemoryBytes(), size)
+        self.assertEqual(histogram.maximum, 3600 * 10 ** 9)
+
+    def test_merge(self):
+        first, second, both = [azuremodules.LatencyHistogram() for each in range(3)]
+        for value in range(1000, 100000, 7):
+            (first if value % 2 else second).Record(value)
+            both.Record(value)
+        first.Merge(second)
+        self.assertEqual(first.count, both.count)
+        self.assertEqual(first.ToDict(), both.ToDict())
+
+    def test_empty(self):
+        histogram = azuremodules.LatencyHistogram()
+        self.assertEqual((histogram.Mean(), histogram.Percentile(99)), (None, None))
+        self.assertEqual(histogram.ToDict()['percentilesUs']['p99'], None)
+
+
+class LatencyProbeTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = azuremodules.LatencyEchoServer(port=0, bindAddress='127.0.0.1')
+        cls.port = cls.server.Start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.Stop()
+
+    def test_loopback_modes(self):
+        for mode in ['tcp', 'udp', 'connect']:
+            report = azuremodules.RunLatencyProbe('127.0.0.1', self.port, mode=mode, count=200)
+            self.assertTrue(report.Succeeded(), '%s : %s' % (mode, report.errors))
+            self.assertEqual(report.histogram.count + report.timeouts, 200)
+            result = report.ToDict()
+            self.assertTrue(0 < result['percentilesUs']['p50'] <= result['percentilesUs']['p99.99'] <= result['maxUs'])
+
+    def test_duration_limits_the_rounds(self):
+        report = azuremodules.RunLatencyProbe('127.0.0.1', self.port, count=10 ** 9, duration=0.3)
+        self.assertTrue(report.Succeeded())
+        self.assertTrue(report.duration < 2)
+
+    def test_closed_port_is_an_error(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        for mode in ['tcp', 'udp']:
+            report = azuremodules.RunLatencyProbe('127.0.0.1', port, mode=mode, count=5, timeout=0.2)
+            self.assertFalse(report.Succeeded())
+            self.assertEqual(report.histogram.count, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
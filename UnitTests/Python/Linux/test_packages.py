@@ -0,0 +1,60 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the Apache License.
+import unittest
+
+import helpers
+
+azuremodules = helpers.ImportAzureModules()
+
+
+class InstallPackagesTest(unittest.TestCase):
+    #the package manager itself is replaced : these tests only drive the bookkeeping around it
+    def setUp(self):
+        self.saved = dict((name, getattr(azuremodules, name)) for name in ('DetectDistro', 'RunStream'))
+        self.index = azuremodules.GetInstalledPackages()
+        self.index.packages = {'curl': '7.0'}
+        self.commands = []
+        self.index.Invalidate = lambda: None
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(azuremodules, name, value)
+        del self.index.Invalidate
+        self.index.packages = None
+
+    def FakeRunStream(self, output, exitCode):
+        def runStream(cmd, timeout=None):
+            self.commands.append(cmd)
+            result = azuremodules.CommandResult(cmd)
+            result.exitCode = exitCode
+            result.stdout = output(cmd)
+            return result
+        azuremodules.RunStream = runStream
+
+    def test_package_manager_matches_install_package(self):
+        for distro, packageManager in [('ubuntu', 'apt'), ('Debian', 'apt'), ('centos', 'yum'), ('Oracle', 'yum'),
+                                       ('sles', 'zypper'), ('opensuse', 'zypper'), ('unknown', None)]:
+            self.assertEqual(azuremodules.GetPackageManager(distro), packageManager)
+
+    def test_nothing_to_install_skips_distro_detection(self):
+        def detectDistro():
+            raise AssertionError('DetectDistro called')
+        azuremodules.DetectDistro = detectDistro
+        result = azuremodules.InstallPackages(['curl', 'curl'])
+        self.assertTrue(result.Succeeded())
+        self.assertEqual(result.status, {'curl': 'already-installed'})
+        self.assertEqual(result.packageManager, None)
+
+    def test_unknown_packages_are_retried_once(self):
+        azuremodules.DetectDistro = lambda: ['ubuntu', '20.04']
+        #every attempt reports the first requested package as unknown
+        self.FakeRunStream(lambda cmd: 'E: Unable to locate package %s\n' % cmd.split()[4], 100)
+        result = azuremodules.InstallPackages(['curl', 'nope1', 'nope2', 'nope3'])
+        self.assertEqual(len(self.commands), 2)
+        self.assertEqual(result.packageManager, 'apt')
+        self.assertEqual(result.status, {'curl': 'already-installed', 'nope1': 'not-found', 'nope2': 'not-found',
+                                         'nope3': 'failed'})
+
+
+if __name__ == '__main__':
+    unittest.main()
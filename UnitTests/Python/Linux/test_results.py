@@ -0,0 +1,76 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the Apache License.
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import helpers
+
+azuremodules = helpers.ImportAzureModules()
+
+PASSWORD = 'Pa$$w0rd 1'
+SUDO_COMMAND = "echo '%s' | sudo -S sed -i s/Logs.Verbose=n/Logs.Verbose=y/g /etc/waagent.conf" % PASSWORD
+
+
+class RedactCommandTest(unittest.TestCase):
+    def test_secrets_are_masked(self):
+        for cmd, expected in [
+                (SUDO_COMMAND, "echo '***' | sudo -S sed -i s/Logs.Verbose=n/Logs.Verbose=y/g /etc/waagent.conf"),
+                ('echo "%s"|sudo -S ' % PASSWORD, "echo '***'|sudo -S "),
+                ("echo 'root:%s' | chpasswd" % PASSWORD, "echo '***' | chpasswd"),
+                ("sshpass -p '%s' scp a b" % PASSWORD, "sshpass -p '***' scp a b"),
+                ("tool --password='%s' -v" % PASSWORD, "tool --password='***' -v")]:
+            self.assertEqual(azuremodules._RedactCommand(cmd), expected)
+
+    def test_other_commands_are_unchanged(self):
+        for cmd in ['echo hello | grep h', 'sudo -S ls', 'ps -ef | grep waagent', '']:
+            self.assertEqual(azuremodules._RedactCommand(cmd), cmd)
+
+
+class ResultsRecorderTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='azuremodules-results-')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_recorded_commands_are_redacted(self):
+        path = os.path.join(self.directory, 'results.json')
+        recorder = azuremodules.ResultsRecorder(path, testName='WALA-VERIFY-VERBOSE-ENABLED-LOGS')
+        with recorder.Check('EnableVerboseLogs'):
+            recorder.RecordCommand(SUDO_COMMAND, time.time(), 0, 0)
+        recorder.RecordCommand(SUDO_COMMAND, time.time(), 0, 0)
+        recorder.SetState('TestCompleted')
+        with open(path) as f:
+            text = f.read()
+        self.assertFalse(PASSWORD in text)
+        results = json.loads(text)
+        self.assertEqual(results['commands'][0]['cmd'], azuremodules._RedactCommand(SUDO_COMMAND))
+        self.assertEqual(results['checks'][0]['commands'][0]['cmd'], azuremodules._RedactCommand(SUDO_COMMAND))
+
+
+class CommandTraceTest(unittest.TestCase):
+    def test_traced_and_logged_commands_are_redacted(self):
+        directory = tempfile.mkdtemp(prefix='azuremodules-trace-')
+        try:
+            tracer = azuremodules.CommandTracer(os.path.join(directory, 'command-trace.json'))
+            tracer.Record('Run', SUDO_COMMAND, time.time(), 0, 0)
+            tracer.Report()
+            with open(tracer.path) as f:
+                self.assertFalse(PASSWORD in f.read())
+        finally:
+            shutil.rmtree(directory)
+        #timed out : the command line goes to the error and the debug line of Runtime.log
+        azuremodules.RunStream("echo '%s' | sudo -S sleep 5" % PASSWORD, timeout=0.2)
+        azuremodules.WRunLog.flush()
+        with open(azuremodules.WRunLog.baseFilename) as f:
+            log = f.read()
+        self.assertTrue("echo '***' | sudo -S sleep 5" in log)
+        self.assertFalse(PASSWORD in log)
+
+
+if __name__ == '__main__':
+    unittest.main()
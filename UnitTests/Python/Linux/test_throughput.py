@@ -0,0 +1,79 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the Apache License.
+import socket
+import unittest
+
+import helpers
+
+azuremodules = helpers.ImportAzureModules()
+
+DURATION = 1
+INTERVAL = 0.25
+
+
+class ThroughputTest(unittest.TestCase):
+    def Run(self, udp=False, streams=3, **kwargs):
+        server = azuremodules.ThroughputServer(port=0, udp=udp, interval=INTERVAL, bindAddress='127.0.0.1')
+        port = server.Start()
+        try:
+            client = azuremodules.RunThroughputClient('127.0.0.1', port, streams=streams, duration=DURATION, udp=udp,
+                                                      interval=INTERVAL, **kwargs)
+        finally:
+            received = server.Stop()
+        return client, received
+
+    def CheckTcp(self, client, received):
+        self.assertTrue(client.Succeeded(), client.ToDict()['perStream'])
+        self.assertTrue(received.Succeeded(), received.ToDict()['perStream'])
+        self.assertEqual(len(received.streams), 3)
+        self.assertEqual(received.Bytes(), client.Bytes())
+        self.assertTrue(client.Gbps() > 0)
+        intervals = client.Intervals()
+        self.assertTrue(DURATION / INTERVAL <= len(intervals) <= DURATION / INTERVAL + 1)
+        self.assertEqual(sum([interval['bytes'] for interval in intervals]), client.Bytes())
+
+    def test_tcp_streams(self):
+        self.CheckTcp(*self.Run(zeroCopy=False))
+
+    def test_tcp_streams_with_sendfile(self):
+        self.CheckTcp(*self.Run(zeroCopy=True))
+
+    def test_udp_streams(self):
+        client, received = self.Run(udp=True, streams=2, bandwidth=20 * 1000 * 1000)
+        self.assertTrue(client.Succeeded(), client.ToDict()['perStream'])
+        self.assertEqual(len(received.streams), 2)
+        for stream in client.streams:
+            #paced at 20 Mbit/s in 1400 byte datagrams for one second
+            self.assertTrue(1000 < stream.packets < 2500, stream.packets)
+            self.assertEqual(stream.received + stream.lost, stream.packets)
+        self.assertEqual(sorted([stream.received for stream in client.streams]),
+                         sorted([stream.received for stream in received.streams]))
+        sent = sum([stream.packets for stream in client.streams])
+        lost = sum([stream.lost for stream in client.streams])
+        self.assertEqual(client.ToDict()['lossPercent'], round(100.0 * lost / sent, 4))
+
+    def test_udp_loss_is_lost_over_sent(self):
+        #the sender knows what it sent, the receiver knows the highest sequence : both report the lost share of it
+        report = azuremodules.ThroughputReport('udp')
+        for sent, received in [(100, 50), (300, 300)]:
+            stream = azuremodules.StreamStats(len(report.streams))
+            stream.packets = sent
+            stream.received = received
+            stream.lost = sent - received
+            report.streams.append(stream)
+        self.assertEqual(report.streams[0].LossPercent(), 50.0)
+        self.assertEqual(report.streams[0].ToDict()['lossPercent'], 50.0)
+        self.assertEqual(report.ToDict()['lossPercent'], 12.5)
+
+    def test_closed_port_fails(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        report = azuremodules.RunThroughputClient('127.0.0.1', port, streams=2, duration=DURATION)
+        self.assertFalse(report.Succeeded())
+        self.assertEqual(len([stream for stream in report.streams if stream.error]), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
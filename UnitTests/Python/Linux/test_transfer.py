@@ -0,0 +1,213 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the Apache License.
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+
+import helpers
+
+try:
+    import sshstub
+except ImportError:
+    sshstub = None
+
+azuremodules = helpers.ImportAzureModules()
+
+
+def _MakeFiles(directory, count):
+    paths = []
+    for index in range(count):
+        path = os.path.join(directory, 'file %s.sh' % index)
+        with open(path, 'w') as f:
+            f.write('echo %s\n' % index)
+        paths.append(path)
+    return paths
+
+
+def _Sent(result):
+    return sorted([os.path.basename(status.destination) for status in result.files if not status.skipped])
+
+
+def _ClosedPort():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class TransferTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='azuremodules-transfer-')
+        self.source = os.path.join(self.directory, 'source')
+        os.mkdir(self.source)
+        self.files = _MakeFiles(self.source, 6)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def Remote(self, name):
+        path = os.path.join(self.directory, name)
+        os.mkdir(path)
+        return path
+
+    def CheckCopied(self, remote):
+        for path in self.files:
+            with open(path) as local:
+                with open(os.path.join(remote, os.path.basename(path))) as copied:
+                    self.assertEqual(copied.read(), local.read())
+
+
+@unittest.skipIf(sshstub is None, 'paramiko is not installed')
+class SSHConnectionPoolTest(TransferTest):
+    def setUp(self):
+        TransferTest.setUp(self)
+        self.stub = sshstub.SSHStub()
+
+    def tearDown(self):
+        azuremodules.GetSSHConnectionPool().CloseAll()
+        self.stub.Close()
+        TransferTest.tearDown(self)
+
+    def test_transfers_reuse_the_pooled_connection(self):
+        hostIP, hostPassword, hostUsername, hostPort = self.stub.Host()
+        remote = self.Remote('remote')
+        for channels in [1, 4]:
+            result = azuremodules.RemoteUpload(hostIP, hostPassword, hostUsername, hostPort, ','.join(self.files),
+                                               remote, channels=channels)
+            self.assertTrue(result.Succeeded())
+            self.CheckCopied(remote)
+        local = self.Remote('local')
+        remoteFiles = [os.path.join(remote, os.path.basename(path)) for path in self.files]
+        result = azuremodules.RemoteDownload(hostIP, hostPassword, hostUsername, hostPort, ','.join(remoteFiles), local)
+        self.assertTrue(result.Succeeded())
+        self.assertEqual(sorted(os.listdir(local)), sorted([os.path.basename(path) for path in self.files]))
+        self.assertEqual(self.stub.connections, 1)
+
+    def test_bundle_download_rejects_files_with_the_same_name(self):
+        hostIP, hostPassword, hostUsername, hostPort = self.stub.Host()
+        first, second = self.Remote('first'), self.Remote('second')
+        for remote in [first, second]:
+            azuremodules.RemoteUpload(hostIP, hostPassword, hostUsername, hostPort, ','.join(self.files[:2]), remote)
+        local = self.Remote('local')
+        remoteFiles = [os.path.join(first, 'file 0.sh'), os.path.join(second, 'file 0.sh'),
+                       os.path.join(second, 'file 1.sh')]
+        result = azuremodules.RemoteDownload(hostIP, hostPassword, hostUsername, hostPort, ','.join(remoteFiles), local,
+                                             bundle=True)
+        self.assertFalse(result.Succeeded())
+        self.assertEqual(sorted([status.source for status in result.files if status.ok]), remoteFiles[2:])
+        self.assertEqual(len([status for status in result.files if status.error]), 2)
+        self.assertEqual(os.listdir(local), ['file 1.sh'])
+
+    def test_discarded_connection_is_replaced(self):
+        hostIP, hostPassword, hostUsername, hostPort = self.stub.Host()
+        remote = self.Remote('remote')
+        azuremodules.RemoteUpload(hostIP, hostPassword, hostUsername, hostPort, self.files[0], remote)
+        azuremodules.GetSSHConnectionPool().Discard(hostIP, hostPort, hostUsername)
+        result = azuremodules.RemoteUpload(hostIP, hostPassword, hostUsername, hostPort, ','.join(self.files), remote)
+        self.assertTrue(result.Succeeded())
+        self.CheckCopied(remote)
+        self.assertEqual(self.stub.connections, 2)
+
+    def test_wrong_password_is_a_connect_error(self):
+        hostIP, hostPassword, hostUsername, hostPort = self.stub.Host()
+        result = azuremodules.RemoteUpload(hostIP, 'wrong', hostUsername, hostPort, self.files[0], self.Remote('remote'))
+        self.assertFalse(result.Succeeded())
+        self.assertTrue(result.connectError is not None)
+
+
+@unittest.skipIf(sshstub is None, 'paramiko is not installed')
+class RemoteUploadToHostsTest(TransferTest):
+    def setUp(self):
+        TransferTest.setUp(self)
+        self.stubs = [sshstub.SSHStub() for index in range(2)]
+
+    def tearDown(self):
+        azuremodules.GetSSHConnectionPool().CloseAll()
+        for stub in self.stubs:
+            stub.Close()
+        TransferTest.tearDown(self)
+
+    def test_one_unreachable_host(self):
+        #every stub writes to the same local directory, the fan-out keys are what tell the hosts apart
+        remote = self.Remote('remote')
+        badHost = ('127.0.0.1', sshstub.PASSWORD, 'user', _ClosedPort())
+        hosts = [stub.Host() for stub in self.stubs] + [badHost]
+        for mode in ['sftp', 'bundle', 'sync']:
+            fanOut = azuremodules.RemoteUploadToHosts(hosts, ','.join(self.files), remote, mode=mode, retries=1,
+                                                      retryInterval=0)
+            badKey = azuremodules._FanOutKey(badHost)
+            self.assertEqual(fanOut.Failed(), [badKey], mode)
+            self.assertFalse(fanOut.Succeeded())
+            self.assertEqual(len(fanOut.hosts), 3)
+            self.assertEqual(fanOut.attempts[badKey], 2)
+            for host in hosts[:2]:
+                self.assertEqual(fanOut.attempts[azuremodules._FanOutKey(host)], 1)
+            self.assertTrue(fanOut.hosts[badKey].connectError is not None)
+            self.assertEqual(fanOut.ToDict()['failed'], [badKey])
+            self.CheckCopied(remote)
+        for stub in self.stubs:
+            self.assertEqual(stub.connections, 1)
+
+
+@unittest.skipIf(sshstub is None, 'paramiko is not installed')
+class RemoteSyncTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.stub = sshstub.SSHStub()
+
+    @classmethod
+    def tearDownClass(cls):
+        azuremodules.GetSSHConnectionPool().CloseAll()
+        cls.stub.Close()
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='azuremodules-sync-')
+        self.source = os.path.join(self.directory, 'source')
+        self.remote = os.path.join(self.directory, 'remote')
+        os.mkdir(self.source)
+        self.files = _MakeFiles(self.source, 5)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def Sync(self, stub=None, bundle=True):
+        hostIP, hostPassword, hostUsername, hostPort = (stub or self.stub).Host()
+        result = azuremodules.RemoteSync(hostIP, hostPassword, hostUsername, hostPort, ','.join(self.files),
+                                         self.remote, bundle=bundle)
+        self.assertTrue(result.Succeeded())
+        return result
+
+    def test_unchanged_files_are_skipped(self):
+        self.assertEqual(len(_Sent(self.Sync())), 5)
+        with open(self.files[2], 'a') as f:
+            f.write('changed\n')
+        self.assertEqual(_Sent(self.Sync(bundle=False)), ['file 2.sh'])
+        self.assertEqual(_Sent(self.Sync()), [])
+
+    def test_files_deleted_on_the_remote_are_sent_again(self):
+        self.Sync()
+        os.remove(os.path.join(self.remote, 'file 4.sh'))
+        self.assertEqual(_Sent(self.Sync()), ['file 4.sh'])
+        #an empty listing means every file is missing, not that the remote side could not hash them
+        for path in self.files:
+            os.remove(os.path.join(self.remote, os.path.basename(path)))
+        self.assertEqual(len(_Sent(self.Sync())), 5)
+        for path in self.files:
+            self.assertTrue(os.path.isfile(os.path.join(self.remote, os.path.basename(path))))
+
+    def test_everything_is_sent_without_remote_sha256sum(self):
+        self.Sync()
+        emptyPath = os.path.join(self.directory, 'bin')
+        os.mkdir(emptyPath)
+        stub = sshstub.SSHStub(env={'PATH': emptyPath})
+        try:
+            self.assertEqual(len(_Sent(self.Sync(stub, bundle=False))), 5)
+        finally:
+            stub.Close()
+
+
+if __name__ == '__main__':
+    unittest.main()